@@ -17,13 +17,27 @@ The integer / L1 dataset is what is used by the Nearist hardware.
 """
 
 import h5py
+import os
 import sys
 import time
+import VectorFile
 from sklearn.neighbors import KNeighborsClassifier
 
 # The number of neighbors to use for classification.
 k = 10
 
+
+def load_uint8(name):
+    """
+    Load the uint8 vectors 'name' ('X_train' or 'X_test'), from the .nvx file
+    if there is one and from the HDF5 file otherwise.
+    """
+    path = './data/%s_uint8' % name
+    if os.path.exists(path + '.nvx'):
+        return VectorFile.read(path + '.nvx')
+    return h5py.File(path + '.h5', 'r')[name][:]
+
+
 # Load the labels for the training and test vectors. 
 # Note: the slice operator at the end tells h5py how much of the matrix to load
 # into memory, so [:] loads the whole thing.
@@ -96,8 +110,8 @@ print("=========================")
 print("\nLoading dataset...")
 sys.stdout.flush()
 
-X_train = h5py.File('./data/X_train_uint8.h5', 'r')['X_train'][:]
-X_test = h5py.File('./data/X_test_uint8.h5', 'r')['X_test'][:]
+X_train = load_uint8('X_train')
+X_test = load_uint8('X_test')
 
 print("  Training set [%5d x %d]" % (len(X_train), len(X_train[0])))
 print("  Test set     [%5d x %d]" % (len(X_test), len(X_test[0])))
@@ -9,6 +9,7 @@ import time
 import psutil
 import os
 import csv
+import VectorFile
 
 from annoy import AnnoyIndex
 
@@ -64,14 +65,23 @@ print('Memory usage at start %.2fGB' % startMem)
 print('Loading the dataset file...')
 sys.stdout.flush()
 
-h5f = h5py.File(dataset_file, 'r')
-
-# Load the dataset completely into memory--the slice operator at the end tells
-# h5py how much of the matrix to load into memory, [:] loads the whole thing.
-query_vecs = h5f['query_vecs'][:]
-word_vecs = h5f['word_vecs'][:]
-abc_i = h5f['abc_i'][:]
-d_i = h5f['d_i'][:]
+if dataset_file.endswith('_queries.nvx'):
+    # An .nvx file of queries, labelled with the analogy word indices, with
+    # the words file next to it. The vectors are memory mapped.
+    queries = VectorFile.VectorFile(dataset_file)
+    query_vecs = queries.vectors
+    word_vecs = VectorFile.read(dataset_file.replace('_queries.nvx', '_words.nvx'))
+    abc_i = queries.labels[:, 0:3]
+    d_i = queries.labels[:, 3]
+else:
+    h5f = h5py.File(dataset_file, 'r')
+
+    # Load the dataset completely into memory--the slice operator at the end tells
+    # h5py how much of the matrix to load into memory, [:] loads the whole thing.
+    query_vecs = h5f['query_vecs'][:]
+    word_vecs = h5f['word_vecs'][:]
+    abc_i = h5f['abc_i'][:]
+    d_i = h5f['d_i'][:]
 
 print('Loading dataset took %.2fGB extra' % (mem_usage_gb() - startMem))
 sys.stdout.flush()
@@ -9,6 +9,7 @@ import matplotlib
 import numpy as np
 import h5py
 import Transforms
+import VectorFile
 import matplotlib.pyplot as plt
 import seaborn as sns
 sns.set()
@@ -52,6 +53,15 @@ h5f = h5py.File('./data/X_test_uint8.h5', 'w')
 h5f.create_dataset(name='X_test', data=X_test_int)
 h5f.close()
 
+# Also write them as .nvx files, labelled with the digits, which can be
+# memory mapped or sent straight to the appliance with
+# Client.ds_load_from_file.
+y_train = h5py.File('./data/y_train.h5', 'r')['y_train'][:]
+y_test = h5py.File('./data/y_test.h5', 'r')['y_test'][:]
+
+VectorFile.write('./data/X_train_uint8.nvx', X_train_int, labels=y_train)
+VectorFile.write('./data/X_test_uint8.nvx', X_test_int, labels=y_test)
+
 
 
 ###############################################################################
@@ -18,6 +18,7 @@ import h5py
 import gensim
 import numpy as np
 import sys
+import VectorFile
 
 from sys import argv
 
@@ -140,4 +141,9 @@ h5f.create_dataset(name='word_vecs', data=model.syn0norm)
 h5f.create_dataset(name='abc_i', data=analogies[:, 0:3])
 h5f.create_dataset(name='d_i', data=analogies[:, 3])
 
-h5f.close()
\ No newline at end of file
+h5f.close()
+
+# Write the same data as a pair of .nvx files, which can be memory mapped.
+# The analogy word indices (abc_i and d_i) are the labels of the queries.
+VectorFile.write('./data/Google_word2vec_analogies_words.nvx', model.syn0norm)
+VectorFile.write('./data/Google_word2vec_analogies_queries.nvx', query_vecs, labels=analogies[:, 0:4])
\ No newline at end of file
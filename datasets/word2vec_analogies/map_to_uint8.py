@@ -22,6 +22,7 @@ import h5py
 import sys
 import numpy as np
 import Transforms
+import VectorFile
 import seaborn as sns
 sns.set()
 
@@ -96,6 +97,13 @@ h5f_int.create_dataset(name='d_i', data=d_i)
 
 h5f_int.close()
 
+# Write the same data as a pair of .nvx files, which can be memory mapped or
+# sent straight to the appliance with Client.ds_load_from_file. The analogy
+# word indices are the labels of the queries.
+VectorFile.write('./data/Google_word2vec_analogies_uint8_%dstd_words.nvx' % standard_deviations, word_vecs_int)
+VectorFile.write('./data/Google_word2vec_analogies_uint8_%dstd_queries.nvx' % standard_deviations, query_vecs_int,
+                 labels=np.column_stack((abc_i, d_i)))
+
 ###############################################################################
 #   Plot data
 ###############################################################################
@@ -4,6 +4,7 @@ import Common
 
 import time
 import h5py
+import numpy as np
 
 # Connection parameters
 api_key = "apikey"
@@ -83,7 +84,7 @@ def main():
     t0 = time.time()
 
     # Perform the queries.    
-    result_batch = c.query(X_test.tolist(), batch_size=1024)
+    result_batch = c.query(X_test, batch_size=1024)
 
     # Get the total elapsed time (including internet overhead in ms)
     wall_time = (time.time() - t0) * 1000.0
@@ -96,32 +97,19 @@ def main():
     print ('%20s %.0f ms' % ('Average hw latency:', hw_time / len(result_batch)))
     print ('%20s %.0f%%' % ('Internet Overhead:', (wall_time - hw_time) * 100.0 / float(hw_time)))
     
-    numRight = 0
+    # Look up the class of every neighbor at once. Row i of 'result_batch.ids'
+    # holds the dataset indices of the 'k' nearest neighbors of query i.
+    neighbor_classes = y_train[result_batch.ids]
 
-    # For each of the query vectors...
-    for i in range(0, len(result_batch)): 
+    # Tally the class votes for each query.
+    arrNumClass = np.zeros((len(result_batch), 10), dtype=np.int64)
+    np.add.at(arrNumClass, (np.arange(len(result_batch))[:, np.newaxis], neighbor_classes), 1)
 
-        # Get the results for the next query.
-        query_results = result_batch[i]
-        
-        # Reset class tallies
-        arrNumClass = [0] * 10
+    # Choose the winning class by checking which had the most "votes".
+    p = arrNumClass.argmax(axis=1)
 
-        # For each of the 'k' results of the query...
-        for result in query_results:
-
-            # Get the index of the matching dataset vector.
-            ds_id = result['ds_id']
-
-            # Tally the class.
-            arrNumClass[y_train[ds_id]] += 1
-
-        # Choose the winning class by checking which had the most "votes".
-        p = arrNumClass.index(max(arrNumClass))
-
-        # Check if we predicted the right class.
-        if (p == y_test[i]):
-            numRight += 1
+    # Check how many classes we predicted correctly.
+    numRight = int(np.sum(p == y_test))
 
     # Calculate the elapsed time (in seconds)
     elapsed = (time.time() - t0)
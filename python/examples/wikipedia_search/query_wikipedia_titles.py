@@ -94,7 +94,7 @@ c.set_read_count(11)
 def main(query_term):
     # Given a title, retrieve the associated vector and query Nearist server
     query_id = title_to_id[query_term]
-    query_vec = list(vecs[query_id])
+    query_vec = vecs[query_id]
 
     print ('Finding most similar articles to "%s"...' % query_term)
     
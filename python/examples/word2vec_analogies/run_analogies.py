@@ -8,6 +8,7 @@ Created on Thu Sep 28 14:23:41 2017
 import sys
 from Client import *
 import h5py
+import numpy as np
 import time
 
 # NOTE - These values should be updated with the ones you received.
@@ -73,8 +74,6 @@ sys.stdout.flush()
 #    Perform Analogies Test Queries
 ###########################################################################
 
-num_right = 0
-
 print 'Performing all', query_vecs.shape[0], ' queries...'
 sys.stdout.flush()
 
@@ -87,7 +86,7 @@ t0 = time.time()
 # Find the nearest neighbors for all queries in this batch.
 # The query call will break the queries into smaller batches and report
 # progress.
-batch_results = c.query(query_vecs.tolist(), batch_size=500, verbose=True)
+batch_results = c.query(query_vecs, batch_size=500, verbose=True)
 
 # Get the total elapsed time (including internet overhead) in ms.
 wall_time = (time.time() - t0) * 1000.0
@@ -104,30 +103,25 @@ print '%20s %.0f%%' % ('Internet Overhead:', (wall_time - hw_time) * 100.0 / flo
 #    Score the Results
 ###########################################################################
 
-# Score the results.
-for j in range(0, len(batch_results)):
-    
-    # Get the results for query number 'j'.
-    results = batch_results[j]
-
-    assert(len(results) == 4)
-
-    # Check the results. The correct answer is word 'd', but it's possible that
-    # words 'a', 'b', and 'c' will appear in these results--we ignore these and
-    # they don't count against accuracy. However, if any word other than 'a',
-    # 'b', or 'c' is ranked higher than 'd', then the analogy has failed.
-    for r in results:
-       # If we encounter the correct index, we got it right.
-       if r['ds_id'] == d_i[j]:
-           num_right += 1
-           break
-       # If the result is either a, b, or c (the input words used
-       # to form the query), then ignore it.
-       elif r['ds_id'] in abc_i[j, :]:
-           continue
-       # If the result isn't a, b, c, or d, then it's wrong.
-       else:
-           break
+# Row j of 'ids' holds the dataset indices of the top four matches for query j.
+ids = batch_results.ids
+
+assert(ids.shape[1] == 4 and np.all(batch_results.counts == 4))
+
+# Check the results. The correct answer is word 'd', but it's possible that
+# words 'a', 'b', and 'c' will appear in these results--we ignore these and
+# they don't count against accuracy. However, if any word other than 'a',
+# 'b', or 'c' is ranked higher than 'd', then the analogy has failed.
+is_d = ids == d_i[:, np.newaxis]
+is_abc = np.any(ids[:, :, np.newaxis] == abc_i[:, np.newaxis, :], axis=2)
+
+# Find the first result which is either 'd' or not one of 'a', 'b', or 'c'.
+decisive = is_d | ~is_abc
+first = np.argmax(decisive, axis=1)
+
+# The analogy is right if that result is 'd'.
+num_right = int(np.sum(np.any(decisive, axis=1) & is_d[np.arange(len(ids)), first]))
+
 
 # Calculate our accuracy.
 accuracy = float(num_right) / float(query_vecs.shape[0]) * 100.0
@@ -0,0 +1,402 @@
+import asyncio
+import collections
+import json
+
+from Common import *
+from Client import Session, set_keepalive
+import Results
+
+
+class AsyncClient:
+    """
+    asyncio interface for communicating with the Nearist appliances.
+
+    AsyncClient mirrors the Client methods as coroutines and uses the same
+    request and response framing, over a single connection opened with
+    asyncio.open_connection.
+
+    Any number of tasks may await requests on the same AsyncClient at
+    once. Requests are written to the connection as soon as they are made,
+    without waiting for earlier responses, and a reader task hands each
+    response to the request it belongs to (the appliance answers requests
+    in the order they were sent).
+    """
+
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+
+        # The settings made on this connection.
+        self.session = Session()
+
+        # The query mode which requests sent from now on are answered in.
+        # It is set as soon as the request to change it is sent, and the
+        # session once the appliance accepts it.
+        self.__query_mode = self.session.query_mode
+
+        # (future, decode) for each request sent but not yet answered,
+        # oldest first.
+        self.__pending = collections.deque()
+        self.__reader_task = None
+        self.__drain_lock = None
+
+    async def __read_responses(self):
+        """
+        Receives responses and completes the pending requests in order.
+        """
+        try:
+            while True:
+                # Receive 36 bytes (the side of the response message header).
+                buf = await self.reader.readexactly(36)
+
+                # Unpack the response header into a Response object.
+                r = Response()
+                r.unpack_header(buf)
+
+                # Receive the body of this response and its checksum
+                # together. This is done even for errors, so that the next
+                # response is read from the right place.
+                if r.body_length > 0:
+                    buf = await self.reader.readexactly(r.body_length + 4)
+                    r.body = memoryview(buf)[:r.body_length]
+                    r.body_checksum = buf[r.body_length:]
+
+                (future, decode) = self.__pending.popleft()
+
+                if future.cancelled():
+                    continue
+
+                if r.status != Status.SUCCESS:
+                    future.set_exception(SearchError(r.status))
+                    continue
+
+                try:
+                    future.set_result(decode(r))
+                except Exception as e:
+                    future.set_exception(e)
+
+        except Exception:
+            # The connection is gone or out of step, so no more responses
+            # will arrive for the pending requests.
+            pass
+
+        finally:
+            while self.__pending:
+                (future, decode) = self.__pending.popleft()
+                if not future.done():
+                    future.set_exception(IOError("Read error."))
+
+    async def __request(self, request, decode=None):
+        """
+        Send 'request' and wait for its response, which is decoded with
+        'decode' (defaulting to Results.decode in the current query mode).
+        """
+        if decode is None:
+            query_mode = self.__query_mode
+            decode = lambda r: Results.decode(r, query_mode)
+
+        # If the connection is gone, the request would never be answered.
+        if self.__reader_task is None or self.__reader_task.done():
+            raise IOError("Read error.")
+
+        future = asyncio.get_running_loop().create_future()
+
+        # Queue the future and write the request without yielding in
+        # between, so the order of the queue matches the order on the wire.
+        self.__pending.append((future, decode))
+        self.writer.writelines(request.pack_parts())
+
+        async with self.__drain_lock:
+            await self.writer.drain()
+
+        return await future
+
+    def set_keepalive(self, after_idle_sec=7200, interval_sec=75, max_fails=8):
+        set_keepalive(self.writer.get_extra_info('socket'), after_idle_sec, interval_sec, max_fails)
+
+    async def open(self, host, port, api_key):
+        """
+        Open a connection to the Nearist appliance.
+
+        :type host: string
+        :param host: IP address of the Nearist appliance.
+
+        :type port: integer
+        :param port: Port number for accessing the Nearist appliance.
+
+        :type api_key: string
+        :param api_key: Unique user access key which is required to access the
+                    appliance.
+
+        """
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+        self.set_keepalive()
+
+        # Store the API key
+        self.api_key = api_key
+
+        self.__drain_lock = asyncio.Lock()
+        self.__reader_task = asyncio.ensure_future(self.__read_responses())
+
+    async def close(self):
+        """
+        Close the connection to the Nearist appliance.
+        """
+        self.writer.close()
+        await self.writer.wait_closed()
+
+        if self.__reader_task is not None:
+            await self.__reader_task
+
+    async def reset(self):
+        """
+        Reset the Nearist hardware, clearing all stored data.
+        """
+        await self.__request(Request(self.api_key, Command.RESET))
+
+    async def reset_timer(self):
+        """
+        Reset board time measurement timer.
+        """
+        await self.__request(Request(self.api_key, Command.RESET_TIMER))
+
+    async def get_timer_value(self):
+        """
+        Get board time measurement in nanoseconds.
+        """
+        return await self.__request(Request(self.api_key, Command.GET_TIMER))
+
+    async def set_distance_mode(self, mode):
+        """
+        Set the distance metric.
+
+        :type mode: Common.DistanceMode
+        :param mode: Distance metric from Common.DistanceMode
+
+        """
+        await self.__request(Request(self.api_key, Command.DISTANCE_MODE, mode))
+        self.session.distance_mode = mode
+
+    async def set_query_mode(self, mode):
+        """
+        Set query mode
+
+        :type mode: Common.QueryMode
+        :param mode: Query mode from Common.QueryMode
+
+        """
+        # Requests made from now on are decoded in the new mode, unless the
+        # appliance rejects it.
+        self.__query_mode = mode
+        try:
+            await self.__request(Request(self.api_key, Command.QUERY_MODE, mode))
+        except SearchError:
+            if self.__query_mode == mode:
+                self.__query_mode = self.session.query_mode
+            raise
+
+        self.session.query_mode = mode
+
+    async def set_read_count(self, count):
+        """
+        Set query result count for KNN_D/KNN_A query mode(s)
+
+        :type count: integer
+        :param count: The top 'K' values in KNN
+
+        """
+        await self.__request(Request(self.api_key, Command.READ_COUNT, count))
+        self.session.read_count = count
+
+    async def set_threshold(self, threshold):
+        """
+        Set query threshold for GT, LT, or KNN query modes.
+
+        See Client.set_threshold.
+
+        :type threshold: integer
+        :param threshold: The threshold value.
+        """
+        await self.__request(Request(self.api_key, Command.THRESHOLD, threshold))
+        self.session.threshold = (threshold, None)
+
+    async def set_threshold_range(self, threshold_lower, threshold_upper):
+        """
+        Set query threshold for RANGE query mode.
+
+        :type threshold_lower: integer
+        :param threshold_lower: Lower threshold value.
+
+        :type threshold_upper: integer
+        :param threshold_upper: Upper threshold value.
+
+        """
+        await self.__request(Request(self.api_key, Command.THRESHOLD, threshold_lower, threshold_upper))
+        self.session.threshold = (threshold_lower, threshold_upper)
+
+    async def ds_load(self, vectors, component_type=None):
+        """
+        Load dataset to Nearist appliance
+
+        :type vectors: list of lists or numpy.ndarray
+        :param vectors: List of vectors (component lists), or a 2-D array
+                        with one vector per row
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+
+        """
+        vectors, component_type = encode_vectors(vectors, component_type, self.session.distance_mode)
+
+        if vectors.ndim != 2 or vectors.size == 0:
+            raise ValueError('Invalid argument')
+
+        await self.__request(Request(
+            self.api_key,
+            Command.DS_LOAD,
+            attribute_0=vector_length(vectors, component_type),
+            attribute_1=0,
+            body_length=vectors.nbytes,
+            body=vectors,
+            component_type=component_type
+        ))
+
+    async def load_dataset_file(self, file_name, dataset_name, component_type=None):
+        """
+        Load local dataset to Nearist appliance
+
+        :type file_name: string
+        :param file_name: Local dataset file name
+
+        :type dataset_name: string
+        :param dataset_name: Local dataset name
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components stored in the file.
+                               See Client.load_dataset_file.
+
+        """
+        root = {"datasetName": dataset_name, "fileName": file_name}
+        if component_type is not None:
+            root["componentType"] = ComponentType(component_type).name.lower()
+        root = json.dumps(root)
+        await self.__request(Request(
+            self.api_key,
+            Command.DS_LOAD,
+            attribute_0=0,
+            attribute_1=1,
+            body_length=len(root),
+            body=root
+        ))
+
+    async def ds_load_random(self, vector_count, comp_count):
+        """
+        Load random dataset to Nearist appliance
+
+        :type vector_count: integer
+        :param vector_count: Vector count to generate
+
+        :type comp_count: integer
+        :param comp_count: Vector's component count
+
+        """
+        root = json.dumps({"vectorCount": vector_count, "compCount": comp_count})
+        await self.__request(Request(
+            self.api_key,
+            Command.DS_LOAD,
+            attribute_0=0,
+            attribute_1=2,
+            body_length=len(root),
+            body=root
+        ))
+
+    async def query(self, vectors, batch_size=128, verbose=True, window=1, component_type=None):
+        """
+        Query for single/multiple vector(s)
+
+        Takes the same arguments as Client.query, and returns the same
+        results. A batch query is split into mini-batches of 'batch_size'
+        queries, and up to 'window' of them are in flight at once. Other
+        tasks can make requests on the same connection in the meantime.
+        'verbose' is accepted for compatibility with Client.query, and is
+        ignored.
+
+        :type vectors: list, list of lists or numpy.ndarray
+        :param vectors: A single query vector, or a matrix with one query
+                        vector per row.
+
+        :type window: integer
+        :param window: Maximum number of mini-batches to have in flight at
+                       once. A window of 2-4 is enough to keep the
+                       appliance busy.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+
+        """
+        vectors, component_type = encode_vectors(vectors, component_type, self.session.distance_mode)
+
+        # Validate that 'vectors' is a non-empty vector or matrix, and that
+        # the mini-batches can be sent.
+        if vectors.ndim not in (1, 2) or vectors.size == 0 or batch_size <= 0 or window <= 0:
+            raise ValueError('Invalid argument')
+
+        # ======== Single Query ========
+        if vectors.ndim == 1:
+            return await self.__request(Request(
+                self.api_key,
+                Command.QUERY,
+                attribute_0=vector_length(vectors, component_type),     # Length of a vector
+                attribute_1=0,
+                body_length=vectors.nbytes,     # Total payload size
+                body=vectors,
+                component_type=component_type
+            ))
+
+        # ======== Batch Query ========
+        results = Results.ResultCollector(self.__query_mode, len(vectors), self.session.read_count)
+        slots = asyncio.Semaphore(window)
+
+        async def query_mini_batch(start):
+            end = min(start + batch_size, len(vectors))
+            mini_batch = vectors[start:end]
+
+            async with slots:
+                records, indptr = await self.__request(Request(
+                    self.api_key,
+                    Command.QUERY,
+                    attribute_0=vector_length(mini_batch, component_type),  # Length of a vector
+                    attribute_1=1,
+                    body_length=mini_batch.nbytes,      # Total matrix size
+                    body=mini_batch,
+                    component_type=component_type
+                ), Response.unpack_results)
+
+            if not end - start == len(indptr) - 1:
+                raise IOError('Mini batch [%d:%d] returned results for %d queries, expected %d.' %
+                              (start, end, len(indptr) - 1, end - start))
+
+            results.put(start, records, indptr)
+
+        await asyncio.gather(*[query_mini_batch(start) for start in range(0, len(vectors), batch_size)])
+
+        return results.result()
+
+    async def query_from_file(self, file_name, dataset_name, output_name):
+        """
+        Query local dataset to Nearist appliance
+        :param file_name: Local dataset file name
+        :param dataset_name: Local dataset name
+        :param output_name: Results output file name
+        :return:
+        """
+        root = json.dumps({"fileName": file_name, "datasetName": dataset_name, "output": output_name})
+        await self.__request(Request(
+            self.api_key,
+            Command.QUERY,
+            attribute_0=0,
+            attribute_1=2,
+            body_length=len(root),
+            body=root
+        ))
@@ -36,117 +36,388 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import binascii
+import collections
+import concurrent.futures
+import itertools
 import json
+import mmap
+import os
+import queue
+import struct
+
+import numpy as np
 
 from Common import *
+import Results
+import VectorFile
 import socket
 import sys
+import threading
 import time
 
+
+def set_keepalive(sock, after_idle_sec=7200, interval_sec=75, max_fails=8):
+    """
+    Enable TCP keepalive on 'sock', using the platform specific options.
+    """
+    if sys.platform == 'linux':
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, after_idle_sec)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval_sec)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, max_fails)
+    elif sys.platform == 'darwin':
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.setsockopt(socket.IPPROTO_TCP, 0x10, interval_sec)
+    elif sys.platform == 'win32':
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, after_idle_sec * 1000, interval_sec * 1000))
+
+
+def send_buffers(sock, buffers):
+    """
+    Send all of 'buffers' (bytes-like objects) on 'sock', one after
+    another, without joining them into one buffer. Scatter-gather I/O
+    (socket.sendmsg) is used where the platform has it, so the buffers are
+    never copied.
+    """
+    if not hasattr(sock, 'sendmsg'):
+        for buf in buffers:
+            sock.sendall(buf)
+        return
+
+    views = collections.deque(memoryview(buf).cast('B') for buf in buffers if len(buf) > 0)
+
+    while views:
+        sent = sock.sendmsg(views)
+
+        # Drop the buffers which were sent completely, and the part of the
+        # first buffer which was sent.
+        while sent > 0:
+            if sent >= len(views[0]):
+                sent -= len(views[0])
+                views.popleft()
+            else:
+                views[0] = views[0][sent:]
+                sent = 0
+
+
+def read_batches(source, batch_size):
+    """
+    Read 'source' in blocks of 'batch_size' rows; the last block may be
+    shorter.
+
+    'source' is a 2-D array-like (numpy.ndarray, numpy.memmap, h5py.Dataset
+    or VectorFile.VectorFile), which is read by slicing rows, so only one
+    block is read into memory at a time. Otherwise it is an iterable of
+    vectors or of 2-D blocks of rows, which are regrouped into blocks of
+    'batch_size' rows.
+    """
+    if hasattr(source, 'shape') and len(source.shape) == 2:
+        for start in range(0, source.shape[0], batch_size):
+            yield source[start:start + batch_size]
+        return
+
+    pending = []
+    pending_rows = 0
+
+    for block in source:
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block.reshape(1, -1)
+
+        pending.append(block)
+        pending_rows += len(block)
+
+        while pending_rows >= batch_size:
+            rows = np.concatenate(pending) if len(pending) > 1 else pending[0]
+            yield rows[:batch_size]
+            pending = [rows[batch_size:]]
+            pending_rows = len(pending[0])
+
+    if pending_rows > 0:
+        yield np.concatenate(pending)
+
+
+class Session:
+    """
+    The settings made on a connection to the appliance.
+
+    A Session records the distance mode, query mode, read count and
+    threshold set on a connection, so that the same settings can be applied
+    to other connections. Its set_* methods have the same signatures as the
+    Client methods, and only record the setting.
+    """
+
+    def __init__(self):
+        self.distance_mode = DistanceMode.NO_DISTANCE_MODE
+        self.query_mode = QueryMode.NO_QUERY_MODE
+        self.read_count = None
+
+        # (threshold, None) for set_threshold, or (lower, upper) for
+        # set_threshold_range.
+        self.threshold = None
+
+    def set_distance_mode(self, mode):
+        self.distance_mode = mode
+
+    def set_query_mode(self, mode):
+        self.query_mode = mode
+
+    def set_read_count(self, count):
+        self.read_count = count
+
+    def set_threshold(self, threshold):
+        self.threshold = (threshold, None)
+
+    def set_threshold_range(self, threshold_lower, threshold_upper):
+        self.threshold = (threshold_lower, threshold_upper)
+
+    def copy(self):
+        """
+        Returns a copy of this Session.
+        """
+        session = Session()
+        session.__dict__.update(self.__dict__)
+        return session
+
+    def apply(self, client):
+        """
+        Make these settings on 'client'.
+        """
+        if self.distance_mode != DistanceMode.NO_DISTANCE_MODE:
+            client.set_distance_mode(self.distance_mode)
+
+        if self.query_mode != QueryMode.NO_QUERY_MODE:
+            client.set_query_mode(self.query_mode)
+
+        if self.read_count is not None:
+            client.set_read_count(self.read_count)
+
+        if self.threshold is not None:
+            (lower, upper) = self.threshold
+            if upper is None:
+                client.set_threshold(lower)
+            else:
+                client.set_threshold_range(lower, upper)
+
+
 class Client:
     """
     This class provides the Python interface for communicating with the Nearist appliances.
 
     Commands are communicated via TCP/IP to the appliance server.
+
+    If the appliance responds with an error status, a SearchError is raised
+    and the connection stays usable. If the connection itself fails (any
+    other IOError), the client reconnects to the same appliance, waiting
+    'retry_delay' seconds before the first attempt and twice as long before
+    each further one, makes the same settings on the new connection, and
+    sends the failed requests again. After 'max_retries' failed attempts,
+    the IOError is raised. Datasets loaded with ds_load_stream or
+    ds_load_from_file aren't sent again if their upload fails.
     """
 
-    def __init__(self):
+    RECV_BUFFER_SIZE = 1 << 16
+    """
+    Initial size of the receive buffer. The buffer grows to fit the largest
+    response received on the connection.
+    """
+
+    def __init__(self, max_retries=3, retry_delay=0.5, reload_dataset=False, timeout=None):
+        """
+        :type max_retries: integer
+        :param max_retries: Number of times to reconnect after the connection
+                            fails, before giving up. 0 disables reconnecting.
+
+        :type retry_delay: float
+        :param retry_delay: Seconds to wait before the first attempt to
+                            reconnect.
+
+        :type reload_dataset: bool
+        :param reload_dataset: Whether to load the dataset again after
+                               reconnecting (see reconnect). It's only needed
+                               if the appliance itself was restarted.
+
+        :type timeout: float
+        :param timeout: Seconds to wait for each socket operation (connecting,
+                        or sending or receiving some data), or None to wait
+                        indefinitely. A timeout is a failed connection.
+        """
         self.sock = None
-        
-    @staticmethod
-    def __recvall(sock, length):
+
+        # The settings made on this connection.
+        self.session = Session()
+
+        # The address connected to, and the dataset loaded, as
+        # (method, args, kwargs), for reconnect.
+        self.address = None
+        self.dataset_load = None
+
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.reload_dataset = reload_dataset
+        self.timeout = timeout
+
+        # Whether the client is reconnecting, so the requests which make
+        # the settings again aren't retried themselves.
+        self.__recovering = False
+
+        # Receive buffer, reused for every response on the connection.
+        # Bytes [__start, __end) have been received but not yet consumed.
+        self.__buffer = memoryview(bytearray(Client.RECV_BUFFER_SIZE))
+        self.__start = 0
+        self.__end = 0
+
+    def __recvall(self, length):
         # Helper function to recv 'length' bytes or return None if EOF is hit.
-        data = bytearray()
+        # Returns a view into the receive buffer, which is only valid until
+        # the next call.
 
-        # Loop until we've received 'length' bytes.        
-        while len(data) < length:
+        # If everything received so far has been consumed, start over at the
+        # front of the buffer.
+        if self.__start == self.__end:
+            self.__start = self.__end = 0
 
-            # Receive the remaining bytes. The amount of data returned might
-            # be less than 'length'.
-            packet = sock.recv(length - len(data))
+        if self.__end - self.__start < length:
+            # If 'length' bytes won't fit after the unconsumed bytes, move
+            # them to the front of the buffer. If the buffer is too small,
+            # replace it with a larger one (rather than resizing it, which
+            # isn't possible while views of it exist).
+            if self.__start + length > len(self.__buffer):
+                pending = bytes(self.__buffer[self.__start:self.__end])
 
-            # If we received 0 bytes, the connection has been closed...            
-            if not packet:
-                return None
+                if length > len(self.__buffer):
+                    self.__buffer = memoryview(bytearray(max(length, 2 * len(self.__buffer))))
 
-            # Append the received bytes to 'data'.    
-            data += packet
+                self.__buffer[:len(pending)] = pending
+                self.__start, self.__end = 0, len(pending)
+
+            # Loop until we've received 'length' bytes.
+            while self.__end - self.__start < length:
+
+                # Receive as much as fits in the buffer. This might include
+                # the start of the next response, which is kept for the next
+                # call.
+                received = self.sock.recv_into(self.__buffer[self.__end:])
+
+                # If we received 0 bytes, the connection has been closed...
+                if received == 0:
+                    return None
+
+                self.__end += received
 
         # Return the 'length' bytes of received data.
+        data = self.__buffer[self.__start:self.__start + length]
+        self.__start += length
         return data
 
-    def __on_request_complete(self, request):
+    def __receive(self):
         """
-        Receives the response from the appliance.
+        Receives the next response from the appliance.
+
+        The body of the returned Response is a view into the receive buffer,
+        which is only valid until the next response is received.
         """
 
         # Receive 36 bytes (the side of the response message header).
-        buf = Client.__recvall(self.sock, 36)
+        buf = self.__recvall(36)
 
-        if buf is not None:
+        if buf is None:
+            raise IOError("Read error.")
 
-            # Unpack the response header into a Response object.
-            r = Response()
-            r.unpack_header(buf)
+        # Unpack the response header into a Response object.
+        r = Response()
+        r.unpack_header(buf)
 
-            if r.status != Status.SUCCESS:
-                raise IOError("Nearist error: %s " % Status(r.status))
-            else:
-                results = []
-
-                # If there is data to receive for this response...
-                if r.body_length > 0:
-                    # Receive the body of this response.
-                    r.body = Client.__recvall(self.sock, r.body_length)
-                    r.body_checksum = Client.__recvall(self.sock, 4)
-                    if r.body is not None:
-                        length = r.body_length >> 3
-                        if length > 0:
-                            body = struct.unpack_from(("=" + ("Q" * length)), r.body, 0)
-
-                            if r.attribute_1 == 0:
-                                for i in range(0, length, 2):
-                                    if body[i] != 0xFFFFFFFFFFFFFFFF and body[i + 1] != 0xFFFFFFFFFFFFFFFF:
-                                        results.append({'ds_id': body[i], 'distance': body[i + 1]})
-                                    else:
-                                        break
-                            elif r.attribute_1 == 1:
-                                result = []
-                                for i in range(0, length, 2):
-                                    if body[i] != 0xFFFFFFFFFFFFFFFF and body[i + 1] != 0xFFFFFFFFFFFFFFFF:
-                                        result.append({'ds_id': body[i], 'distance': body[i + 1]})
-                                    else:
-                                        results.append(result)
-                                        result = []
-                    else:
-                        raise IOError("Read error.")
-                else:
-                    results = r.attribute_0
-        else:
-            raise IOError("Read error.")
+        # If there is data to receive for this response...
+        if r.body_length > 0:
+            # Receive the body of this response and its checksum together.
+            # This is done even for errors, so that the next response is
+            # read from the right place.
+            buf = self.__recvall(r.body_length + 4)
 
-        return results
+            if buf is None:
+                raise IOError("Read error.")
 
-    def __request(self, request):
-        # 'sendall' will send all bytes in the request before returning.        
-        status = self.sock.sendall(request.pack())
+            r.body = buf[:r.body_length]
+            r.body_checksum = buf[r.body_length:]
+
+        if r.status != Status.SUCCESS:
+            raise SearchError(r.status)
 
-        # If the request was sent successfully... 
-        # ('sendall' returns None if successful.)
-        if status is None:
-            return self.__on_request_complete(request)
+        return r
+
+    def __drain(self, count):
+        """
+        Receives and discards the responses to 'count' requests which have
+        been sent, so that the next response received is for the next
+        request. If the connection fails, it is closed, to be reopened by
+        the next request.
+        """
+        for _ in range(count):
+            try:
+                self.__receive()
+            except SearchError:
+                pass
+            except IOError:
+                self.sock.close()
+                return
+
+    def __recover(self, error, failures):
+        """
+        Handles the failure of the connection with IOError 'error', after
+        'failures' earlier attempts to reconnect: closes the socket, and
+        either raises 'error' if there have been 'max_retries' attempts, or
+        waits and reconnects. A failed attempt is left to make the next
+        request fail. Returns the number of attempts made.
+        """
+        try:
+            self.sock.close()
+        except (OSError, AttributeError):
+            pass
+
+        if self.__recovering or self.address is None or failures >= self.max_retries:
+            raise error
+
+        failures += 1
+        time.sleep(self.retry_delay * 2 ** (failures - 1))
+
+        self.__recovering = True
+        try:
+            self.reconnect(self.reload_dataset)
+        except IOError:
+            pass
+        finally:
+            self.__recovering = False
+
+        return failures
+
+    def __on_request_complete(self, request):
+        """
+        Receives the response from the appliance and decodes its results.
+        """
+        return Results.decode(self.__receive(), self.session.query_mode)
+
+    def __send(self, request):
+        # Send the header, body and checksum straight from their buffers.
+        send_buffers(self.sock, request.pack_parts())
+
+    def __request(self, request):
+        # Send the request, then wait for its response. If the connection
+        # fails, reconnect and send it again.
+        failures = 0
+
+        while True:
+            try:
+                self.__send(request)
+                return self.__on_request_complete(request)
+            except SearchError:
+                raise
+            except IOError as e:
+                failures = self.__recover(e, failures)
 
     def set_keepalive(self, after_idle_sec=7200, interval_sec=75, max_fails=8):
-        if sys.platform == 'linux':
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, after_idle_sec)
-            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval_sec)
-            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, max_fails)
-        elif sys.platform == 'darwin':
-            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-            self.sock.setsockopt(socket.IPPROTO_TCP, 0x10, interval_sec)
-        elif sys.platform == 'win32':
-            self.sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, after_idle_sec * 1000, interval_sec * 1000))
+        set_keepalive(self.sock, after_idle_sec, interval_sec, max_fails)
 
     def open(self, host, port, api_key):
         """
@@ -171,13 +442,18 @@ class Client:
         # Create a new socket (the host and port are specified in 'connect').
         self.sock = socket.socket(address_info[0][0], socket.SOCK_STREAM)
 
+        # Discard anything left in the receive buffer by a previous socket.
+        self.__start = self.__end = 0
+
         self.set_keepalive()
+        self.sock.settimeout(self.timeout)
 
         # Connect to the host.
         self.sock.connect((host, port))
 
         # Store the API key        
         self.api_key = api_key
+        self.address = (host, port)
 
     def close(self):
         """
@@ -185,6 +461,38 @@ class Client:
         """
         self.sock.close()
 
+    def reconnect(self, reload_dataset=True):
+        """
+        Open a new connection to the appliance this client last opened,
+        after the connection has failed, and make the same settings on it.
+
+        The distance mode, query mode, read count and threshold are set
+        again from 'session'. The dataset is loaded again the same way it
+        was loaded (see 'dataset_load'), except for a dataset streamed from
+        an iterator by ds_load_stream, which can't be read twice.
+
+        :type reload_dataset: bool
+        :param reload_dataset: Whether to load the dataset again. The
+                               appliance may still hold it, if only the
+                               connection failed.
+        """
+        if self.address is None:
+            raise ValueError('Invalid argument')
+
+        try:
+            self.sock.close()
+        except (OSError, AttributeError):
+            pass
+
+        (host, port) = self.address
+        self.open(host, port, self.api_key)
+
+        self.session.copy().apply(self)
+
+        if reload_dataset and self.dataset_load is not None:
+            (method, args, kwargs) = self.dataset_load
+            method(*args, **kwargs)
+
     def reset(self):
         """
         Reset the Nearist hardware, clearing all stored data.
@@ -193,6 +501,7 @@ class Client:
         # Create and submit a reset request.
         request = Request(self.api_key, Command.RESET)
         self.__request(request)
+        self.dataset_load = None
 
     def reset_timer(self):
         """
@@ -227,6 +536,8 @@ class Client:
         )
         self.__request(request)
 
+        self.session.distance_mode = mode
+
     def set_query_mode(self, mode):
         """
         Set query mode
@@ -243,6 +554,9 @@ class Client:
         )
         self.__request(request)
 
+        # The query mode determines how batch results are returned.
+        self.session.query_mode = mode
+
     def set_read_count(self, count):
         """
         Set query result count for KNN_D/KNN_A query mode(s)
@@ -259,6 +573,9 @@ class Client:
         )
         self.__request(request)
 
+        # The read count determines the width of batch results.
+        self.session.read_count = count
+
     def set_threshold(self, threshold):
         """
         Set query threshold for GT, LT, or KNN query modes.
@@ -278,7 +595,9 @@ class Client:
             Command.THRESHOLD,
             threshold
         )
-        self.__request(request)        
+        self.__request(request)
+
+        self.session.threshold = (threshold, None)
         
     def set_threshold_range(self, threshold_lower, threshold_upper):
         """
@@ -299,32 +618,305 @@ class Client:
         )
         self.__request(request)
 
-    def ds_load(self, vectors):
+        self.session.threshold = (threshold_lower, threshold_upper)
+
+    def ds_load(self, vectors, component_type=None):
         """
         Load dataset to Nearist appliance
         
-        :type vectors: 
-        :param vectors: List of vectors (component lists)
-
-        """
-
-        if isinstance(vectors, list):
-            if isinstance(vectors[0], list):
-                request = Request(
-                    self.api_key,
-                    Command.DS_LOAD,
-                    attribute_0=len(vectors[0]),
-                    attribute_1=0,
-                    body_length=len(vectors) * (len(vectors[0])),
-                    body=vectors
-                )
-                self.__request(request)
-            else:
+        :type vectors: list of lists or numpy.ndarray
+        :param vectors: List of vectors (component lists), or a 2-D array
+                        with one vector per row. A boolean array is sent
+                        packed eight components to a byte if the distance
+                        mode is a bit metric (see Common.encode_vectors).
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. By default, uint16
+                               and uint32 arrays are sent with their own
+                               width and anything else as uint8 (see
+                               Common.as_components). ComponentType.BIT
+                               sends packed bits.
+
+        """
+
+        # Keep the arguments (not the converted copy), to reload the dataset
+        # on reconnect.
+        dataset_load = (self.ds_load, (vectors, component_type), {})
+
+        vectors, component_type = encode_vectors(vectors, component_type, self.session.distance_mode)
+
+        if vectors.ndim != 2 or vectors.size == 0:
+            raise ValueError('Invalid argument')
+
+        request = Request(
+            self.api_key,
+            Command.DS_LOAD,
+            attribute_0=vector_length(vectors, component_type),
+            attribute_1=0,
+            body_length=vectors.nbytes,
+            body=vectors,
+            component_type=component_type
+        )
+        self.__request(request)
+        self.dataset_load = dataset_load
+
+    def ds_load_stream(self, source, n_vectors=None, chunk_size=1 << 24, component_type=None, verbose=True):
+        """
+        Load a dataset to Nearist appliance in chunks, so the dataset never
+        needs to be in memory all at once.
+
+        The length of the dataset is sent first, and then the chunks are
+        sent as they are read, with the body checksum updated as each one
+        goes. Only about one chunk is held in memory at a time.
+
+        If an iterable of blocks doesn't produce exactly 'n_vectors' vectors
+        of the same length and type, the request can't be completed, so the
+        connection is closed and IOError is raised.
+
+        :type source: numpy.ndarray, numpy.memmap, h5py.Dataset, VectorFile.VectorFile or iterable
+        :param source: A 2-D array-like with one vector per row, which is
+                       read 'chunk_size' bytes at a time by slicing rows, or
+                       an iterable of 2-D blocks of rows.
+
+        :type n_vectors: integer
+        :param n_vectors: Total number of vectors. Required if 'source' is
+                          an iterable of blocks.
+
+        :type chunk_size: integer
+        :param chunk_size: Approximate size of the chunks read from an
+                           array-like 'source', in bytes.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See ds_load. A
+                               VectorFile's own component type is used by
+                               default.
+
+        :type verbose: bool
+        :param verbose: Whether to print the progress and throughput.
+
+        :rtype: float
+        :return: The upload throughput, in bytes per second.
+        """
+
+        if component_type is None:
+            component_type = getattr(source, 'component_type', None)
+
+        if hasattr(source, 'shape') and len(source.shape) == 2:
+            n_vectors = source.shape[0]
+            rows = max(1, chunk_size // max(1, source.shape[1] * np.dtype(source.dtype).itemsize))
+            blocks = (source[start:start + rows] for start in range(0, n_vectors, rows))
+        elif n_vectors is not None:
+            blocks = iter(source)
+        else:
+            raise ValueError('Invalid argument')
+
+        blocks = (encode_vectors(block, component_type, self.session.distance_mode) for block in blocks)
+
+        # The first block sets the vector length and component type.
+        (first, first_type) = next(blocks, (None, None))
+        if first is None or first.ndim != 2 or n_vectors == 0:
+            raise ValueError('Invalid argument')
+
+        row_bytes = first.shape[1] * first.itemsize
+
+        request = Request(
+            self.api_key,
+            Command.DS_LOAD,
+            attribute_0=vector_length(first, first_type),
+            attribute_1=0,
+            body_length=n_vectors * row_bytes,
+            component_type=first_type
+        )
+
+        try:
+            # Send the header on its own, with the full body length.
+            send_buffers(self.sock, request.pack_parts())
+
+            checksum = 0
+            sent = 0
+            t0 = time.time()
+
+            for (block, block_type) in itertools.chain([(first, first_type)], blocks):
+                if block.ndim != 2 or block_type != first_type or block.shape[1] != first.shape[1] or \
+                        sent + len(block) > n_vectors:
+                    raise IOError('Dataset block at vector %d does not match the dataset (%d vectors of %d bytes).' %
+                                  (sent, n_vectors, row_bytes))
+
+                body = memoryview(block.reshape(-1).view(np.uint8))
+                checksum = binascii.crc32(body, checksum)
+                send_buffers(self.sock, [body])
+                sent += len(block)
+
+                if verbose:
+                    elapsed = max(time.time() - t0, 1E-9)
+                    print('  Uploaded %7d / %7d vectors (%3.0f%%) %.1f MB/s' %
+                          (sent, n_vectors, float(sent) / n_vectors * 100.0, sent * row_bytes / elapsed / 1E6))
+                    sys.stdout.flush()
+
+            if sent != n_vectors:
+                raise IOError('Dataset stream ended after %d vectors, expected %d.' % (sent, n_vectors))
+
+            # Finish the body with its checksum, and wait for the response.
+            send_buffers(self.sock, [struct.pack("=L", checksum & 0xFFFFFFFF)])
+            elapsed = max(time.time() - t0, 1E-9)
+
+        except BaseException:
+            # A body cut short would be taken for the start of the next
+            # request, so the connection is closed, and the next request
+            # reconnects.
+            self.close()
+            raise
+
+        self.__on_request_complete(request)
+
+        # Only an array-like can be read again, to reload the dataset.
+        self.dataset_load = None
+        if hasattr(source, 'shape'):
+            self.dataset_load = (self.ds_load_stream, (source,),
+                                 {"chunk_size": chunk_size, "component_type": first_type, "verbose": False})
+
+        return n_vectors * row_bytes / elapsed
+
+    def ds_load_from_file(self, path, dims=None, offset=0, n_vectors=None, component_type=ComponentType.UINT8,
+                          threads=4):
+        """
+        Load a dataset to Nearist appliance from a raw binary file or an
+        .nvx file on this host.
+
+        The file holds the vectors row after row, in the layout of the
+        request body (see Common.ComponentType), starting at 'offset'. The
+        body is sent with socket.sendfile, which moves it from the file to
+        the socket inside the kernel where the platform supports it. While
+        it is being sent, the body checksum is computed over a memory map of
+        the file, in one piece per thread (see Common.crc32_combine).
+
+        For an .nvx file (see VectorFile), the layout is read from its
+        header instead of the arguments, and the checksum stored in the file
+        is sent, so the file isn't read by the client at all.
+
+        To load a file on the appliance's own disk, use load_dataset_file.
+
+        :type path: string
+        :param path: Name of the file.
+
+        :type dims: integer
+        :param dims: Number of components in each vector (in bits, for
+                     ComponentType.BIT). Required unless 'path' is an .nvx
+                     file.
+
+        :type offset: integer
+        :param offset: Position of the first vector in the file, in bytes.
+
+        :type n_vectors: integer
+        :param n_vectors: Number of vectors to load. By default, every vector
+                          from 'offset' to the end of the file is loaded.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Format of the components in the file.
+
+        :type threads: integer
+        :param threads: Number of threads to compute the checksum with.
+
+        """
+
+        checksum = None
+
+        if path.endswith('.nvx'):
+            header = VectorFile.VectorFile(path)
+            if header.component_type is None:
+                raise ValueError('%s holds %s vectors, which the appliance does not support.' %
+                                 (path, header.dtype.name))
+
+            # Packed bits are sent as whole bytes.
+            (component_type, row_bytes) = (header.component_type, header.row_bytes)
+            dims = row_bytes * 8 if header.packed else header.dims
+            (offset, n_vectors) = (header.vectors_offset, header.count)
+            checksum = header.vectors_crc
+            header.close()
+
+        elif dims is None or dims <= 0:
+            raise ValueError('Invalid argument')
+
+        elif component_type == ComponentType.BIT:
+            if dims % 8 != 0:
                 raise ValueError('Invalid argument')
+            row_bytes = dims // 8
         else:
+            row_bytes = dims * COMPONENT_DTYPES[component_type].itemsize
+
+        file_size = os.path.getsize(path)
+
+        if n_vectors is None:
+            if row_bytes == 0 or (file_size - offset) % row_bytes != 0:
+                raise ValueError('File size is not a whole number of %d byte vectors.' % row_bytes)
+            n_vectors = (file_size - offset) // row_bytes
+
+        body_length = n_vectors * row_bytes
+        if body_length <= 0 or offset < 0 or offset + body_length > file_size:
             raise ValueError('Invalid argument')
 
-    def load_dataset_file(self, file_name, dataset_name):
+        request = Request(
+            self.api_key,
+            Command.DS_LOAD,
+            attribute_0=dims,
+            attribute_1=0,
+            body_length=body_length,
+            component_type=component_type
+        )
+
+        if checksum is not None:
+            try:
+                send_buffers(self.sock, request.pack_parts())
+                with open(path, 'rb') as f:
+                    self.sock.sendfile(f, offset, body_length)
+
+                send_buffers(self.sock, [struct.pack("=L", checksum)])
+            except BaseException:
+                # Don't leave a body cut short on the connection.
+                self.close()
+                raise
+
+            self.__on_request_complete(request)
+            self.dataset_load = (self.ds_load_from_file, (path,), {"threads": threads})
+            return
+
+        with open(path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+
+            # Start computing the checksum of each piece of the body.
+            body = memoryview(mapping)[offset:offset + body_length]
+            piece_size = -(-body_length // threads)
+            pieces = [body[start:start + piece_size] for start in range(0, body_length, piece_size)]
+            futures = [executor.submit(binascii.crc32, piece) for piece in pieces]
+
+            try:
+                # Send the header, and then the body straight from the file.
+                send_buffers(self.sock, request.pack_parts())
+                self.sock.sendfile(f, offset, body_length)
+
+                checksum = 0
+                for (piece, future) in zip(pieces, futures):
+                    checksum = crc32_combine(checksum, future.result(), len(piece))
+
+            except BaseException:
+                # Don't leave a body cut short on the connection.
+                self.close()
+                raise
+
+            finally:
+                # The memory map can only be closed once the views of it are
+                # released.
+                concurrent.futures.wait(futures)
+                for piece in pieces:
+                    piece.release()
+                body.release()
+
+        send_buffers(self.sock, [struct.pack("=L", checksum & 0xFFFFFFFF)])
+        self.__on_request_complete(request)
+        self.dataset_load = (self.ds_load_from_file, (path, dims, offset, n_vectors, component_type, threads), {})
+
+    def load_dataset_file(self, file_name, dataset_name, component_type=None):
         """
         Load local dataset to Nearist appliance
         
@@ -334,9 +926,17 @@ class Client:
         :type dataset_name: string
         :param dataset_name: Local dataset name
 
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components stored in the file.
+                               If given, it is sent as "componentType" so
+                               the appliance can check the file against it.
+
         """
 
-        root = json.dumps({"datasetName": dataset_name, "fileName": file_name})
+        root = {"datasetName": dataset_name, "fileName": file_name}
+        if component_type is not None:
+            root["componentType"] = ComponentType(component_type).name.lower()
+        root = json.dumps(root)
         request = Request(
             self.api_key,
             Command.DS_LOAD,
@@ -346,6 +946,7 @@ class Client:
             body=root
         )
         self.__request(request)
+        self.dataset_load = (self.load_dataset_file, (file_name, dataset_name, component_type), {})
 
     def ds_load_random(self, vector_count, comp_count):
         """
@@ -369,30 +970,59 @@ class Client:
             body=root
         )
         self.__request(request)
+        self.dataset_load = (self.ds_load_random, (vector_count, comp_count), {})
 
-    def query(self, vectors, batch_size=128, verbose=True):
+    def query(self, vectors, batch_size=128, verbose=True, window=1, component_type=None):
         """
         Query for single/multiple vector(s)
 
-        :type vectors: list or list of lists
-        :param vectors: List of components for single query / List of vectors (component lists) for multipel query
+        :type vectors: list, list of lists or numpy.ndarray
+        :param vectors: List of components for single query / List of vectors (component lists) for multipel query.
+                        A 1-D array is a single query and a 2-D array holds one query vector per row.
+
+        :type window: integer
+        :param window: Maximum number of mini-batches to have in flight at
+                       once. With a window larger than 1, the next
+                       mini-batches are sent while the appliance is still
+                       working on earlier ones, hiding the network round
+                       trip. A small window (2-4) is enough to keep the
+                       appliance busy.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components, as for ds_load.
+
+        The results of a single query are returned as a structured array of
+        Common.RESULT_DTYPE, so each result can be indexed as
+        result['ds_id'] and result['distance']. A batch query returns a
+        Results.ResultSet, which holds one such array per query vector and
+        exposes all of the IDs and distances as (n_queries, k) arrays. In the
+        GT, LT, EQ and RANGE query modes, where the number of results varies
+        from query to query, a batch query returns a Results.SparseResultSet
+        holding the results in compressed sparse row form instead.
 
         """
-        # Validate that 'vectors' is a list.
-        if not isinstance(vectors, list):
+
+        # Convert the query vector(s) to the component format once, up front. Each
+        # mini-batch below is then just a view of rows in this matrix.
+        vectors, component_type = encode_vectors(vectors, component_type, self.session.distance_mode)
+
+        # Validate that 'vectors' is a non-empty vector or matrix, and that
+        # the mini-batches can be sent.
+        if vectors.ndim not in (1, 2) or vectors.size == 0 or batch_size <= 0 or window <= 0:
             raise ValueError('Invalid argument')
 
         # ======== Single Query ========
         # If 'vectors' is just a single query vector...
-        if not isinstance(vectors[0], list):
+        if vectors.ndim == 1:
             # Construct the query request.
             request = Request(
                 self.api_key,
                 Command.QUERY,
-                attribute_0=len(vectors),       # Length of a vector
+                attribute_0=vector_length(vectors, component_type),     # Length of a vector
                 attribute_1=0,
-                body_length=len(vectors),       # Total payload size
-                body=vectors
+                body_length=vectors.nbytes,     # Total payload size
+                body=vectors,
+                component_type=component_type
             )
 
             # Issue the query and return the results.
@@ -404,62 +1034,406 @@ class Client:
         # the results.
 
         start = 0
-        results = []
+
+        # The results of each mini-batch are written straight into the
+        # output at the mini-batch's offset.
+        results = Results.ResultCollector(self.session.query_mode, len(vectors), self.session.read_count)
+
+        # The (start, end) offsets and requests of the mini-batches which
+        # have been sent but whose results haven't been received yet, oldest
+        # first. If the connection fails, they are sent again.
+        in_flight = collections.deque()
+        failures = 0
+        resend = False
 
         # Record the start time.
         t0 = time.time()
 
-        # For each mini-batch...
-        while start < len(vectors):
-            # Calculate the 'end' of this mini-batch.
-            end = min(start + batch_size, len(vectors))
+        # Until every mini-batch has been sent and its results received...
+        while start < len(vectors) or in_flight:
+            try:
+                # After reconnecting, send the mini-batches in flight again.
+                if resend:
+                    resend = False
+                    for (_, _, request) in in_flight:
+                        self.__send(request)
+
+                # Send mini-batches until 'window' of them are in flight.
+                while start < len(vectors) and len(in_flight) < window:
+                    # Calculate the 'end' of this mini-batch.
+                    end = min(start + batch_size, len(vectors))
+
+                    # Select the vectors in this mini-batch.
+                    mini_batch = vectors[start:end]
+
+                    # Progress update.
+                    if verbose and not start == 0:
+                        # Caclulate the average throughput so far.
+                        queries_per_sec = ((time.time() - t0)  / start)
+
+                        # Estimate how much time (in minutes) is left to complete the
+                        # test.
+                        time_est = queries_per_sec * (len(vectors) - start) / 60.0
+
+                        # Format the estimated time remaining into minutes.
+                        # If it's less than 1 minute, show <1 instead of 0.
+                        if time_est < 1:
+                            time_est_str = '<1 min...'
+                        else:
+                            time_est_str = '~%.0f min...' % time_est
+
+                        print ('  Query %5d / %5d (%3.0f%%) Time Remaining: %s' % (start, len(vectors), float(start) / len(vectors) * 100.0, time_est_str))
+                        sys.stdout.flush()
+
+                    # Construct the query request.
+                    request = Request(
+                        self.api_key,
+                        Command.QUERY,
+                        attribute_0=vector_length(mini_batch, component_type),  # Length of a vector
+                        attribute_1=1,
+                        body_length=mini_batch.nbytes,      # Total matrix size
+                        body=mini_batch,
+                        component_type=component_type
+                    )
+
+                    # Submit the query without waiting for the results.
+                    self.__send(request)
+                    in_flight.append((start, end, request))
+
+                    # Update the start pointer.
+                    start = end
+
+                # Wait for the results of the oldest mini-batch. The appliance
+                # answers requests in the order they were sent.
+                response = self.__receive()
+                (batch_start, batch_end, request) = in_flight.popleft()
+                failures = 0
+
+            except SearchError:
+                # The error is the response to the oldest mini-batch. The
+                # responses to the others must still be received.
+                in_flight.popleft()
+                self.__drain(len(in_flight))
+                raise
+
+            except IOError as e:
+                failures = self.__recover(e, failures)
+                resend = True
+                continue
+
+            records, indptr = response.unpack_results()
+
+            if not batch_end - batch_start == len(indptr) - 1:
+                # The responses to the mini-batches still in flight must be
+                # received, or they'd be taken for the next request's.
+                self.__drain(len(in_flight))
+                raise IOError('Mini batch [%d:%d] returned results for %d queries, expected %d.' %
+                              (batch_start, batch_end, len(indptr) - 1, batch_end - batch_start))
+
+            results.put(batch_start, records, indptr)
+
+        return results.result()
+
+    def query_iter(self, source, batch_size=128, window=2, component_type=None):
+        """
+        Query a stream of query vectors in mini-batches, yielding the results
+        of each mini-batch as they arrive.
+
+        The mini-batches are read from 'source' and converted to the
+        component format on a background thread, which stays up to 'window'
+        mini-batches ahead. Up to 'window' mini-batches are in flight at
+        once, so with the default of 2 the next mini-batch is already
+        packed and sent while the appliance works on the current one. Only
+        about 2 x 'window' mini-batches are held in memory at a time,
+        however many queries 'source' holds.
+
+        Stopping the iteration early (e.g. with 'break') waits for the
+        results of the mini-batches in flight, so the connection can still
+        be used.
+
+            for (offset, results) in client.query_iter(h5f['query_vecs'], batch_size=256):
+                ids[offset:offset + len(results)] = results.ids
+
+        :type source: numpy.ndarray, numpy.memmap, h5py.Dataset, VectorFile.VectorFile or iterable
+        :param source: A 2-D array-like with one query vector per row, or an
+                       iterable of query vectors or of 2-D blocks of rows
+                       (see read_batches).
+
+        :type batch_size: integer
+        :param batch_size: Number of query vectors per mini-batch.
+
+        :type window: integer
+        :param window: Maximum number of mini-batches in flight, and number
+                       of mini-batches to read ahead.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components, as for ds_load. A
+                               VectorFile's own component type is used by
+                               default.
+
+        :rtype: generator
+        :return: (offset, results) for each mini-batch, in order, where
+                 'offset' is the index in 'source' of its first query, and
+                 'results' is a Results.ResultSet or Results.SparseResultSet
+                 as returned by query.
+        """
 
-            # Select the vectors in this mini-batch.
-            mini_batch = vectors[start:end]
+        if batch_size <= 0 or window <= 0:
+            raise ValueError('Invalid argument')
 
-            # Progress update.
-            if verbose and not start == 0:
-                # Caclulate the average throughput so far.
-                queries_per_sec = ((time.time() - t0)  / start)
+        if component_type is None:
+            component_type = getattr(source, 'component_type', None)
+
+        distance_mode = self.session.distance_mode
+
+        # Mini-batches ready to send, followed by None at the end of
+        # 'source', or the exception raised reading it.
+        prefetched = queue.Queue(maxsize=window)
+        stop = threading.Event()
+
+        def read():
+            try:
+                for block in read_batches(source, batch_size):
+                    if stop.is_set():
+                        return
+                    prefetched.put(encode_vectors(block, component_type, distance_mode))
+                prefetched.put(None)
+            except Exception as e:
+                prefetched.put(e)
+
+        reader = threading.Thread(target=read)
+        reader.daemon = True
+        reader.start()
+
+        # The (offset, length) and requests of the mini-batches which have
+        # been sent but whose results haven't been received yet, oldest
+        # first. If the connection fails, they are sent again.
+        in_flight = collections.deque()
+        offset = 0
+        exhausted = False
+        failures = 0
+        resend = False
+
+        # The exception raised reading 'source'. It isn't a connection
+        # failure, so it is raised outside the recovery below, once the
+        # mini-batches in flight are received.
+        source_error = None
+
+        try:
+            while True:
+                try:
+                    # After reconnecting, send the mini-batches in flight
+                    # again.
+                    if resend:
+                        resend = False
+                        for (_, _, request) in in_flight:
+                            self.__send(request)
+
+                    # Send mini-batches until 'window' of them are in flight.
+                    while not exhausted and len(in_flight) < window:
+                        item = prefetched.get()
+                        if item is None:
+                            exhausted = True
+                            break
+                        if isinstance(item, Exception):
+                            source_error = item
+                            exhausted = True
+                            break
+
+                        (mini_batch, mini_batch_type) = item
+                        if mini_batch.ndim != 2:
+                            raise ValueError('Invalid argument')
+                        if len(mini_batch) == 0:
+                            continue
+
+                        request = Request(
+                            self.api_key,
+                            Command.QUERY,
+                            attribute_0=vector_length(mini_batch, mini_batch_type),
+                            attribute_1=1,
+                            body_length=mini_batch.nbytes,
+                            body=mini_batch,
+                            component_type=mini_batch_type
+                        )
+
+                        # The mini-batch is in flight from here, so it is
+                        # sent again if sending it fails.
+                        in_flight.append((offset, len(mini_batch), request))
+                        offset += len(mini_batch)
+                        self.__send(request)
+
+                    if not in_flight:
+                        break
+
+                    # Wait for the results of the oldest mini-batch.
+                    response = self.__receive()
+                    (batch_offset, batch_length, request) = in_flight.popleft()
+                    failures = 0
+
+                except SearchError:
+                    # The error is the response to the oldest mini-batch.
+                    in_flight.popleft()
+                    raise
+
+                except IOError as e:
+                    failures = self.__recover(e, failures)
+                    resend = True
+                    continue
+
+                records, indptr = response.unpack_results()
+
+                if not batch_length == len(indptr) - 1:
+                    # The responses to the mini-batches still in flight
+                    # must be received, or they'd be taken for the next
+                    # request's.
+                    self.__drain(len(in_flight))
+                    raise IOError('Mini batch [%d:%d] returned results for %d queries, expected %d.' %
+                                  (batch_offset, batch_offset + batch_length, len(indptr) - 1, batch_length))
+
+                results = Results.ResultCollector(self.session.query_mode, batch_length, self.session.read_count)
+                results.put(0, records, indptr)
+
+                yield (batch_offset, results.result())
+
+            # The results of the mini-batches read before the error have
+            # all been yielded.
+            if source_error is not None:
+                raise source_error
+
+        except (GeneratorExit, Exception) as e:
+            # If the iteration stops for any reason but a failed connection,
+            # the results of the mini-batches in flight must still be
+            # received, or they'd be taken for the results of the next
+            # request.
+            if isinstance(e, SearchError) or not isinstance(e, IOError):
+                self.__drain(len(in_flight))
+            raise
+
+        finally:
+            # Unblock the reader thread, and wait for it to stop.
+            stop.set()
+            while reader.is_alive():
+                try:
+                    prefetched.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            reader.join()
+
+    def query_resumable(self, source, writer, batch_size=128, window=2, component_type=None, max_retries=5,
+                        retry_delay=1.0, reload_dataset=True, verbose=True):
+        """
+        Run a long batch query whose results are written to disk, surviving
+        lost connections.
 
-                # Estimate how much time (in minutes) is left to complete the
-                # test.
-                time_est = queries_per_sec * (len(vectors) - start) / 60.0
+        The results are streamed into 'writer' (see ResultWriter), which
+        checkpoints the mini-batches written to disk. Only the queries
+        'writer' doesn't already hold are run, so a job interrupted by a
+        crash continues where it stopped when run again with a writer
+        opened with resume=True.
 
-                # Format the estimated time remaining into minutes.
-                # If it's less than 1 minute, show <1 instead of 0.
-                if time_est < 1:
-                    time_est_str = '<1 min...'
-                else:
-                    time_est_str = '~%.0f min...' % time_est
+        If the connection fails (IOError), the client reconnects, makes its
+        settings and reloads the dataset (see reconnect), and continues from
+        the first mini-batch whose results weren't received, waiting
+        'retry_delay' seconds, doubling each time, between attempts. After
+        'max_retries' attempts in a row without progress, the IOError is
+        raised.
 
-                print ('  Query %5d / %5d (%3.0f%%) Time Remaining: %s' % (start, len(vectors), float(start) / len(vectors) * 100.0, time_est_str))
-                sys.stdout.flush()
+        The writer isn't closed, so the caller should close it, e.g.:
 
-            # Construct the query request.
-            request = Request(
-                self.api_key,
-                Command.QUERY,
-                attribute_0=len(mini_batch[0]),    # Length of a vector
-                attribute_1=1,
-                body_length=len(mini_batch) * (len(mini_batch[0])), # Total matrix size
-                body=mini_batch
-            )
+            with ResultWriter.open_writer('results.npy', len(queries), k=10, resume=True) as writer:
+                client.query_resumable(queries, writer)
+
+        :type source: numpy.ndarray, numpy.memmap, h5py.Dataset or VectorFile.VectorFile
+        :param source: A 2-D array-like with one query vector per row,
+                       which can be read again from any row.
+
+        :type writer: ResultWriter.ResultWriter
+        :param writer: Where to write the results, for len(source) queries.
+
+        :type batch_size: integer
+        :param batch_size: Number of query vectors per mini-batch.
 
-            # Submit the query and wait for the results.
-            mini_res = self.__request(request)
+        :type window: integer
+        :param window: Maximum number of mini-batches in flight (see
+                       query_iter).
 
-            if not len(mini_batch) == len(mini_res):
-                print ('ERROR: Mini batch length %d does not match results legnth %d!' % (len(mini_batch), len(mini_res)))
-                sys.stdout.flush()
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components, as for ds_load.
 
-            # Accumulate the results.
-            results = results + mini_res
+        :type max_retries: integer
+        :param max_retries: Number of failed reconnection attempts in a row
+                            to give up after.
 
-            # Update the start pointer.
-            start = end
+        :type retry_delay: float
+        :param retry_delay: Seconds to wait before the first attempt to
+                            reconnect.
+
+        :type reload_dataset: bool
+        :param reload_dataset: Whether to reload the dataset after
+                               reconnecting (see reconnect).
+
+        :type verbose: bool
+        :param verbose: Whether to print progress, and the connection
+                        failures.
+        """
+
+        if not hasattr(source, 'shape') or len(source.shape) != 2 or source.shape[0] != writer.n_queries:
+            raise ValueError('Invalid argument')
 
-        return results
+        if component_type is None:
+            component_type = getattr(source, 'component_type', None)
+
+        n_queries = source.shape[0]
+        failures = 0
+
+        # The connection is also recovered within query_iter, which reloads
+        # the dataset as set here.
+        saved_reload_dataset = self.reload_dataset
+        self.reload_dataset = reload_dataset
+
+        try:
+            for (start, end) in writer.remaining():
+                # The first query whose results haven't been received.
+                offset = start
+
+                while offset < end:
+                    # Read the rest of the range a mini-batch at a time.
+                    blocks = (source[i:min(i + batch_size, end)] for i in range(offset, end, batch_size))
+
+                    try:
+                        for (batch_offset, results) in self.query_iter(blocks, batch_size, window, component_type):
+                            writer.put(offset, results)
+                            offset += len(results)
+                            failures = 0
+
+                            if verbose:
+                                print('  Query %7d / %7d (%3.0f%%)' % (offset, n_queries, offset * 100.0 / n_queries))
+                                sys.stdout.flush()
+
+                    except SearchError:
+                        # The appliance refused the queries; trying again won't help.
+                        raise
+
+                    except IOError as e:
+                        failures += 1
+                        if failures > max_retries:
+                            raise
+
+                        delay = retry_delay * 2 ** (failures - 1)
+                        if verbose:
+                            print('  Connection failed at query %d (%s), reconnecting in %.1f s...' % (offset, e, delay))
+                            sys.stdout.flush()
+
+                        time.sleep(delay)
+                        try:
+                            self.reconnect(reload_dataset)
+                        except IOError as e:
+                            if verbose:
+                                print('  Reconnecting failed (%s).' % e)
+                                sys.stdout.flush()
+
+        finally:
+            self.reload_dataset = saved_reload_dataset
 
     def query_from_file(self, file_name, dataset_name, output_name):
         """
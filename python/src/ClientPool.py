@@ -0,0 +1,264 @@
+import concurrent.futures
+import contextlib
+import queue
+import threading
+
+from Common import *
+from Client import Client, Session
+import Results
+
+
+class ClientPool:
+    """
+    A pool of connections to one Nearist appliance, for use from multiple
+    threads.
+
+    Each connection is a Client which is used by one thread at a time.
+    Threads borrow a connection with the 'connection' context manager, and
+    batch queries made through the pool are spread over all of the
+    connections.
+
+    The distance mode, query mode, read count and threshold set through the
+    pool are made on every connection.
+    """
+
+    def __init__(self, size=4, **kwargs):
+        """
+        :type size: integer
+        :param size: Number of connections to open.
+
+        The other arguments are passed to Client for each connection.
+        """
+        self.size = size
+        self.client_args = kwargs
+        self.clients = []
+
+        # The settings made on every connection.
+        self.session = Session()
+
+        # Connections which aren't in use.
+        self.__idle = queue.Queue()
+
+    def open(self, host, port, api_key):
+        """
+        Open the connections to the Nearist appliance.
+
+        :type host: string
+        :param host: IP address of the Nearist appliance.
+
+        :type port: integer
+        :param port: Port number for accessing the Nearist appliance.
+
+        :type api_key: string
+        :param api_key: Unique user access key which is required to access the
+                    appliance.
+
+        """
+        for i in range(self.size):
+            c = Client(**self.client_args)
+            c.open(host, port, api_key)
+
+            # Make the pool's settings on the new connection.
+            self.session.apply(c)
+
+            self.clients.append(c)
+            self.__idle.put(c)
+
+    def close(self):
+        """
+        Close all of the connections.
+        """
+        for c in self.clients:
+            c.close()
+
+        self.clients = []
+        self.__idle = queue.Queue()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        Borrow a connection, waiting until one is available. The connection
+        is returned to the pool at the end of the 'with' block:
+
+            with pool.connection() as c:
+                c.query(vector)
+        """
+        c = self.__idle.get()
+        try:
+            yield c
+        finally:
+            self.__idle.put(c)
+
+    @contextlib.contextmanager
+    def __all_connections(self):
+        # Borrow every connection, waiting for requests in progress to
+        # complete.
+        clients = [self.__idle.get() for i in range(len(self.clients))]
+        try:
+            yield clients
+        finally:
+            for c in clients:
+                self.__idle.put(c)
+
+    def __configure(self, name, *args):
+        # Make a setting on every connection, and record it in the pool's
+        # session.
+        with self.__all_connections() as clients:
+            for target in clients + [self.session]:
+                getattr(target, name)(*args)
+
+    def reset(self):
+        """
+        Reset the Nearist hardware, clearing all stored data.
+        """
+        with self.connection() as c:
+            c.reset()
+
+    def reset_timer(self):
+        """
+        Reset board time measurement timer.
+        """
+        with self.connection() as c:
+            c.reset_timer()
+
+    def get_timer_value(self):
+        """
+        Get board time measurement in nanoseconds.
+        """
+        with self.connection() as c:
+            return c.get_timer_value()
+
+    def set_distance_mode(self, mode):
+        """
+        Set the distance metric on every connection.
+
+        :type mode: Common.DistanceMode
+        :param mode: Distance metric from Common.DistanceMode
+
+        """
+        self.__configure('set_distance_mode', mode)
+
+    def set_query_mode(self, mode):
+        """
+        Set query mode on every connection.
+
+        :type mode: Common.QueryMode
+        :param mode: Query mode from Common.QueryMode
+
+        """
+        self.__configure('set_query_mode', mode)
+
+    def set_read_count(self, count):
+        """
+        Set query result count for KNN_D/KNN_A query mode(s) on every
+        connection.
+
+        :type count: integer
+        :param count: The top 'K' values in KNN
+
+        """
+        self.__configure('set_read_count', count)
+
+    def set_threshold(self, threshold):
+        """
+        Set query threshold for GT, LT, or KNN query modes on every
+        connection.
+
+        :type threshold: integer
+        :param threshold: The threshold value.
+        """
+        self.__configure('set_threshold', threshold)
+
+    def set_threshold_range(self, threshold_lower, threshold_upper):
+        """
+        Set query threshold for RANGE query mode on every connection.
+
+        :type threshold_lower: integer
+        :param threshold_lower: Lower threshold value.
+
+        :type threshold_upper: integer
+        :param threshold_upper: Upper threshold value.
+
+        """
+        self.__configure('set_threshold_range', threshold_lower, threshold_upper)
+
+    def ds_load(self, vectors, component_type=None):
+        """
+        Load dataset to Nearist appliance. See Client.ds_load.
+        """
+        with self.connection() as c:
+            c.ds_load(vectors, component_type)
+
+    def load_dataset_file(self, file_name, dataset_name, component_type=None):
+        """
+        Load local dataset to Nearist appliance. See Client.load_dataset_file.
+        """
+        with self.connection() as c:
+            c.load_dataset_file(file_name, dataset_name, component_type)
+
+    def ds_load_random(self, vector_count, comp_count):
+        """
+        Load random dataset to Nearist appliance. See Client.ds_load_random.
+        """
+        with self.connection() as c:
+            c.ds_load_random(vector_count, comp_count)
+
+    def query(self, vectors, batch_size=128, verbose=True, window=1, component_type=None):
+        """
+        Query for single/multiple vector(s)
+
+        Takes the same arguments as Client.query, and returns the same
+        results. The mini-batches of a batch query are sent over all of the
+        pool's connections at once, 'window' at a time on each connection,
+        and their results are reassembled in query order. 'verbose' is
+        accepted for compatibility with Client.query, and is ignored.
+
+        :type vectors: list, list of lists or numpy.ndarray
+        :param vectors: A single query vector, or a matrix with one query
+                        vector per row.
+
+        :type window: integer
+        :param window: Number of mini-batches each connection is given at a
+                       time, which it keeps in flight at once (see
+                       Client.query).
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+
+        """
+        vectors, component_type = encode_vectors(vectors, component_type, self.session.distance_mode)
+
+        # Validate that 'vectors' is a non-empty vector or matrix, and that
+        # the mini-batches can be sent.
+        if vectors.ndim not in (1, 2) or vectors.size == 0 or batch_size <= 0 or window <= 0:
+            raise ValueError('Invalid argument')
+
+        # ======== Single Query ========
+        if vectors.ndim == 1:
+            with self.connection() as c:
+                return c.query(vectors, component_type=component_type)
+
+        # ======== Batch Query ========
+        results = Results.ResultCollector(self.session.query_mode, len(vectors), self.session.read_count)
+        results_lock = threading.Lock()
+
+        # Each connection is given 'window' mini-batches at a time, which
+        # Client.query pipelines.
+        chunk_size = batch_size * window
+
+        def query_chunk(start):
+            with self.connection() as c:
+                chunk_res = c.query(vectors[start:start + chunk_size], batch_size=batch_size, verbose=False,
+                                    window=window, component_type=component_type)
+
+            with results_lock:
+                results.add(start, chunk_res)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.clients)) as executor:
+            futures = [executor.submit(query_chunk, start) for start in range(0, len(vectors), chunk_size)]
+
+            # Raise the first error, if any.
+            for future in futures:
+                future.result()
+
+        return results.result()
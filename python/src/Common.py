@@ -3,6 +3,8 @@ import binascii
 
 from enum import IntEnum
 
+import numpy as np
+
 class DistanceMode(IntEnum):
     """
      Possible distance metric configurations.
@@ -55,6 +57,14 @@ class DistanceMode(IntEnum):
     JACCARD = 0x0005
 
 
+BIT_DISTANCE_MODES = (DistanceMode.HAMMING, DistanceMode.BIT_AND, DistanceMode.BIT_OR, DistanceMode.JACCARD)
+"""
+Distance modes which can be applied to 1-bit components. Boolean vectors
+are sent packed eight components to a byte in these modes (see
+encode_vectors).
+"""
+
+
 class QueryMode(IntEnum):
     """
     Possible query mode configurations.
@@ -142,8 +152,67 @@ class Status(IntEnum):
     UNKNOWN_ERROR = 0xFF
 
 
+class ComponentType(IntEnum):
+    """
+    Width of the vector components in a request body.
+
+    The component type is sent in the reserved word of the request header.
+    UINT8 (0) is the appliance's native format, so requests which don't set
+    a component type are unchanged on the wire.
+    """
+    UINT8 = 0x00
+    UINT16 = 0x01
+    UINT32 = 0x02
+    """
+    1-bit components, packed eight to a byte with the first component in
+    the most significant bit (as numpy.packbits). Each vector is padded
+    with zero bits to a whole number of bytes, and its length (attribute 0)
+    is given in bits, including the padding.
+    """
+    BIT = 0x03
+
+
+COMPONENT_DTYPES = {
+    ComponentType.UINT8: np.dtype('u1'),
+    ComponentType.UINT16: np.dtype('<u2'),
+    ComponentType.UINT32: np.dtype('<u4'),
+}
+"""
+Layout of a single component of each ComponentType in a request body.
+Packed bits (ComponentType.BIT) are sent as uint8 bytes.
+"""
+
+
+RESULT_DTYPE = np.dtype([('ds_id', '<u8'), ('distance', '<u8')])
+"""
+Layout of a single result in a query response body: the dataset vector ID
+followed by its distance, both little-endian uint64.
+"""
+
+RESULT_SENTINEL = 0xFFFFFFFFFFFFFFFF
+"""
+Value marking the end of a query's results in a response body.
+"""
+
+
+class SearchError(IOError):
+    """
+    Raised when the appliance responds with a Status other than SUCCESS,
+    or (by Engine) when a search can't be performed, with the Status the
+    appliance would respond with.
+
+    Unlike other IOErrors raised by the clients, a SearchError doesn't
+    break the connection.
+    """
+
+    def __init__(self, status):
+        IOError.__init__(self, "Nearist error: %s " % Status(status))
+        self.status = status
+
+
 class Request:
-    def __init__(self, api_key, command, attribute_0=0, attribute_1=0, body_length=0, body=None):
+    def __init__(self, api_key, command, attribute_0=0, attribute_1=0, body_length=0, body=None,
+                 component_type=ComponentType.UINT8):
         # Pad the API key out to 8 characters, and only take 8 characters.
         self.api_key = api_key.ljust(8)[0:8]
         self.command = command
@@ -151,27 +220,41 @@ class Request:
         self.attribute_1 = attribute_1
         self.body_length = body_length
         self.body = body
+        self.component_type = component_type
 
     def pack(self):
         """
-        Returns the binary representation of this request (as a string).
+        Returns the binary representation of this request (as bytes). See
+        pack_parts.
+        """
+        return b"".join(self.pack_parts())
+
+    def pack_parts(self):
+        """
+        Returns the binary representation of this request as a list of
+        bytes-like parts, which are sent one after another: the header, and
+        then the body and its checksum if there is a body. The body part is
+        a view of the body's components rather than a copy, so the parts can
+        be sent with scatter-gather I/O without copying the body at all.
         
         The header structure is as follows:
            Command      4 bytes
-           Reserved     4 bytes
+           Reserved     4 bytes (the ComponentType of the body)
            Attribute 0  8 bytes
            Attribute 1  8 bytes
            Body length  8 bytes
            API Key      8 bytes (8 characters)
            Checksum     4 bytes
         
-        The header is followed by the body of the request, if present.
+        The header is followed by the body of the request, if present, and
+        a checksum of the body.
         """
 
         # Pack the message header.        
         # 'L' is unsigned long (32-bit) and 'Q' is unsigned long long (64-bit)
         # 'LLQQQ' = 2*4 + 3*8 = 32 bytes
-        buf = struct.pack("=LLQQQ", self.command, 0, self.attribute_0, self.attribute_1, self.body_length)
+        buf = struct.pack("=LLQQQ", self.command, self.component_type, self.attribute_0, self.attribute_1,
+                          self.body_length)
 
         # Add the API key to the header (it's 8 characters, 8 bytes).
         buf += format(self.api_key).encode()
@@ -181,30 +264,214 @@ class Request:
 
         # If this request includes a body...
         if self.body_length > 0 and self.body is not None:
-            body = ""
-            
-            # For each vector...
-            for vector in self.body:
-                # TODO - This doesn't support numpy arrays.
-                if isinstance(vector, list):
-                    # Add each component of the vector to the request.
-                    # TODO - B is uint8, so this is currently hardcoded to 
-                    #        components of that size.
-                    if(isinstance(body,str)):
-                        body = format(body).encode() # this may not work for batch queries this needs to be done before entering the loop
-                    for comp in vector:
-                        body += struct.pack("B", comp)
-                else:
-                    if isinstance(vector, str):
-                        body += vector
-                    else:
-                        body += struct.pack("B", vector)
-            if isinstance(body, str):
-                body = format(body).encode()
-            # Append the body and a checksum of it to the end of the buffer.
-            buf = buf + body + struct.pack("=L", binascii.crc32(body) & 0xFFFFFFFF) #this line is correct
+            body = self.pack_body()
 
-        return buf
+            # The body is followed by a checksum of it, which is computed
+            # over the same view.
+            return [buf, body, struct.pack("=L", binascii.crc32(body) & 0xFFFFFFFF)]
+
+        return [buf]
+
+    def pack_body(self):
+        """
+        Returns the body of this request as a flat, read-only byte view.
+
+        String bodies (the JSON arguments of the file and random dataset
+        commands) are encoded, bytes-like bodies are used as they are, and
+        vectors are serialized in a single step with `as_components`, in
+        the request's component type.
+        """
+        if isinstance(self.body, str):
+            return memoryview(self.body.encode())
+
+        if isinstance(self.body, (bytes, bytearray, memoryview)):
+            return memoryview(self.body).cast("B")
+
+        return memoryview(as_components(self.body, self.component_type).reshape(-1).view(np.uint8))
+
+    def unpack_header(self, buffer):
+        """
+        Unpacks a 44 byte request header (see pack) from 'buffer', as
+        received by the appliance. The header's checksum is stored in
+        'checksum', and 'header_valid' is set to whether it matches the
+        header fields.
+        """
+        (self.command, self.component_type, self.attribute_0, self.attribute_1, self.body_length) = \
+            struct.unpack_from("=LLQQQ", buffer, 0)
+        self.api_key = bytes(buffer[32:40]).decode(errors="replace")
+        (self.checksum,) = struct.unpack_from("=L", buffer, 40)
+        self.header_valid = self.checksum == binascii.crc32(buffer[0:40]) & 0xFFFFFFFF
+
+
+def component_type_of(dtype):
+    """
+    Returns the ComponentType whose components are stored as 'dtype', or
+    None if there isn't one.
+    """
+    dtype = np.dtype(dtype)
+
+    for (component_type, component_dtype) in COMPONENT_DTYPES.items():
+        if dtype.kind == 'u' and dtype.itemsize == component_dtype.itemsize:
+            return component_type
+
+    return None
+
+
+def as_components(vectors, component_type=None):
+    """
+    Converts a vector, or a matrix of row vectors, to a C-contiguous array
+    in one of the component formats of ComponentType.
+
+    Lists (of lists), NumPy arrays and other buffer-protocol objects are
+    accepted. Arrays which are already in the component format and
+    C-contiguous are returned without a copy, so slicing rows out of the
+    result is free. Other arrays are converted in a single step, after
+    checking that every component is a whole number which fits in the
+    component format.
+
+    :type vectors: list, list of lists, numpy.ndarray or buffer
+    :param vectors: A single vector or a matrix of row vectors.
+
+    :type component_type: Common.ComponentType
+    :param component_type: The component format to convert to. By default,
+                           uint16 and uint32 arrays keep their width and
+                           anything else is converted to uint8.
+
+    :rtype: numpy.ndarray
+    """
+    if component_type is None and getattr(vectors, 'dtype', None) is not None:
+        component_type = component_type_of(vectors.dtype)
+
+    if component_type in (None, ComponentType.BIT):
+        component_type = ComponentType.UINT8
+
+    dtype = COMPONENT_DTYPES[component_type]
+
+    if isinstance(vectors, (bytes, bytearray, memoryview)):
+        return np.frombuffer(vectors, dtype=dtype)
+
+    vectors = np.asarray(vectors)
+
+    # Check the range of anything which isn't already of the right width,
+    # rather than letting the conversion wrap around, and that floats are
+    # whole numbers, rather than letting the conversion truncate them.
+    if vectors.dtype != dtype and vectors.size > 0 and vectors.dtype != bool:
+        if vectors.dtype.kind in 'fc' and not (vectors == np.trunc(vectors.real)).all():
+            raise ValueError('Invalid argument')
+
+        info = np.iinfo(dtype)
+        if vectors.min() < info.min or vectors.max() > info.max:
+            raise ValueError('Component values must be within [%d, %d] for %s' %
+                             (info.min, info.max, ComponentType(component_type).name))
+
+    return np.ascontiguousarray(vectors, dtype=dtype)
+
+
+def encode_vectors(vectors, component_type=None, distance_mode=None):
+    """
+    Converts a vector, or a matrix of row vectors, to the components sent in
+    a request body, choosing how to pack 1-bit components.
+
+    Boolean arrays are 1-bit components. In the bit distance modes (see
+    BIT_DISTANCE_MODES), or if 'component_type' is ComponentType.BIT, they
+    are packed eight to a byte, which makes them 8x smaller on the wire.
+    Otherwise they are sent as uint8 0s and 1s. A uint8 array with
+    'component_type' ComponentType.BIT is taken to be packed already.
+
+    Anything else is converted by as_components. Objects which carry their
+    own 'component_type', such as a VectorFile.VectorFile, are taken to be
+    in that format.
+
+    :type vectors: list, list of lists, numpy.ndarray or buffer
+    :param vectors: A single vector or a matrix of row vectors.
+
+    :type component_type: Common.ComponentType
+    :param component_type: The component format, or None to choose it from
+                           the type of 'vectors'.
+
+    :type distance_mode: Common.DistanceMode
+    :param distance_mode: The distance mode the vectors will be used with.
+
+    :rtype: tuple
+    :return: (components, component_type), where 'components' is the array
+             to send and 'component_type' its ComponentType.
+    """
+    if component_type is None:
+        component_type = getattr(vectors, 'component_type', None)
+
+    if component_type is None and distance_mode in BIT_DISTANCE_MODES and \
+            isinstance(vectors, np.ndarray) and vectors.dtype == bool:
+        component_type = ComponentType.BIT
+
+    if component_type == ComponentType.BIT:
+        if isinstance(vectors, np.ndarray) and vectors.dtype == bool:
+            return np.packbits(vectors, axis=-1), component_type
+        return as_components(vectors, ComponentType.UINT8), component_type
+
+    vectors = as_components(vectors, component_type)
+    return vectors, component_type_of(vectors.dtype)
+
+
+def _gf2_matrix_times(matrix, vector):
+    # Multiply a 32x32 GF(2) matrix (a list of 32 column words) by a vector.
+    total = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[i]
+        vector >>= 1
+        i += 1
+    return total
+
+
+def _gf2_matrix_square(matrix):
+    return [_gf2_matrix_times(matrix, column) for column in matrix]
+
+
+def crc32_combine(crc1, crc2, length2):
+    """
+    Returns the CRC-32 of two pieces of data joined together, from the
+    CRC-32 of each piece (as binascii.crc32) and the length of the second
+    piece, as zlib's crc32_combine. This lets the checksum of a large body
+    be computed in parallel, one piece per thread.
+    """
+    if length2 <= 0:
+        return crc1
+
+    # The operator for one zero bit, and then for two and four zero bits.
+    odd = [0xEDB88320] + [1 << n for n in range(31)]
+    even = _gf2_matrix_square(odd)
+    odd = _gf2_matrix_square(even)
+
+    # Apply the operator for each set bit of 'length2' (in bytes) to crc1.
+    while True:
+        even = _gf2_matrix_square(odd)
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+        odd = _gf2_matrix_square(even)
+        if length2 & 1:
+            crc1 = _gf2_matrix_times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+
+    return crc1 ^ crc2
+
+
+def vector_length(components, component_type):
+    """
+    Returns the length of the vectors in 'components' (as returned by
+    encode_vectors) to send in attribute 0 of a request: the number of
+    components, or of bits for packed 1-bit components.
+    """
+    if component_type == ComponentType.BIT:
+        return components.shape[-1] * 8
+
+    return components.shape[-1]
 
 
 class Response:
@@ -234,6 +501,83 @@ class Response:
         self.body = body
         self.body_checksum = 0
 
+    def pack(self):
+        """
+        Returns the binary representation of this response (as bytes), as
+        sent by the appliance: the header, followed by the body and a
+        checksum of it, if present.
+        """
+        buf = struct.pack("=LLQQQ", self.command, self.status, self.attribute_0, self.attribute_1, self.body_length)
+        buf += struct.pack("=L", binascii.crc32(buf) & 0xFFFFFFFF)
+
+        if self.body_length > 0 and self.body is not None:
+            body = memoryview(self.body).cast("B")
+            buf = b"".join((buf, body, struct.pack("=L", binascii.crc32(body) & 0xFFFFFFFF)))
+
+        return buf
+
     def unpack_header(self, buffer):
         (self.command, self.status, self.attribute_0, self.attribute_1, self.body_length, self.checksum) = \
             struct.unpack_from("=LLQQQL", buffer, 0)
+
+    def pack_results(self, records, indptr):
+        """
+        Sets the body of this response to the results of one or more
+        queries: the inverse of unpack_results. The results of query i are
+        records[indptr[i]:indptr[i + 1]], and each query's results are
+        followed by a sentinel.
+        """
+        n_queries = len(indptr) - 1
+
+        body = np.empty(len(records) + n_queries, dtype=RESULT_DTYPE)
+        body['ds_id'] = RESULT_SENTINEL
+        body['distance'] = RESULT_SENTINEL
+
+        # Query i's results move along by the i sentinels before them.
+        body[np.arange(len(records)) + np.repeat(np.arange(n_queries), np.diff(indptr))] = records
+
+        self.body = body
+        self.body_length = body.nbytes
+
+    def unpack_results(self):
+        """
+        Decodes the body of a query response.
+
+        The body is a sequence of (ds_id, distance) pairs. Each query's
+        results are terminated by a pair containing RESULT_SENTINEL.
+
+        For a single query (attribute_1 == 0), returns a structured array of
+        RESULT_DTYPE holding the results up to the first sentinel.
+
+        For a batch query (attribute_1 == 1), returns a tuple
+        (records, indptr): 'records' holds the results of every query with
+        the sentinels removed, and the results of query 'i' are
+        records[indptr[i]:indptr[i + 1]]. Any trailing results which are not
+        terminated by a sentinel are dropped.
+
+        The returned arrays are views into 'body' where possible.
+        """
+        body = self.body if self.body is not None else b""
+        records = np.frombuffer(body, dtype=RESULT_DTYPE, count=len(body) // RESULT_DTYPE.itemsize)
+
+        # Locate the sentinels with a single vectorized comparison.
+        ends = np.flatnonzero((records['ds_id'] == RESULT_SENTINEL) | (records['distance'] == RESULT_SENTINEL))
+
+        if self.attribute_1 == 0:
+            if len(ends) > 0:
+                return records[:ends[0]]
+            return records
+
+        # Query 'i' ends at the i-th sentinel. Removing the sentinels shifts
+        # each end position left by the number of sentinels before it.
+        indptr = np.zeros(len(ends) + 1, dtype=np.int64)
+        indptr[1:] = ends - np.arange(len(ends))
+
+        # Drop the sentinels, and anything after the last one.
+        last = ends[-1] if len(ends) > 0 else 0
+        keep = np.ones(last, dtype=bool)
+        keep[ends[:-1]] = False
+
+        return records[:last][keep], indptr
+
+
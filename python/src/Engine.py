@@ -0,0 +1,440 @@
+"""
+Brute-force nearest neighbor search on the CPU, following the appliance's
+distance and query semantics.
+
+The distances are integers, computed over uint8, uint16 or uint32
+components (see Common.ComponentType):
+
+    L1       Sum of absolute differences.
+    LMAX     Largest absolute difference.
+    HAMMING  Number of components which differ.
+    BIT_AND  Number of bits set in (a AND b).
+    BIT_OR   Number of bits set in (a OR b).
+    JACCARD  Number of bits set in (a AND b) divided by the number set in
+             (a OR b), as a fixed point fraction with JACCARD_BITS
+             fractional bits (rounded down). Two empty vectors have a
+             similarity of 0.
+
+Datasets and queries of 1-bit components can also be searched packed, eight
+components to a byte (see pack_bits). On packed bits, HAMMING and L1 count
+the bits which differ, LMAX is 1 if any bit differs, and BIT_AND, BIT_OR
+and JACCARD are as above. The distances are the same as for the unpacked
+0/1 components, with an eighth of the memory.
+
+The results of each query are ordered as follows:
+
+    KNN_A    Ascending distance, then ascending ds_id. If a threshold has
+             been set, only distances below it are returned.
+    KNN_D    Descending distance, then ascending ds_id. If a threshold has
+             been set, only distances above it are returned.
+    ALL      Every dataset vector, in ds_id order.
+    GT, LT,  Results whose distance is greater than, less than or equal to
+    EQ       the threshold, in ds_id order.
+    RANGE    Results whose distance is within [lower, upper], in ds_id
+             order.
+"""
+
+import os
+
+import numpy as np
+
+from Common import *
+import VectorFile
+
+JACCARD_BITS = 16
+"""
+Number of fractional bits in Jaccard similarities.
+"""
+
+BLOCK_BYTES = 1 << 18
+"""
+Number of bytes in the temporaries of one block of distance
+calculations (see distances).
+"""
+
+QUERY_BLOCK_SIZE = 16
+"""
+Largest number of queries in one block of distance calculations.
+"""
+
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+"""
+Number of bits set in each byte value.
+"""
+
+POPCOUNT16 = (POPCOUNT[np.arange(1 << 16) & 0xFF] + POPCOUNT[np.arange(1 << 16) >> 8]).astype(np.uint8)
+"""
+Number of bits set in each 16-bit value.
+"""
+
+PACK_ALIGNMENT = 8
+"""
+Packed bit rows are padded with zero bytes to a multiple of this many bytes,
+so that they can be viewed as 64-bit words.
+"""
+
+
+def _count_bits(x):
+    # Total number of bits set in the components along the last axis of the
+    # C-contiguous array 'x', whatever their width.
+    return np.sum(POPCOUNT[x.view(np.uint8)], axis=-1, dtype=np.uint64)
+
+
+def _block_distances(dataset, queries, distance_mode, out):
+    # Distances between a block of queries and a block of dataset vectors,
+    # written into the (len(queries), len(dataset)) view 'out'.
+    a = queries[:, np.newaxis, :]
+    b = dataset[np.newaxis, :, :]
+
+    if distance_mode in (DistanceMode.L1, DistanceMode.LMAX):
+        # |a - b| without widening the components.
+        difference = np.maximum(a, b) - np.minimum(a, b)
+        if distance_mode == DistanceMode.L1:
+            np.sum(difference, axis=2, dtype=np.uint64, out=out)
+        else:
+            np.max(difference, axis=2, out=out, initial=0)
+    elif distance_mode == DistanceMode.HAMMING:
+        np.sum(a != b, axis=2, dtype=np.uint64, out=out)
+    elif distance_mode == DistanceMode.BIT_AND:
+        out[...] = _count_bits(a & b)
+    elif distance_mode == DistanceMode.BIT_OR:
+        out[...] = _count_bits(a | b)
+    elif distance_mode == DistanceMode.JACCARD:
+        intersection = _count_bits(a & b)
+        union = _count_bits(a | b)
+        np.floor_divide(intersection << np.uint64(JACCARD_BITS), np.maximum(union, 1), out=out)
+    else:
+        raise SearchError(Status.DISTANCE_MODE_NOT_SUPPORTED)
+
+
+def _popcount(x):
+    # Total number of bits set along the last axis of the uint8 array 'x',
+    # whose rows are a multiple of PACK_ALIGNMENT bytes long.
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x.view(np.uint64)).sum(axis=-1, dtype=np.uint64)
+
+    return np.take(POPCOUNT16, x.view(np.uint16)).sum(axis=-1, dtype=np.uint64)
+
+
+def _block_bit_distances(dataset, queries, distance_mode, out):
+    # As _block_distances, for packed bit rows.
+    a = queries[:, np.newaxis, :]
+    b = dataset[np.newaxis, :, :]
+
+    if distance_mode in (DistanceMode.HAMMING, DistanceMode.L1):
+        out[...] = _popcount(a ^ b)
+    elif distance_mode == DistanceMode.LMAX:
+        out[...] = np.any(a != b, axis=2)
+    elif distance_mode == DistanceMode.BIT_AND:
+        out[...] = _popcount(a & b)
+    elif distance_mode == DistanceMode.BIT_OR:
+        out[...] = _popcount(a | b)
+    elif distance_mode == DistanceMode.JACCARD:
+        intersection = _popcount(a & b)
+        union = _popcount(a | b)
+        np.floor_divide(intersection << np.uint64(JACCARD_BITS), np.maximum(union, 1), out=out)
+    else:
+        raise SearchError(Status.DISTANCE_MODE_NOT_SUPPORTED)
+
+
+def pack_bits(vectors):
+    """
+    Pack a matrix of 1-bit components (booleans, or 0 and 1) eight to a
+    byte, with the first component in the most significant bit (as
+    numpy.packbits). The rows are padded with zeros to a multiple of
+    PACK_ALIGNMENT bytes, which doesn't change any distance.
+
+    :type vectors: numpy.ndarray
+    :param vectors: (n_vectors, n_components) matrix.
+
+    :rtype: numpy.ndarray
+    :return: (n_vectors, n_bytes) uint8 matrix.
+    """
+    return align_bits(np.packbits(np.asarray(vectors) != 0, axis=1))
+
+
+def align_bits(packed):
+    """
+    Pad rows of packed bits (as sent with Common.ComponentType.BIT) with
+    zero bytes to a multiple of PACK_ALIGNMENT bytes, as pack_bits does.
+    """
+    n_bytes = -(-packed.shape[1] // PACK_ALIGNMENT) * PACK_ALIGNMENT
+    if n_bytes == packed.shape[1]:
+        return np.ascontiguousarray(packed)
+
+    aligned = np.zeros((len(packed), n_bytes), dtype=np.uint8)
+    aligned[:, :packed.shape[1]] = packed
+
+    return aligned
+
+
+def match_queries(queries, queries_packed, dataset, dataset_packed):
+    """
+    Convert 'queries' to the same form as 'dataset', so that 1-bit
+    components can be searched whether the dataset and the queries were
+    each sent packed or not.
+
+    :type queries_packed: bool
+    :param queries_packed: Whether 'queries' are rows of packed bits (as
+                           sent with Common.ComponentType.BIT).
+
+    :type dataset_packed: bool
+    :param dataset_packed: Whether 'dataset' was packed by pack_bits.
+    """
+    if dataset is None:
+        return queries
+
+    if dataset_packed:
+        return align_bits(queries) if queries_packed else pack_bits(queries)
+
+    if not queries_packed:
+        return queries
+
+    # Unpack the queries to one component per byte. The padding bits past
+    # the end of the dataset's vectors are dropped.
+    if dataset is None or queries.shape[1] != -(-dataset.shape[1] // 8):
+        raise SearchError(Status.QUERY_SIZE_NOT_SUPPORTED)
+
+    return np.unpackbits(queries, axis=1, count=dataset.shape[1])
+
+
+def distances(dataset, queries, distance_mode, packed=False):
+    """
+    Compute the distance between every query and every dataset vector.
+
+    The work is done in blocks of queries and dataset vectors whose
+    temporaries hold about BLOCK_BYTES bytes, so that they stay in the
+    CPU cache.
+
+    :type dataset: numpy.ndarray
+    :param dataset: (n_vectors, n_components) matrix of components, or
+                    packed bit rows if 'packed' is set.
+
+    :type queries: numpy.ndarray
+    :param queries: (n_queries, n_components) matrix of components, or
+                    packed bit rows if 'packed' is set.
+
+    :type distance_mode: Common.DistanceMode
+    :param distance_mode: Distance metric from Common.DistanceMode
+
+    :type packed: bool
+    :param packed: Whether 'dataset' and 'queries' are 1-bit components
+                   packed by pack_bits.
+
+    :rtype: numpy.ndarray
+    :return: (n_queries, n_vectors) uint64 matrix of distances.
+    """
+    result = np.empty((len(queries), len(dataset)), dtype=np.uint64)
+
+    block_distances = _block_bit_distances if packed else _block_distances
+
+    row_bytes = max(dataset.shape[1] * dataset.itemsize, 1)
+    query_block = max(1, min(len(queries), QUERY_BLOCK_SIZE))
+    dataset_block = max(1, BLOCK_BYTES // (query_block * row_bytes))
+
+    for i in range(0, len(queries), query_block):
+        for j in range(0, len(dataset), dataset_block):
+            block_distances(dataset[j:j + dataset_block], queries[i:i + query_block], distance_mode,
+                            result[i:i + query_block, j:j + dataset_block])
+
+    return result
+
+
+def _top_k(distance, k, descending):
+    # Returns the ds_ids of the 'k' nearest results of each query, in the
+    # order they are returned.
+    n_vectors = distance.shape[1]
+    ids = np.arange(n_vectors, dtype=np.uint64)
+
+    # Make a key which is unique for every result and orders the results
+    # by distance and then by ds_id, so that the results selected by
+    # argpartition don't depend on how it breaks ties.
+    max_distance = int(distance.max()) if distance.size else 0
+    if (max_distance + 1) * n_vectors >= 1 << 64:
+        # The key would overflow, so fall back to a full sort.
+        if descending:
+            distance = ~distance
+        return np.argsort(distance, axis=1, kind='stable')[:, :k]
+
+    if descending:
+        key = (np.uint64(max_distance) - distance) * np.uint64(n_vectors) + ids
+    else:
+        key = distance * np.uint64(n_vectors) + ids
+
+    if k < n_vectors:
+        candidates = np.argpartition(key, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n_vectors), distance.shape)
+
+    order = np.argsort(np.take_along_axis(key, candidates, axis=1), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def select(distance, session):
+    """
+    Select the results of each query from its distances, according to the
+    query mode, read count and threshold in 'session'.
+
+    k-NN queries select their results with argpartition, and the other
+    query modes with a mask over the distances.
+
+    :type distance: numpy.ndarray
+    :param distance: (n_queries, n_vectors) uint64 matrix of distances.
+
+    :type session: Client.Session
+    :param session: The settings to search with.
+
+    :rtype: tuple
+    :return: (records, indptr), where the results of query i are
+             records[indptr[i]:indptr[i + 1]] (see
+             Common.Response.unpack_results).
+    """
+    query_mode = session.query_mode
+    threshold = session.threshold
+
+    if query_mode in (QueryMode.KNN_A, QueryMode.KNN_D):
+        if session.read_count is None:
+            raise SearchError(Status.INVALID_SEQUENCE)
+
+        ids = _top_k(distance, min(session.read_count, distance.shape[1]), query_mode == QueryMode.KNN_D)
+        selected = np.take_along_axis(distance, ids, axis=1)
+
+        if threshold is None:
+            keep = np.ones(ids.shape, dtype=bool)
+        elif query_mode == QueryMode.KNN_A:
+            keep = selected < threshold[0]
+        else:
+            keep = selected > threshold[0]
+
+        records = np.empty(np.count_nonzero(keep), dtype=RESULT_DTYPE)
+        records['ds_id'] = ids[keep]
+        records['distance'] = selected[keep]
+
+    elif query_mode in (QueryMode.ALL, QueryMode.GT, QueryMode.LT, QueryMode.EQ, QueryMode.RANGE):
+        if query_mode == QueryMode.ALL:
+            keep = np.ones(distance.shape, dtype=bool)
+        elif threshold is None:
+            raise SearchError(Status.INVALID_SEQUENCE)
+        elif query_mode == QueryMode.GT:
+            keep = distance > threshold[0]
+        elif query_mode == QueryMode.LT:
+            keep = distance < threshold[0]
+        elif query_mode == QueryMode.EQ:
+            keep = distance == threshold[0]
+        else:
+            if threshold[1] is None:
+                raise SearchError(Status.INVALID_SEQUENCE)
+            keep = (distance >= threshold[0]) & (distance <= threshold[1])
+
+        # The kept results, row by row, in ds_id order.
+        (rows, columns) = np.nonzero(keep)
+
+        records = np.empty(len(rows), dtype=RESULT_DTYPE)
+        records['ds_id'] = columns
+        records['distance'] = distance[rows, columns]
+
+    else:
+        raise SearchError(Status.INVALID_SEQUENCE)
+
+    indptr = np.zeros(len(distance) + 1, dtype=np.int64)
+    np.cumsum(np.count_nonzero(keep, axis=1), out=indptr[1:])
+
+    return records, indptr
+
+
+def search(dataset, queries, session, executor=None, batch_size=256, packed=False):
+    """
+    Search 'dataset' for each of 'queries'. Returns (records, indptr), as
+    for select.
+
+    :type dataset: numpy.ndarray
+    :param dataset: (n_vectors, n_components) matrix of components.
+
+    :type queries: numpy.ndarray
+    :param queries: (n_queries, n_components) matrix of components.
+
+    :type session: Client.Session
+    :param session: The settings to search with.
+
+    :type executor: concurrent.futures.Executor
+    :param executor: If given, the queries are split into batches of
+                     'batch_size' queries which are searched in parallel on
+                     'executor'. NumPy releases the GIL in its kernels, so a
+                     ThreadPoolExecutor keeps several cores busy.
+
+    :type batch_size: integer
+    :param batch_size: Number of queries searched by each task on
+                       'executor'.
+
+    :type packed: bool
+    :param packed: Whether 'dataset' and 'queries' are packed bit rows (see
+                   pack_bits).
+    """
+    if dataset is None:
+        raise SearchError(Status.DATASET_NOT_FOUND)
+
+    if queries.shape[1] != dataset.shape[1]:
+        raise SearchError(Status.QUERY_SIZE_NOT_SUPPORTED)
+
+    # Queries may be narrower than the dataset's components, but not wider.
+    if queries.dtype != dataset.dtype:
+        if not np.can_cast(queries.dtype, dataset.dtype, 'safe'):
+            raise SearchError(Status.INVALID_DATA)
+        queries = queries.astype(dataset.dtype)
+
+    if session.distance_mode == DistanceMode.NO_DISTANCE_MODE:
+        raise SearchError(Status.INVALID_SEQUENCE)
+
+    search_batch = lambda batch: select(distances(dataset, batch, session.distance_mode, packed), session)
+
+    if executor is None or len(queries) <= batch_size:
+        return search_batch(queries)
+
+    futures = [executor.submit(search_batch, queries[start:start + batch_size])
+               for start in range(0, len(queries), batch_size)]
+    parts = [future.result() for future in futures]
+
+    # Join the batches' results, moving each batch's indptr along by the
+    # results before it.
+    records = np.concatenate([records for (records, indptr) in parts])
+    indptr = np.zeros(len(queries) + 1, dtype=np.int64)
+
+    offset = 0
+    start = 0
+    for (part_records, part_indptr) in parts:
+        indptr[start + 1:start + len(part_indptr)] = part_indptr[1:] + offset
+        offset += len(part_records)
+        start += len(part_indptr) - 1
+
+    return records, indptr
+
+
+def read_dataset_file(file_name, dataset_name):
+    """
+    Read a dataset file, as named in a DS_LOAD file request.
+
+    '.npy' and '.nvx' files (see VectorFile) are memory mapped; packed bits
+    in an .nvx file are unpacked to uint8 0s and 1s. Other files are read as
+    HDF5, which requires h5py.
+    """
+    if not file_name or not os.path.exists(file_name):
+        raise SearchError(Status.DATASET_FILE_NOT_FOUND)
+
+    if file_name.endswith('.npy'):
+        return np.load(file_name, mmap_mode='r')
+
+    if file_name.endswith('.nvx'):
+        vector_file = VectorFile.VectorFile(file_name)
+        if vector_file.packed:
+            return np.unpackbits(vector_file.vectors, axis=1, count=vector_file.dims)
+        return vector_file.vectors
+
+    try:
+        import h5py
+    except ImportError:
+        raise SearchError(Status.NOT_SUPPORTED)
+
+    with h5py.File(file_name, 'r') as h5f:
+        if dataset_name not in h5f:
+            raise SearchError(Status.DATASET_NOT_FOUND)
+        return h5f[dataset_name][:]
@@ -0,0 +1,318 @@
+import concurrent.futures
+import os
+import time
+
+import numpy as np
+
+from Common import *
+from Client import Session, read_batches
+import Engine
+from Engine import SearchError
+import Results
+
+
+class LocalClient:
+    """
+    Searches on the CPU, with the same interface as Client.
+
+    LocalClient runs the searches in this process with Engine, which follows
+    the appliance's integer distances and result ordering, so its results
+    can be used in place of the appliance's. It is a fallback for when the
+    appliance isn't available, or for jobs too small to be worth sending.
+
+    Batch queries are split into mini-batches which are searched in
+    parallel on a thread pool. A dataset of 1-bit components, given as a
+    boolean array, is stored and searched packed eight components to a
+    byte (see Engine.pack_bits). Errors are raised as Engine.SearchError,
+    which is an IOError with the same message as the appliance's error.
+    """
+
+    def __init__(self, threads=None, seed=0):
+        """
+        :type threads: integer
+        :param threads: Number of threads to search with, defaulting to the
+                        number of CPUs.
+
+        :type seed: integer
+        :param seed: Seed for random datasets.
+        """
+        self.threads = threads or os.cpu_count() or 1
+        self.seed = seed
+
+        # The settings made on this client.
+        self.session = Session()
+
+        self.dataset = None
+
+        # Whether the dataset is 1-bit components, stored packed.
+        self.dataset_packed = False
+
+        # Time spent searching, in nanoseconds.
+        self.timer = 0
+
+        self.__executor = None
+
+    def set_keepalive(self, after_idle_sec=7200, interval_sec=75, max_fails=8):
+        # There is no connection to keep alive.
+        pass
+
+    def open(self, host=None, port=None, api_key=None):
+        """
+        Start the search threads. The arguments are accepted for
+        compatibility with Client.open, and are ignored.
+        """
+        self.api_key = api_key
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.threads)
+
+    def close(self):
+        """
+        Stop the search threads.
+        """
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
+
+    def reset(self):
+        """
+        Clear the dataset.
+        """
+        self.dataset = None
+        self.dataset_packed = False
+
+    def reset_timer(self):
+        """
+        Reset the search time measurement timer.
+        """
+        self.timer = 0
+
+    def get_timer_value(self):
+        """
+        Get the time spent searching, in nanoseconds.
+        """
+        return self.timer
+
+    def set_distance_mode(self, mode):
+        """
+        Set the distance metric.
+
+        :type mode: Common.DistanceMode
+        :param mode: Distance metric from Common.DistanceMode
+
+        """
+        try:
+            self.session.distance_mode = DistanceMode(mode)
+        except ValueError:
+            raise SearchError(Status.DISTANCE_MODE_NOT_SUPPORTED)
+
+    def set_query_mode(self, mode):
+        """
+        Set query mode
+
+        :type mode: Common.QueryMode
+        :param mode: Query mode from Common.QueryMode
+
+        """
+        try:
+            self.session.query_mode = QueryMode(mode)
+        except ValueError:
+            raise SearchError(Status.QUERY_MODE_NOT_SUPPORTED)
+
+    def set_read_count(self, count):
+        """
+        Set query result count for KNN_D/KNN_A query mode(s)
+
+        :type count: integer
+        :param count: The top 'K' values in KNN
+
+        """
+        if count <= 0:
+            raise SearchError(Status.READ_COUNT_NOT_SUPPORTED)
+
+        self.session.read_count = count
+
+    def set_threshold(self, threshold):
+        """
+        Set query threshold for GT, LT, or KNN query modes. See
+        Client.set_threshold.
+
+        :type threshold: integer
+        :param threshold: The threshold value.
+        """
+        self.session.threshold = (threshold, None)
+
+    def set_threshold_range(self, threshold_lower, threshold_upper):
+        """
+        Set query threshold for RANGE query mode.
+
+        :type threshold_lower: integer
+        :param threshold_lower: Lower threshold value.
+
+        :type threshold_upper: integer
+        :param threshold_upper: Upper threshold value.
+
+        """
+        self.session.threshold = (threshold_lower, threshold_upper)
+
+    def ds_load(self, vectors, component_type=None):
+        """
+        Load a dataset.
+
+        :type vectors: list of lists or numpy.ndarray
+        :param vectors: List of vectors (component lists), or a 2-D array
+                        with one vector per row. A boolean array is a
+                        dataset of 1-bit components, which is stored packed
+                        whatever the distance mode.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+
+        """
+        if component_type is None and isinstance(vectors, np.ndarray) and vectors.dtype == bool:
+            component_type = ComponentType.BIT
+
+        vectors, component_type = encode_vectors(vectors, component_type)
+
+        if vectors.ndim != 2 or vectors.size == 0:
+            raise ValueError('Invalid argument')
+
+        self.dataset_packed = component_type == ComponentType.BIT
+        self.dataset = Engine.align_bits(vectors) if self.dataset_packed else vectors
+
+    def ds_load_stream(self, source, n_vectors=None, chunk_size=1 << 24, component_type=None, verbose=True):
+        """
+        Load a dataset given as an array-like or an iterable of blocks of
+        rows, as for Client.ds_load_stream. The dataset is searched in
+        memory, so the blocks are gathered into one array; an np.memmap is
+        used in place, without reading it.
+
+        :rtype: float
+        :return: The load throughput, in bytes per second.
+        """
+        t0 = time.time()
+
+        if component_type is None:
+            component_type = getattr(source, 'component_type', None)
+
+        if hasattr(source, 'shape') and len(source.shape) == 2:
+            vectors = source if isinstance(source, np.ndarray) else source[:]
+        else:
+            vectors = np.concatenate([np.asarray(block) for block in source])
+            if n_vectors is not None and len(vectors) != n_vectors:
+                raise ValueError('Invalid argument')
+
+        self.ds_load(vectors, component_type)
+
+        return self.dataset.nbytes / max(time.time() - t0, 1E-9)
+
+    def load_dataset_file(self, file_name, dataset_name, component_type=None):
+        """
+        Load a dataset from a file. '.npy' files are memory mapped, and other
+        files are read as HDF5 (see Engine.read_dataset_file).
+
+        :type file_name: string
+        :param file_name: Local dataset file name
+
+        :type dataset_name: string
+        :param dataset_name: Local dataset name
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components stored in the file,
+                               which is checked if given.
+
+        """
+        dataset = Engine.read_dataset_file(file_name, dataset_name)
+
+        if dataset.ndim != 2 or component_type_of(dataset.dtype) is None:
+            raise SearchError(Status.INVALID_DATA)
+
+        if component_type is not None and component_type_of(dataset.dtype) != component_type:
+            raise SearchError(Status.INVALID_DATA)
+
+        self.dataset = dataset
+        self.dataset_packed = False
+
+    def ds_load_random(self, vector_count, comp_count):
+        """
+        Load a random dataset.
+
+        :type vector_count: integer
+        :param vector_count: Vector count to generate
+
+        :type comp_count: integer
+        :param comp_count: Vector's component count
+
+        """
+        rng = np.random.RandomState(self.seed)
+        self.dataset = rng.randint(0, 256, size=(vector_count, comp_count)).astype(np.uint8)
+        self.dataset_packed = False
+
+    def query(self, vectors, batch_size=128, verbose=True, window=1, component_type=None):
+        """
+        Query for single/multiple vector(s)
+
+        Returns the same results as Client.query. The queries are searched
+        in mini-batches of 'batch_size' queries on the thread pool. 'verbose'
+        and 'window' are accepted for compatibility with Client.query, and
+        are ignored.
+
+        :type vectors: list, list of lists or numpy.ndarray
+        :param vectors: A single query vector, or a matrix with one query
+                        vector per row. If the dataset is packed bits, the
+                        queries are 1-bit components too (any non-zero
+                        component is a 1).
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+
+        """
+        vectors, component_type = encode_vectors(vectors, component_type, self.session.distance_mode)
+
+        # Validate that 'vectors' is a non-empty vector or matrix.
+        if vectors.ndim not in (1, 2) or vectors.size == 0:
+            raise ValueError('Invalid argument')
+
+        queries = Engine.match_queries(np.atleast_2d(vectors), component_type == ComponentType.BIT,
+                                       self.dataset, self.dataset_packed)
+
+        t0 = time.perf_counter()
+        records, indptr = Engine.search(self.dataset, queries, self.session, self.__executor, batch_size,
+                                        self.dataset_packed)
+        self.timer += int((time.perf_counter() - t0) * 1E9)
+
+        # ======== Single Query ========
+        if vectors.ndim == 1:
+            return records
+
+        # ======== Batch Query ========
+        results = Results.ResultCollector(self.session.query_mode, len(vectors), self.session.read_count)
+        results.put(0, records, indptr)
+
+        return results.result()
+
+    def query_iter(self, source, batch_size=128, window=2, component_type=None):
+        """
+        Query a stream of query vectors in mini-batches, yielding
+        (offset, results) for each mini-batch, as Client.query_iter does.
+        The mini-batches are read and searched one after another; 'window'
+        is accepted for compatibility, and is ignored.
+        """
+        if batch_size <= 0:
+            raise ValueError('Invalid argument')
+
+        if component_type is None:
+            component_type = getattr(source, 'component_type', None)
+
+        offset = 0
+        for mini_batch in read_batches(source, batch_size):
+            if len(mini_batch) == 0:
+                continue
+
+            yield (offset, self.query(mini_batch, batch_size, component_type=component_type))
+            offset += len(mini_batch)
+
+    def query_from_file(self, file_name, dataset_name, output_name):
+        """
+        Not supported: the appliance's output file format is specific to
+        the appliance.
+        """
+        raise SearchError(Status.NOT_SUPPORTED)
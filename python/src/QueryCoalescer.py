@@ -0,0 +1,204 @@
+import asyncio
+import concurrent.futures
+import queue
+import threading
+import time
+
+import numpy as np
+
+from Common import *
+
+
+class QueryCoalescer:
+    """
+    Gathers single queries made from many threads or tasks into batch
+    queries.
+
+    Each single query is queued, and a dispatcher thread takes the queued
+    queries, waiting up to 'max_wait' seconds after the first one for up to
+    'max_batch' of them, and sends them as one batch query. Each caller
+    gets its own query's results, the same as a single Client.query would
+    return. Queries made while a batch is being searched are sent together
+    in the next batch, so under load the batches grow without waiting.
+
+    Queries of different lengths, types or component types are sent in
+    separate batches.
+
+    The client is only used by the dispatcher threads. With more than one
+    thread, it must be usable from several threads at once, such as a
+    ClientPool, ReplicaClient or LocalClient; with one, any client will do.
+    Settings are made on the client directly.
+    """
+
+    def __init__(self, client, max_batch=128, max_wait=0.002, threads=1):
+        """
+        :type client: Client.Client
+        :param client: Client to send the batch queries with, which has its
+                       settings and dataset already.
+
+        :type max_batch: integer
+        :param max_batch: Largest number of queries to send in one batch.
+
+        :type max_wait: float
+        :param max_wait: Seconds to wait for more queries after the first
+                         one of a batch arrives.
+
+        :type threads: integer
+        :param threads: Number of dispatcher threads, which is the number
+                        of batches which may be searched at once.
+        """
+        if max_batch <= 0 or max_wait < 0 or threads <= 0:
+            raise ValueError('Invalid argument')
+
+        self.client = client
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+
+        # Number of batches sent, and of queries in them.
+        self.batches = 0
+        self.queries = 0
+
+        # (arrival time, vector, component type, future) of each query which
+        # hasn't been sent, oldest first.
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__closed = False
+
+        self.__threads = [threading.Thread(target=self.__run) for i in range(threads)]
+        for thread in self.__threads:
+            thread.daemon = True
+            thread.start()
+
+    def __run(self):
+        while True:
+            item = self.__queue.get()
+            if item is None:
+                return
+
+            # Take the queries which arrive up to 'max_wait' after the
+            # first. If it has waited that long already, take only those
+            # queued.
+            batch = [item]
+            deadline = item[0] + self.max_wait
+            stop = False
+
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.__queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self.__send(batch)
+
+            if stop:
+                return
+
+    def __send(self, batch):
+        # Send the queries which haven't been cancelled, a batch for each
+        # vector length, type and component type, and complete their
+        # futures.
+        groups = {}
+        for (arrival, vector, component_type, future) in batch:
+            if future.set_running_or_notify_cancel():
+                key = (len(vector), vector.dtype, component_type)
+                groups.setdefault(key, []).append((vector, future))
+
+        for ((length, dtype, component_type), group) in groups.items():
+            try:
+                vectors = np.stack([vector for (vector, future) in group])
+                results = self.client.query(vectors, batch_size=len(group), component_type=component_type)
+            except Exception as e:
+                for (vector, future) in group:
+                    future.set_exception(e)
+                continue
+
+            with self.__lock:
+                self.batches += 1
+                self.queries += len(group)
+
+            # Copy each query's results, so they don't hold on to the whole
+            # batch's.
+            for (i, (vector, future)) in enumerate(group):
+                future.set_result(np.array(results[i]))
+
+    def submit(self, vector, component_type=None):
+        """
+        Queue a single query.
+
+        :type vector: list or numpy.ndarray
+        :param vector: The query vector.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+
+        :rtype: concurrent.futures.Future
+        :return: A future for the query's results.
+        """
+        vector = np.asarray(vector)
+
+        # Validate that 'vector' is a non-empty vector.
+        if vector.ndim != 1 or vector.size == 0:
+            raise ValueError('Invalid argument')
+
+        future = concurrent.futures.Future()
+
+        with self.__lock:
+            if self.__closed:
+                raise IOError('The query coalescer is closed.')
+
+            self.__queue.put((time.monotonic(), vector, component_type, future))
+
+        return future
+
+    def query(self, vector, component_type=None):
+        """
+        Query for a single vector, waiting for it to be sent in a batch.
+        Returns the same results as Client.query.
+
+        :type vector: list or numpy.ndarray
+        :param vector: The query vector.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+        """
+        return self.submit(vector, component_type).result()
+
+    async def query_async(self, vector, component_type=None):
+        """
+        Query for a single vector from an asyncio task, without blocking the
+        event loop. Returns the same results as Client.query.
+
+        :type vector: list or numpy.ndarray
+        :param vector: The query vector.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+        """
+        return await asyncio.wrap_future(self.submit(vector, component_type))
+
+    def close(self):
+        """
+        Send the queued queries, and stop the dispatcher threads. The client
+        isn't closed.
+        """
+        with self.__lock:
+            if self.__closed:
+                return
+            self.__closed = True
+
+            for thread in self.__threads:
+                self.__queue.put(None)
+
+        for thread in self.__threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,648 @@
+import collections
+import concurrent.futures
+import contextlib
+import threading
+import time
+
+import numpy as np
+
+from Common import *
+from Client import Session
+from ClientPool import ClientPool
+import Results
+
+
+class Replica:
+    """
+    One appliance of a ReplicaClient: its connections, and the requests made
+    to it.
+    """
+
+    def __init__(self, host, port, api_key, connections, history, timeout):
+        self.host = host
+        self.port = port
+        self.api_key = api_key
+        self.connections = connections
+        self.timeout = timeout
+
+        # The connections to the appliance, or None until it is opened, and
+        # the number of requests using each pool of connections, which is
+        # closed when it has been replaced and the last request is done.
+        self.pool = None
+        self.borrowed = {}
+        self.lock = threading.Lock()
+
+        # Incremented each time the connections are opened, so that the
+        # failure of a request made on the old connections doesn't count
+        # against the new ones.
+        self.generation = 0
+
+        # Whether the connections must be opened before the next request.
+        self.needs_open = True
+        self.open_lock = threading.Lock()
+
+        # Number of requests sent and not yet answered.
+        self.outstanding = 0
+
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.ejections = 0
+
+        # Connection failures since the last successful request, and the
+        # time.monotonic() until which the replica is ejected.
+        self.failures = 0
+        self.ejected_until = 0.0
+
+        # The latencies of the latest single queries and requests of batch
+        # queries, in seconds.
+        self.latencies = {'query': collections.deque(maxlen=history),
+                          'batch': collections.deque(maxlen=history)}
+
+    def open(self, session, dataset_load):
+        """
+        Open new connections to the appliance, and make 'session' on them.
+        The dataset is loaded if 'dataset_load' is given, as (name, args)
+        of the Client method which loads it.
+        """
+        # Reconnect at once if a connection has dropped, but give up after
+        # one attempt, so the request goes to another replica.
+        pool = ClientPool(self.connections, max_retries=1, retry_delay=0.0, timeout=self.timeout)
+        try:
+            pool.open(self.host, self.port, self.api_key)
+            session.apply(pool)
+
+            if dataset_load is not None:
+                (name, args) = dataset_load
+                getattr(pool, name)(*args)
+        except BaseException:
+            pool.close()
+            raise
+
+        self.__replace(pool)
+
+    def close(self):
+        self.__replace(None)
+        self.needs_open = True
+
+    def __replace(self, pool):
+        # Make 'pool' the connections for new requests, and close the old
+        # ones unless requests are still using them.
+        with self.lock:
+            (old, self.pool) = (self.pool, pool)
+            self.generation += 1
+            idle = old is not None and old not in self.borrowed
+
+        if idle:
+            old.close()
+
+    @contextlib.contextmanager
+    def borrow(self):
+        """
+        Use the current connections to the appliance, as (pool, generation).
+        """
+        with self.lock:
+            (pool, generation) = (self.pool, self.generation)
+            if pool is None:
+                raise IOError('%s:%d is not open.' % (self.host, self.port))
+            self.borrowed[pool] = self.borrowed.get(pool, 0) + 1
+
+        try:
+            yield (pool, generation)
+        finally:
+            # The last request using replaced connections closes them.
+            with self.lock:
+                self.borrowed[pool] -= 1
+                if self.borrowed[pool] == 0:
+                    del self.borrowed[pool]
+                replaced = pool not in self.borrowed and pool is not self.pool
+
+            if replaced:
+                pool.close()
+
+    def healthy(self, now):
+        return now >= self.ejected_until
+
+    def stats(self):
+        """
+        Returns the request counts and latency percentiles of this replica
+        as a dict.
+        """
+        stats = {
+            'host': self.host,
+            'port': self.port,
+            'healthy': self.healthy(time.monotonic()),
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'errors': self.errors,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'ejections': self.ejections,
+        }
+
+        for (kind, latencies) in self.latencies.items():
+            samples = np.array(latencies)
+            for (name, q) in (('p50', 50), ('p95', 95), ('p99', 99)):
+                stats['%s_%s' % (kind, name)] = float(np.percentile(samples, q)) if len(samples) else None
+
+        return stats
+
+
+class ReplicaClient:
+    """
+    Client for a dataset which is held whole on each of several Nearist
+    appliances (replicas).
+
+    Each query, or each 'window' mini-batches of a batch query, is sent to
+    the healthy replica with the fewest requests outstanding, and is sent
+    again to another replica if the connection fails. A single query which hasn't
+    been answered after the 'hedge_percentile' latency of recent single
+    queries is also sent to a second replica (a hedged request), and the
+    first response is used.
+
+    A replica whose connection fails 'eject_after' times in a row is
+    ejected: no requests are sent to it for 'eject_time' seconds, after
+    which its connections are opened again, with the settings and dataset
+    made through the ReplicaClient. If every replica is ejected, requests
+    are sent to the ejected replicas anyway.
+
+    Settings and datasets loaded through the ReplicaClient are made on
+    every replica.
+    """
+
+    def __init__(self, endpoints, connections=2, hedge=True, hedge_percentile=95, hedge_delay=None,
+                 min_samples=20, eject_after=3, eject_time=30.0, history=1000, timeout=10.0):
+        """
+        :type endpoints: list
+        :param endpoints: (host, port, api_key) of each appliance.
+
+        :type connections: integer
+        :param connections: Number of connections to open to each appliance,
+                            which is the number of requests each can be
+                            sent at once.
+
+        :type hedge: bool
+        :param hedge: Whether to send hedged requests for single queries.
+
+        :type hedge_percentile: float
+        :param hedge_percentile: Percentile of the latency of recent single
+                                 queries (across all replicas) to wait for
+                                 before sending a hedged request.
+
+        :type hedge_delay: float
+        :param hedge_delay: Seconds to wait before sending a hedged request,
+                            in place of the percentile.
+
+        :type min_samples: integer
+        :param min_samples: Number of single queries to measure the latency
+                            of before the percentile is used. No hedged
+                            requests are sent until then, unless
+                            'hedge_delay' is given.
+
+        :type eject_after: integer
+        :param eject_after: Number of connection failures in a row after
+                            which a replica is ejected.
+
+        :type eject_time: float
+        :param eject_time: Seconds to eject a replica for.
+
+        :type history: integer
+        :param history: Number of recent requests to keep the latency of,
+                        for each replica.
+
+        :type timeout: float
+        :param timeout: Seconds to wait for a replica to connect, or to send
+                        or receive more of a request or response (see
+                        Client), before counting the request as a failed
+                        connection. A replica which hangs is ejected like
+                        one which fails.
+        """
+        if not endpoints or connections <= 0:
+            raise ValueError('Invalid argument')
+
+        self.replicas = [Replica(host, port, api_key, connections, history, timeout)
+                         for (host, port, api_key) in endpoints]
+
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.eject_after = eject_after
+        self.eject_time = eject_time
+
+        # The settings made on every replica.
+        self.session = Session()
+
+        # (name, args) of the Client method which loaded the dataset, to
+        # load it again on a replica which is opened again.
+        self.dataset_load = None
+
+        self.__lock = threading.Lock()
+        self.__executor = None
+
+    def open(self):
+        """
+        Open connections to all of the appliances. An appliance which can't
+        be reached is ejected, and IOError is raised only if none can be.
+        """
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=2 * sum(replica.connections for replica in self.replicas))
+
+        error = None
+        for replica in self.replicas:
+            try:
+                replica.open(self.session, self.dataset_load)
+                replica.needs_open = False
+            except IOError as e:
+                error = e
+                self.__fail(replica, replica.generation)
+
+        if all(replica.needs_open for replica in self.replicas):
+            raise error
+
+    def close(self):
+        """
+        Close the connections to all of the appliances.
+        """
+        for replica in self.replicas:
+            replica.close()
+
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+
+    def eject(self, index, duration=None):
+        """
+        Eject a replica: send it no requests for 'duration' seconds
+        ('eject_time' by default).
+
+        :type index: integer
+        :param index: Index of the replica in 'endpoints'.
+        """
+        replica = self.replicas[index]
+        with self.__lock:
+            replica.ejected_until = time.monotonic() + (self.eject_time if duration is None else duration)
+            replica.ejections += 1
+
+    def readmit(self, index):
+        """
+        Send requests to an ejected replica again.
+
+        :type index: integer
+        :param index: Index of the replica in 'endpoints'.
+        """
+        replica = self.replicas[index]
+        with self.__lock:
+            replica.ejected_until = 0.0
+            replica.failures = 0
+
+    def stats(self):
+        """
+        Returns the request counts and latencies of each replica, as a list
+        of dicts in 'endpoints' order. The latencies are in seconds, and
+        are percentiles ('query_p50', 'query_p95', 'query_p99' for single
+        queries and 'batch_p50'... for the requests of batch queries) of
+        the latest 'history' requests, or None if there are none yet.
+        """
+        with self.__lock:
+            return [replica.stats() for replica in self.replicas]
+
+    def __fail(self, replica, generation):
+        # Count a connection failure of 'replica', and eject it after
+        # 'eject_after' in a row. Called with the lock held, or before any
+        # requests are made.
+        replica.errors += 1
+
+        if generation != replica.generation:
+            return
+
+        replica.failures += 1
+        if replica.failures >= self.eject_after or replica.needs_open:
+            if replica.healthy(time.monotonic()):
+                replica.ejections += 1
+            replica.ejected_until = time.monotonic() + self.eject_time
+            replica.needs_open = True
+
+    def __acquire(self, exclude, hedge):
+        # Choose the replica to send a request to: the healthy replica with
+        # the fewest outstanding requests, or the ejected replica which is
+        # due back soonest if there are no healthy ones. Replicas in
+        # 'exclude' aren't chosen, and the chosen one is added to it.
+        with self.__lock:
+            now = time.monotonic()
+            candidates = [replica for replica in self.replicas if replica not in exclude]
+            if not candidates:
+                return None
+
+            healthy = [replica for replica in candidates if replica.healthy(now)]
+            if healthy:
+                replica = min(healthy, key=lambda replica: replica.outstanding)
+            else:
+                replica = min(candidates, key=lambda replica: replica.ejected_until)
+
+            exclude.add(replica)
+            replica.outstanding += 1
+            replica.requests += 1
+            if hedge:
+                replica.hedges += 1
+
+        return replica
+
+    def __send(self, replica, kind, call):
+        # Make the request 'call(client)' on a connection to 'replica', and
+        # record its latency or failure. The request has been counted as
+        # outstanding by __acquire.
+        t0 = time.perf_counter()
+        generation = replica.generation
+
+        try:
+            # An ejected replica is opened again before it is used.
+            if replica.needs_open:
+                with replica.open_lock:
+                    if replica.needs_open:
+                        replica.open(self.session, self.dataset_load)
+                        replica.needs_open = False
+
+            with replica.borrow() as (pool, generation):
+                with pool.connection() as c:
+                    result = call(c)
+
+        except SearchError:
+            with self.__lock:
+                replica.outstanding -= 1
+            raise
+
+        except IOError:
+            with self.__lock:
+                replica.outstanding -= 1
+                self.__fail(replica, generation)
+            raise
+
+        with self.__lock:
+            replica.outstanding -= 1
+            replica.failures = 0
+            replica.latencies[kind].append(time.perf_counter() - t0)
+
+        return result
+
+    def __request(self, kind, call, tried, hedge=False):
+        # Make the request 'call(client)' on a replica not in 'tried', and on
+        # another one each time the connection fails. Returns (replica,
+        # result).
+        error = None
+
+        while True:
+            replica = self.__acquire(tried, hedge)
+            if replica is None:
+                raise error or IOError('No replica is available.')
+
+            try:
+                return (replica, self.__send(replica, kind, call))
+            except SearchError:
+                raise
+            except IOError as e:
+                error = e
+
+    def __current_hedge_delay(self):
+        # Seconds to wait for a single query before hedging it, or None if
+        # there aren't enough samples yet.
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+
+        with self.__lock:
+            samples = [latency for replica in self.replicas for latency in replica.latencies['query']]
+
+        if len(samples) < self.min_samples:
+            return None
+
+        return float(np.percentile(samples, self.hedge_percentile))
+
+    def __hedged_request(self, call):
+        # Make a single query request, hedged with a second replica if it
+        # takes longer than the hedge delay, and return the first result.
+        tried = set()
+        futures = {self.__executor.submit(self.__request, 'query', call, tried): False}
+
+        delay = self.__current_hedge_delay() if self.hedge and len(self.replicas) > 1 else None
+        if delay is not None:
+            (done, pending) = concurrent.futures.wait(futures, timeout=delay)
+
+            # Hedge only if the first request is still waiting, and there is
+            # another replica to send it to.
+            if not done and len(tried) < len(self.replicas):
+                futures[self.__executor.submit(self.__request, 'query', call, tried, True)] = True
+
+        error = None
+        pending = set(futures)
+        while pending:
+            (done, pending) = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    (replica, result) = future.result()
+                except SearchError:
+                    raise
+                except IOError as e:
+                    error = e
+                    continue
+
+                # The other request is left to complete on its own, or is
+                # cancelled if it hasn't started.
+                for other in pending:
+                    other.cancel()
+
+                if futures[future]:
+                    with self.__lock:
+                        replica.hedge_wins += 1
+
+                return result
+
+        raise error
+
+    def __broadcast(self, name, *args):
+        # Call the ClientPool method 'name' on every replica which is open. A
+        # replica whose connection fails is ejected, and opened again with
+        # the current settings and dataset when it is readmitted.
+        def call(replica):
+            with replica.borrow() as (pool, generation):
+                return getattr(pool, name)(*args)
+
+        futures = {}
+        for replica in self.replicas:
+            if not replica.needs_open:
+                futures[replica] = (replica.generation, self.__executor.submit(call, replica))
+
+        results = []
+        error = None
+        for (replica, (generation, future)) in futures.items():
+            try:
+                results.append(future.result())
+            except SearchError:
+                raise
+            except IOError as e:
+                error = e
+                with self.__lock:
+                    self.__fail(replica, generation)
+                    replica.needs_open = True
+
+        if not results and error is not None:
+            raise error
+
+        return results
+
+    def __configure(self, name, *args):
+        # Make a setting on every replica, and record it in the session.
+        self.__broadcast(name, *args)
+        getattr(self.session, name)(*args)
+
+    def __load(self, name, *args):
+        # Load the dataset on every replica, and record how it was loaded.
+        self.__broadcast(name, *args)
+        self.dataset_load = (name, args)
+
+    def reset(self):
+        """
+        Reset every appliance, clearing all stored data.
+        """
+        self.__broadcast('reset')
+        self.dataset_load = None
+
+    def reset_timer(self):
+        """
+        Reset the board time measurement timer of every appliance.
+        """
+        self.__broadcast('reset_timer')
+
+    def get_timer_value(self):
+        """
+        Get board time measurement in nanoseconds. The replicas share the
+        work, so this is the total time of all of the replicas.
+        """
+        return sum(self.__broadcast('get_timer_value'))
+
+    def set_distance_mode(self, mode):
+        """
+        Set the distance metric on every replica.
+
+        :type mode: Common.DistanceMode
+        :param mode: Distance metric from Common.DistanceMode
+
+        """
+        self.__configure('set_distance_mode', mode)
+
+    def set_query_mode(self, mode):
+        """
+        Set query mode on every replica.
+
+        :type mode: Common.QueryMode
+        :param mode: Query mode from Common.QueryMode
+
+        """
+        self.__configure('set_query_mode', mode)
+
+    def set_read_count(self, count):
+        """
+        Set query result count for KNN_D/KNN_A query mode(s) on every
+        replica.
+
+        :type count: integer
+        :param count: The top 'K' values in KNN
+
+        """
+        self.__configure('set_read_count', count)
+
+    def set_threshold(self, threshold):
+        """
+        Set query threshold for GT, LT, or KNN query modes on every replica.
+
+        :type threshold: integer
+        :param threshold: The threshold value.
+        """
+        self.__configure('set_threshold', threshold)
+
+    def set_threshold_range(self, threshold_lower, threshold_upper):
+        """
+        Set query threshold for RANGE query mode on every replica.
+
+        :type threshold_lower: integer
+        :param threshold_lower: Lower threshold value.
+
+        :type threshold_upper: integer
+        :param threshold_upper: Upper threshold value.
+
+        """
+        self.__configure('set_threshold_range', threshold_lower, threshold_upper)
+
+    def ds_load(self, vectors, component_type=None):
+        """
+        Load the same dataset onto every appliance. See Client.ds_load.
+        """
+        vectors, component_type = encode_vectors(vectors, component_type, self.session.distance_mode)
+        self.__load('ds_load', vectors, component_type)
+
+    def load_dataset_file(self, file_name, dataset_name, component_type=None):
+        """
+        Load a dataset file, which must be present on every appliance. See
+        Client.load_dataset_file.
+        """
+        self.__load('load_dataset_file', file_name, dataset_name, component_type)
+
+    def query(self, vectors, batch_size=128, verbose=True, window=1, component_type=None):
+        """
+        Query for single/multiple vector(s)
+
+        Takes the same arguments as Client.query, and returns the same
+        results. A single query is hedged (see ReplicaClient). The
+        mini-batches of a batch query are sent 'window' at a time to the
+        replica with the fewest outstanding requests, and their results are
+        reassembled in query order. 'verbose' is accepted for compatibility
+        with Client.query, and is ignored.
+
+        :type vectors: list, list of lists or numpy.ndarray
+        :param vectors: A single query vector, or a matrix with one query
+                        vector per row.
+
+        :type window: integer
+        :param window: Number of mini-batches sent to a replica at a time,
+                       which it keeps in flight at once (see Client.query).
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+
+        """
+        vectors, component_type = encode_vectors(vectors, component_type, self.session.distance_mode)
+
+        # Validate that 'vectors' is a non-empty vector or matrix, and that
+        # the mini-batches can be sent.
+        if vectors.ndim not in (1, 2) or vectors.size == 0 or batch_size <= 0 or window <= 0:
+            raise ValueError('Invalid argument')
+
+        # ======== Single Query ========
+        if vectors.ndim == 1:
+            return self.__hedged_request(lambda c: c.query(vectors, component_type=component_type))
+
+        # ======== Batch Query ========
+        results = Results.ResultCollector(self.session.query_mode, len(vectors), self.session.read_count)
+        results_lock = threading.Lock()
+
+        # Each request holds 'window' mini-batches, which Client.query
+        # pipelines.
+        chunk_size = batch_size * window
+
+        def query_chunk(start):
+            chunk = vectors[start:start + chunk_size]
+            (replica, chunk_res) = self.__request(
+                'batch', lambda c: c.query(chunk, batch_size=batch_size, verbose=False, window=window,
+                                           component_type=component_type), set())
+
+            with results_lock:
+                results.add(start, chunk_res)
+
+        futures = [self.__executor.submit(query_chunk, start) for start in range(0, len(vectors), chunk_size)]
+
+        # Raise the first error, if any.
+        for future in futures:
+            future.result()
+
+        return results.result()
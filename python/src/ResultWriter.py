@@ -0,0 +1,422 @@
+"""
+Writers which stream the results of a batch query to disk.
+
+A ResultWriter takes the results of each mini-batch of a batch query (as
+yielded by Client.query_iter) and writes them into preallocated arrays on
+disk from a writer thread, so the results are never all in memory. At most
+'max_pending' mini-batches are queued for the writer thread; putting more
+waits for it to catch up.
+
+    with ResultWriter.open_writer('results.npy', len(queries), k=10) as writer:
+        writer.put_all(client.query_iter(queries, batch_size=256))
+
+The results are stored as (n_queries, k) arrays of ds_ids and distances,
+one row per query. Queries which returned fewer than 'k' results are
+padded with Common.RESULT_SENTINEL, as in Results.ResultSet. The rows of
+queries whose results are never put are left zero (or the sentinel, in
+HDF5).
+
+Only k-NN results (Results.ResultSet) can be written, since the number of
+results of the threshold query modes isn't known in advance.
+
+Each writer keeps a checkpoint file next to its output, listing the ranges
+of queries whose results have been flushed to disk. A writer created with
+resume=True reopens the output and its checkpoint, and 'remaining' gives
+the queries which still need to be run (see Client.query_resumable).
+"""
+
+import json
+import mmap
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from Common import *
+import Results
+
+CHECKPOINT_SUFFIX = '.checkpoint'
+"""
+Suffix added to the output's file name to name its checkpoint file.
+"""
+
+
+def _merge_ranges(ranges):
+    # Sort [start, end) ranges and join the ones which touch or overlap.
+    merged = []
+    for (start, end) in sorted((start, end) for (start, end) in ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    return merged
+
+
+def _can_resume(path):
+    return os.path.exists(path) and os.path.exists(path + CHECKPOINT_SUFFIX)
+
+
+class ResultWriter:
+    """
+    Base class of the result writers, which runs the writer thread.
+
+    Subclasses store the rows of results in _write, and write them to disk
+    in _flush and _close.
+    """
+
+    def __init__(self, n_queries, k, max_pending=4, flush_interval=5.0, flush_size=1 << 26, checkpoint=None,
+                 resume=False):
+        """
+        :type n_queries: integer
+        :param n_queries: Number of queries in the batch query.
+
+        :type k: integer
+        :param k: Number of results per query (the read count).
+
+        :type max_pending: integer
+        :param max_pending: Number of mini-batches which may wait to be
+                            written.
+
+        :type flush_interval: float
+        :param flush_interval: Seconds between flushes to disk.
+
+        :type flush_size: integer
+        :param flush_size: Number of bytes of results after which to flush,
+                           whatever the time. The memory holding results
+                           which have been flushed is released, so this
+                           bounds the memory the writer uses.
+
+        :type checkpoint: string
+        :param checkpoint: Name of the checkpoint file, or None for no
+                           checkpoint.
+
+        :type resume: bool
+        :param resume: Whether to read the ranges already written from the
+                       checkpoint file, rather than start a new one.
+        """
+        if n_queries < 0 or k <= 0 or max_pending <= 0:
+            raise ValueError('Invalid argument')
+
+        self.n_queries = n_queries
+        self.k = k
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        # Number of queries whose results have been written.
+        self.written = 0
+
+        # [start, end) ranges of the queries whose results are on disk, and
+        # of those written since the last flush.
+        self.checkpoint = checkpoint
+        self.completed = []
+        self.__unflushed = []
+        self.__lock = threading.Lock()
+
+        if resume:
+            with open(checkpoint, 'r') as f:
+                root = json.load(f)
+
+            if root["queryCount"] != n_queries or root["readCount"] != k:
+                raise ValueError('Checkpoint %s is for %d queries of %d results.' %
+                                 (checkpoint, root["queryCount"], root["readCount"]))
+
+            self.completed = _merge_ranges(root["completed"])
+            self.written = sum(end - start for (start, end) in self.completed)
+        else:
+            self.__save_checkpoint()
+
+        self.__pending = queue.Queue(maxsize=max_pending)
+        self.__error = None
+        self.__closed = False
+
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __run(self):
+        last_flush = time.time()
+        unflushed = 0
+
+        while True:
+            try:
+                item = self.__pending.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = ()
+
+            # After an error, keep taking mini-batches so put doesn't block,
+            # but don't write them.
+            if item is None:
+                return
+            if item and self.__error is None:
+                try:
+                    (offset, results) = item
+                    self._write(offset, results.records)
+                    self.written += len(results)
+                    self.__unflushed.append((offset, offset + len(results)))
+                    unflushed += len(results) * self.k * RESULT_DTYPE.itemsize
+                except Exception as e:
+                    self.__error = e
+
+            if (unflushed >= self.flush_size or time.time() - last_flush >= self.flush_interval) and \
+                    self.__error is None:
+                try:
+                    self._flush()
+                    self.__save_checkpoint()
+                except Exception as e:
+                    self.__error = e
+                last_flush = time.time()
+                unflushed = 0
+
+    def __save_checkpoint(self):
+        # Add the ranges written since the last flush to the completed
+        # ranges, and write them to the checkpoint file. The file is
+        # replaced in one step, so it is never half written.
+        with self.__lock:
+            self.completed = _merge_ranges(self.completed + self.__unflushed)
+            self.__unflushed = []
+            completed = list(self.completed)
+
+        if self.checkpoint is None:
+            return
+
+        root = {"queryCount": self.n_queries, "readCount": self.k, "completed": completed}
+
+        with open(self.checkpoint + '.tmp', 'w') as f:
+            f.write(json.dumps(root))
+        os.replace(self.checkpoint + '.tmp', self.checkpoint)
+
+    def remaining(self):
+        """
+        Returns the [start, end) ranges of the queries whose results have
+        not been flushed to disk, in order.
+        """
+        with self.__lock:
+            completed = list(self.completed)
+
+        ranges = []
+        start = 0
+        for (end, next_start) in completed + [[self.n_queries, self.n_queries]]:
+            if end > start:
+                ranges.append((start, end))
+            start = next_start
+
+        return ranges
+
+    def __check(self):
+        # Raise the error from the writer thread, if any.
+        if self.__error is not None:
+            raise self.__error
+
+    def put(self, offset, results):
+        """
+        Queue the results of the mini-batch of queries starting at query
+        'offset' to be written. Waits if 'max_pending' mini-batches are
+        already waiting.
+
+        Errors from the writer thread are raised by the next put or close.
+
+        :type offset: integer
+        :param offset: Index of the mini-batch's first query.
+
+        :type results: Results.ResultSet
+        :param results: The results of the mini-batch.
+        """
+        self.__check()
+
+        if self.__closed:
+            raise ValueError('Invalid argument')
+
+        if not isinstance(results, Results.ResultSet):
+            raise ValueError('Only k-NN results (Results.ResultSet) can be written.')
+
+        if offset < 0 or offset + len(results) > self.n_queries or results.k > self.k:
+            raise ValueError('Invalid argument')
+
+        self.__pending.put((offset, results))
+
+    def put_all(self, batches):
+        """
+        Write the results of every mini-batch from an iterable of
+        (offset, results), such as Client.query_iter.
+        """
+        for (offset, results) in batches:
+            self.put(offset, results)
+
+    def close(self):
+        """
+        Wait for the queued results to be written, and close the file.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+
+        self.__pending.put(None)
+        self.__thread.join()
+
+        # The results written before any error are still recorded.
+        self._close()
+        self.__save_checkpoint()
+
+        self.__check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _rows(self, records):
+        # The mini-batch's rows padded to 'k' results, as (ds_ids, distances).
+        ids = np.full((len(records), self.k), RESULT_SENTINEL, dtype=np.uint64)
+        distances = np.full((len(records), self.k), RESULT_SENTINEL, dtype=np.uint64)
+
+        ids[:, :records.shape[1]] = records['ds_id']
+        distances[:, :records.shape[1]] = records['distance']
+
+        return (ids, distances)
+
+    def _write(self, offset, records):
+        raise NotImplementedError()
+
+    def _flush(self):
+        pass
+
+    def _close(self):
+        pass
+
+
+def _release(array):
+    # Write the changes to a memory mapped array to disk, and drop its pages
+    # from memory, so the memory used doesn't grow with the file.
+    array.flush()
+
+    mapping = getattr(array, '_mmap', None)
+    if mapping is not None and hasattr(mapping, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+        mapping.madvise(mmap.MADV_DONTNEED)
+
+
+class NpyResultWriter(ResultWriter):
+    """
+    Writes the results to a .npy file holding an (n_queries, k) array of
+    Common.RESULT_DTYPE, which is filled in through a memory map. Read it
+    with numpy.load(path, mmap_mode='r').
+    """
+
+    def __init__(self, path, n_queries, k, resume=False, **kwargs):
+        """
+        :type path: string
+        :param path: Name of the .npy file to write.
+
+        :type resume: bool
+        :param resume: Whether to continue writing 'path', if it and its
+                       checkpoint exist, rather than create it.
+
+        The other arguments are as for ResultWriter.
+        """
+        self.path = path
+
+        resume = resume and _can_resume(path)
+        if resume:
+            self.records = np.lib.format.open_memmap(path, mode='r+')
+            if self.records.dtype != RESULT_DTYPE or self.records.shape != (n_queries, k):
+                raise ValueError('%s does not hold %d x %d results.' % (path, n_queries, k))
+        else:
+            self.records = np.lib.format.open_memmap(path, mode='w+', dtype=RESULT_DTYPE, shape=(n_queries, k))
+
+        ResultWriter.__init__(self, n_queries, k, checkpoint=path + CHECKPOINT_SUFFIX, resume=resume, **kwargs)
+
+    def _write(self, offset, records):
+        (ids, distances) = self._rows(records)
+        self.records['ds_id'][offset:offset + len(records)] = ids
+        self.records['distance'][offset:offset + len(records)] = distances
+
+    def _flush(self):
+        _release(self.records)
+
+    def _close(self):
+        self.records.flush()
+        self.records = None
+
+
+class HDF5ResultWriter(ResultWriter):
+    """
+    Writes the results to an HDF5 file, as (n_queries, k) uint64 datasets
+    'ids' and 'distances', chunked by rows. Requires h5py.
+    """
+
+    def __init__(self, path, n_queries, k, chunk_rows=4096, resume=False, **kwargs):
+        """
+        :type path: string
+        :param path: Name of the HDF5 file to write.
+
+        :type chunk_rows: integer
+        :param chunk_rows: Number of rows per chunk of the datasets.
+
+        :type resume: bool
+        :param resume: Whether to continue writing 'path', if it and its
+                       checkpoint exist, rather than create it.
+
+        The other arguments are as for ResultWriter.
+        """
+        import h5py
+
+        self.path = path
+
+        resume = resume and _can_resume(path)
+        if resume:
+            self.h5f = h5py.File(path, 'r+')
+            (self.ids, self.distances) = (self.h5f['ids'], self.h5f['distances'])
+            if self.ids.shape != (n_queries, k):
+                raise ValueError('%s does not hold %d x %d results.' % (path, n_queries, k))
+        else:
+            self.h5f = h5py.File(path, 'w')
+
+            chunks = (max(1, min(chunk_rows, n_queries)), k)
+            self.ids = self.h5f.create_dataset('ids', shape=(n_queries, k), dtype='<u8', chunks=chunks,
+                                               fillvalue=RESULT_SENTINEL)
+            self.distances = self.h5f.create_dataset('distances', shape=(n_queries, k), dtype='<u8',
+                                                     chunks=chunks, fillvalue=RESULT_SENTINEL)
+
+        ResultWriter.__init__(self, n_queries, k, checkpoint=path + CHECKPOINT_SUFFIX, resume=resume, **kwargs)
+
+    def _write(self, offset, records):
+        (ids, distances) = self._rows(records)
+        self.ids[offset:offset + len(records)] = ids
+        self.distances[offset:offset + len(records)] = distances
+
+    def _flush(self):
+        self.h5f.flush()
+
+    def _close(self):
+        self.h5f.close()
+
+
+def open_writer(path, n_queries, k, **kwargs):
+    """
+    Create a ResultWriter for 'path', choosing the format by its extension:
+    '.npy' (NpyResultWriter), and anything else HDF5 (HDF5ResultWriter).
+    Pass resume=True to continue an interrupted job.
+
+    Results can't be written as .nvx files (see VectorFile), which have no
+    place for the uint64 distances.
+
+    :type path: string
+    :param path: Name of the file to write.
+
+    :type n_queries: integer
+    :param n_queries: Number of queries in the batch query.
+
+    :type k: integer
+    :param k: Number of results per query (the read count).
+
+    :rtype: ResultWriter
+    """
+    if path.endswith('.npy'):
+        return NpyResultWriter(path, n_queries, k, **kwargs)
+    if path.endswith('.nvx'):
+        raise ValueError('Invalid argument')
+
+    return HDF5ResultWriter(path, n_queries, k, **kwargs)
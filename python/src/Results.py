@@ -0,0 +1,520 @@
+import numpy as np
+
+from Common import QueryMode, RESULT_DTYPE, RESULT_SENTINEL
+
+THRESHOLD_MODES = (QueryMode.GT, QueryMode.LT, QueryMode.EQ, QueryMode.RANGE)
+"""
+Query modes which return a variable number of results for each query.
+"""
+
+
+def decode(response, query_mode):
+    """
+    Decode the results of a response received from the appliance.
+
+    Responses without a body return the value of attribute 0 (for example,
+    the timer value). A single query returns a structured array of
+    Common.RESULT_DTYPE, and a batch query returns a ResultSet or a
+    SparseResultSet (see from_batch). The decoded results never refer to
+    the response body, so the body's buffer may be reused.
+
+    :type response: Common.Response
+    :param response: Response with its body received.
+
+    :type query_mode: Common.QueryMode
+    :param query_mode: The query mode the results were produced with.
+    """
+    if response.body_length == 0:
+        return response.attribute_0
+
+    if response.attribute_1 == 0:
+        return response.unpack_results().copy()
+    elif response.attribute_1 == 1:
+        records, indptr = response.unpack_results()
+        return from_batch(query_mode, records, indptr)
+
+    return []
+
+
+def from_batch(query_mode, records, indptr):
+    """
+    Build the result container for decoded batch results.
+
+    Threshold query modes (see THRESHOLD_MODES) produce a SparseResultSet,
+    and all other query modes produce a ResultSet.
+
+    :type query_mode: Common.QueryMode
+    :param query_mode: The query mode the results were produced with.
+
+    :type records: numpy.ndarray
+    :param records: Results of all queries, as returned by
+                    Common.Response.unpack_results.
+
+    :type indptr: numpy.ndarray
+    :param indptr: The results of query i are records[indptr[i]:indptr[i + 1]].
+    """
+    if query_mode in THRESHOLD_MODES:
+        return SparseResultSet(indptr, records)
+
+    return ResultSet.from_batch(records, indptr)
+
+
+class ResultSet:
+    """
+    Compact container for the results of a batch of k-NN queries.
+
+    The results are stored in a single (n_queries, k) structured array of
+    Common.RESULT_DTYPE. Queries which returned fewer than 'k' results have
+    their remaining entries set to RESULT_SENTINEL, and 'counts' records how
+    many results each query actually returned.
+
+    For backward compatibility, a ResultSet behaves like a list with one
+    entry per query: results[i] is a view of query i's results, and each
+    result can be indexed as result['ds_id'] and result['distance'].
+    """
+
+    fill = RESULT_SENTINEL
+    """
+    Value of the padding entries in short rows.
+    """
+
+    def __init__(self, records, counts=None):
+        """
+        :type records: numpy.ndarray
+        :param records: (n_queries, k) array of Common.RESULT_DTYPE.
+
+        :type counts: numpy.ndarray
+        :param counts: Number of results for each query, defaults to 'k' for
+                       every query.
+        """
+        self.records = records
+
+        if counts is None:
+            counts = np.full(records.shape[0], records.shape[1], dtype=np.int64)
+        self.counts = counts
+
+    @classmethod
+    def empty(cls, n_queries, k):
+        """
+        Create a ResultSet with room for 'k' results for each of 'n_queries'
+        queries, and no results stored yet.
+        """
+        records = np.empty((n_queries, k), dtype=RESULT_DTYPE)
+        records['ds_id'] = cls.fill
+        records['distance'] = cls.fill
+
+        return cls(records, np.zeros(n_queries, dtype=np.int64))
+
+    @classmethod
+    def from_batch(cls, records, indptr, k=None):
+        """
+        Build a ResultSet from decoded batch results.
+
+        :type records: numpy.ndarray
+        :param records: Results of all queries, as returned by
+                        Common.Response.unpack_results.
+
+        :type indptr: numpy.ndarray
+        :param indptr: The results of query i are records[indptr[i]:indptr[i + 1]].
+
+        :type k: integer
+        :param k: Row width, defaults to the largest number of results
+                  returned for one query.
+        """
+        counts = np.diff(indptr)
+
+        if k is None or (len(counts) > 0 and counts.max() > k):
+            k = int(counts.max()) if len(counts) > 0 else 0
+
+        result = cls.empty(len(counts), k)
+        result.put(0, records, indptr)
+
+        return result
+
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        Join ResultSets for consecutive query batches into one ResultSet.
+        """
+        k = max([part.k for part in parts] + [0])
+        result = cls.empty(sum(len(part) for part in parts), k)
+
+        start = 0
+        for part in parts:
+            end = start + len(part)
+            result.records[start:end, :part.k] = part.records
+            result.counts[start:end] = part.counts
+            start = end
+
+        return result
+
+    def put(self, start, records, indptr):
+        """
+        Store decoded batch results in the rows starting at 'start'.
+
+        :type records: numpy.ndarray
+        :param records: Results of all queries, as returned by
+                        Common.Response.unpack_results.
+
+        :type indptr: numpy.ndarray
+        :param indptr: The results of query start + i are
+                       records[indptr[i]:indptr[i + 1]].
+        """
+        counts = np.diff(indptr)
+
+        if start + len(counts) > len(self) or (len(counts) > 0 and counts.max() > self.k):
+            raise ValueError('Invalid argument')
+
+        self.counts[start:start + len(counts)] = counts
+
+        # Scatter every result into its (query, rank) position at once.
+        rows = start + np.repeat(np.arange(len(counts)), counts)
+        cols = np.arange(len(records)) - np.repeat(indptr[:-1], counts)
+        self.records[rows, cols] = records
+
+    def widen(self, k):
+        """
+        Returns a copy of this ResultSet with room for 'k' results per query.
+        """
+        result = ResultSet.empty(len(self), k)
+        result.records[:, :self.k] = self.records
+        result.counts[:] = self.counts
+
+        return result
+
+    @property
+    def k(self):
+        """
+        Number of result slots per query.
+        """
+        return self.records.shape[1]
+
+    @property
+    def ids(self):
+        """
+        (n_queries, k) array of dataset vector IDs (a view, not a copy).
+        """
+        return self.records['ds_id']
+
+    @property
+    def distances(self):
+        """
+        (n_queries, k) array of distances (a view, not a copy).
+        """
+        return self.records['distance']
+
+    @property
+    def mask(self):
+        """
+        (n_queries, k) boolean array which is False for padding entries.
+        """
+        return np.arange(self.k) < self.counts[:, np.newaxis]
+
+    def to_records(self):
+        """
+        Returns the underlying (n_queries, k) array of Common.RESULT_DTYPE.
+        """
+        return self.records
+
+    def tolist(self):
+        """
+        Returns the results as a list (one entry per query) of lists of
+        {'ds_id': ..., 'distance': ...} dictionaries.
+        """
+        return [[{'ds_id': int(ds_id), 'distance': int(distance)} for ds_id, distance in row.tolist()]
+                for row in self]
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ResultSet(self.records[index], self.counts[index])
+
+        return self.records[index, :self.counts[index]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return 'ResultSet(n_queries=%d, k=%d)' % (len(self), self.k)
+
+
+class SparseResultSet:
+    """
+    Compressed sparse row (CSR) container for the results of a batch of
+    threshold (GT, LT, EQ or RANGE) queries, where the number of results
+    varies from query to query.
+
+    The results of query i are records[indptr[i]:indptr[i + 1]], where
+    'records' is a flat array of Common.RESULT_DTYPE.
+
+    Like ResultSet, results[i] is a view of query i's results, and each
+    result can be indexed as result['ds_id'] and result['distance'].
+    """
+
+    def __init__(self, indptr, records):
+        """
+        :type indptr: numpy.ndarray
+        :param indptr: Offsets of each query's results, of length
+                       n_queries + 1.
+
+        :type records: numpy.ndarray
+        :param records: Results of all queries, of Common.RESULT_DTYPE.
+        """
+        self.indptr = indptr
+        self.records = records
+
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        Join SparseResultSets for consecutive query batches into one.
+        """
+        records = np.concatenate([part.records for part in parts])
+
+        # Shift each part's offsets by the number of results before it.
+        shifts = np.cumsum([0] + [len(part.records) for part in parts])
+        indptr = np.concatenate([[0]] + [part.indptr[1:] + shift for part, shift in zip(parts, shifts)])
+
+        return cls(indptr.astype(np.int64), records)
+
+    @property
+    def counts(self):
+        """
+        Number of results for each query.
+        """
+        return np.diff(self.indptr)
+
+    @property
+    def ids(self):
+        """
+        Dataset vector IDs of all results (a view, not a copy).
+        """
+        return self.records['ds_id']
+
+    @property
+    def distances(self):
+        """
+        Distances of all results (a view, not a copy).
+        """
+        return self.records['distance']
+
+    def to_records(self):
+        """
+        Returns the underlying flat array of Common.RESULT_DTYPE.
+        """
+        return self.records
+
+    def to_csr_matrix(self, n_columns=None):
+        """
+        Export the results as a scipy.sparse.csr_matrix, with one row per
+        query, one column per dataset vector, and the distances as values.
+
+        Requires scipy.
+
+        :type n_columns: integer
+        :param n_columns: Number of columns (the dataset size), defaults to
+                          the largest returned ds_id + 1.
+        """
+        import scipy.sparse
+
+        if n_columns is None:
+            n_columns = int(self.ids.max()) + 1 if len(self.records) > 0 else 0
+
+        return scipy.sparse.csr_matrix((self.distances, self.ids.astype(np.int64), self.indptr),
+                                       shape=(len(self), n_columns))
+
+    def tolist(self):
+        """
+        Returns the results as a list (one entry per query) of lists of
+        {'ds_id': ..., 'distance': ...} dictionaries.
+        """
+        return [[{'ds_id': int(ds_id), 'distance': int(distance)} for ds_id, distance in row.tolist()]
+                for row in self]
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('Invalid argument')
+            stop = max(start, stop)
+
+            indptr = self.indptr[start:stop + 1]
+            return SparseResultSet(indptr - indptr[0], self.records[indptr[0]:indptr[-1]])
+
+        return self.records[self.indptr[index]:self.indptr[index + 1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return 'SparseResultSet(n_queries=%d, nnz=%d)' % (len(self), len(self.records))
+
+
+class ResultCollector:
+    """
+    Assembles the results of a batch query from its mini-batches.
+
+    Each mini-batch's results are written at its query offset as soon as
+    they arrive, so mini-batches may be added in any order and the results
+    are never copied into a growing list. For k-NN (and ALL) query modes,
+    the output is a ResultSet allocated once for every query. Threshold
+    query modes return a variable number of results, so their mini-batches
+    are kept by offset and joined into one SparseResultSet at the end.
+    """
+
+    def __init__(self, query_mode, n_queries, k=None):
+        """
+        :type query_mode: Common.QueryMode
+        :param query_mode: The query mode the results are produced with.
+
+        :type n_queries: integer
+        :param n_queries: Total number of queries in the batch query.
+
+        :type k: integer
+        :param k: Expected number of results per query (the read count), if
+                  known. The output is widened if a query returns more.
+        """
+        self.query_mode = query_mode
+        self.n_queries = n_queries
+        self.k = k
+        self.output = None
+        self.parts = {}
+
+    def put(self, start, records, indptr):
+        """
+        Store the results of the mini-batch of queries starting at query
+        'start'.
+
+        :type records: numpy.ndarray
+        :param records: Results of all queries in the mini-batch, as returned
+                        by Common.Response.unpack_results.
+
+        :type indptr: numpy.ndarray
+        :param indptr: The results of query start + i are
+                       records[indptr[i]:indptr[i + 1]].
+        """
+        if self.query_mode in THRESHOLD_MODES:
+            # 'records' is already a copy, so it can be kept as it is.
+            self.parts[start] = SparseResultSet(indptr, records)
+            return
+
+        counts = np.diff(indptr)
+        k = int(counts.max()) if len(counts) > 0 else 0
+
+        if self.output is None:
+            self.output = ResultSet.empty(self.n_queries, max(self.k or 0, k))
+        elif k > self.output.k:
+            self.output = self.output.widen(k)
+
+        self.output.put(start, records, indptr)
+
+    def add(self, start, results):
+        """
+        Store a ResultSet or SparseResultSet holding the results of the
+        queries starting at query 'start'.
+        """
+        if self.query_mode in THRESHOLD_MODES:
+            self.parts[start] = results
+            return
+
+        if self.output is None:
+            self.output = ResultSet.empty(self.n_queries, max(self.k or 0, results.k))
+        elif results.k > self.output.k:
+            self.output = self.output.widen(results.k)
+
+        end = start + len(results)
+        self.output.records[start:end, :results.k] = results.records
+        self.output.counts[start:end] = results.counts
+
+    def result(self):
+        """
+        Returns the assembled ResultSet or SparseResultSet.
+        """
+
+        if self.query_mode in THRESHOLD_MODES:
+            return SparseResultSet.concatenate([self.parts[start] for start in sorted(self.parts)])
+
+        if self.output is None:
+            return ResultSet.empty(self.n_queries, self.k or 0)
+
+        return self.output
+
+
+def merge(query_mode, parts, offsets, k=None):
+    """
+    Merge the results of the same queries run against several shards of a
+    dataset into results for the whole dataset.
+
+    Each shard numbers its vectors from 0, so the ds_ids from shard i are
+    shifted by offsets[i]. In the KNN_A and KNN_D query modes, the best 'k'
+    results of each query across all shards are kept, with ties broken by
+    ds_id. In the threshold query modes, the results of each query are
+    joined in ds_id order. In ALL mode, each query's distances are joined
+    in ds_id order.
+
+    :type query_mode: Common.QueryMode
+    :param query_mode: The query mode the results were produced with.
+
+    :type parts: list
+    :param parts: A ResultSet or SparseResultSet from each shard.
+
+    :type offsets: list
+    :param offsets: The ds_id of each shard's first vector.
+
+    :type k: integer
+    :param k: Number of results to keep per query in KNN_A and KNN_D
+              modes, defaults to the largest number returned by a shard.
+    """
+    if query_mode in THRESHOLD_MODES:
+        return _merge_sparse(parts, offsets)
+
+    # Join every shard's results side by side, in shard order.
+    records = np.concatenate([part.records for part in parts], axis=1)
+    mask = np.concatenate([part.mask for part in parts], axis=1)
+    counts = np.sum(mask, axis=1)
+
+    ids = records['ds_id']
+    ids += np.concatenate([np.full(part.k, offset, dtype=np.uint64) for part, offset in zip(parts, offsets)])
+    ids[~mask] = ResultSet.fill
+
+    if query_mode not in (QueryMode.KNN_A, QueryMode.KNN_D):
+        # Move each row's padding to the end, keeping the order of the rest.
+        order = np.argsort(~mask, axis=1, kind='stable')
+        return ResultSet(np.take_along_axis(records, order, axis=1), counts)
+
+    if k is None:
+        k = max(part.k for part in parts)
+
+    # Sort each row by distance (reversed for KNN_D), then ds_id. The
+    # padding sorts last in both modes.
+    distance = records['distance']
+    if query_mode == QueryMode.KNN_D:
+        distance = np.where(mask, ~distance, ResultSet.fill)
+
+    order = np.lexsort((ids, distance), axis=-1)[:, :k]
+
+    return ResultSet(np.take_along_axis(records, order, axis=1), np.minimum(counts, k))
+
+
+def _merge_sparse(parts, offsets):
+    # The query each result belongs to, for every shard's results in turn.
+    n_queries = len(parts[0])
+    rows = np.concatenate([np.repeat(np.arange(n_queries), part.counts) for part in parts])
+
+    records = np.concatenate([part.records for part in parts])
+    records['ds_id'] += np.repeat(np.asarray(offsets, dtype=np.uint64), [len(part.records) for part in parts])
+
+    # Group the results by query. The sort is stable, so each query's
+    # results stay in shard order, which is ds_id order.
+    order = np.argsort(rows, kind='stable')
+
+    indptr = np.zeros(n_queries + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(rows, minlength=n_queries))
+
+    return SparseResultSet(indptr, records[order])
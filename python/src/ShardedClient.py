@@ -0,0 +1,256 @@
+import concurrent.futures
+
+import numpy as np
+
+from Common import *
+from Client import Client, Session
+import Results
+
+
+class ShardedClient:
+    """
+    Client for a dataset which is split across several Nearist appliances.
+
+    Each appliance (shard) holds a contiguous block of the dataset's
+    vectors. Queries are sent to every shard at once, and their results are
+    merged into results for the whole dataset, with ds_ids numbered across
+    all of the shards (see Results.merge).
+
+    Settings made through the ShardedClient are made on every shard.
+    """
+
+    def __init__(self, endpoints):
+        """
+        :type endpoints: list
+        :param endpoints: (host, port, api_key) of each appliance.
+        """
+        self.endpoints = endpoints
+        self.clients = []
+
+        # The ds_id of the first vector on each shard, and the number of
+        # vectors on each shard.
+        self.offsets = [0] * len(endpoints)
+        self.sizes = [0] * len(endpoints)
+
+        # The settings made on every shard.
+        self.session = Session()
+
+        self.__executor = None
+
+    def __broadcast(self, method):
+        # Call 'method(client, shard)' for every shard at once, and return
+        # the results in shard order.
+        futures = [self.__executor.submit(method, c, i) for (i, c) in enumerate(self.clients)]
+        return [future.result() for future in futures]
+
+    def __configure(self, name, *args):
+        # Make a setting on every shard, and record it in the session.
+        self.__broadcast(lambda c, i: getattr(c, name)(*args))
+        getattr(self.session, name)(*args)
+
+    def __set_sizes(self, sizes):
+        self.sizes = list(sizes)
+        self.offsets = [int(offset) for offset in np.cumsum([0] + self.sizes[:-1])]
+
+    def open(self):
+        """
+        Open connections to all of the appliances.
+        """
+        self.__executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.endpoints))
+
+        for (host, port, api_key) in self.endpoints:
+            c = Client()
+            c.open(host, port, api_key)
+            self.session.apply(c)
+            self.clients.append(c)
+
+    def close(self):
+        """
+        Close the connections to all of the appliances.
+        """
+        for c in self.clients:
+            c.close()
+
+        self.clients = []
+        self.__executor.shutdown()
+
+    def reset(self):
+        """
+        Reset every appliance, clearing all stored data.
+        """
+        self.__broadcast(lambda c, i: c.reset())
+        self.__set_sizes([0] * len(self.clients))
+
+    def reset_timer(self):
+        """
+        Reset the board time measurement timer of every appliance.
+        """
+        self.__broadcast(lambda c, i: c.reset_timer())
+
+    def get_timer_value(self):
+        """
+        Get board time measurement in nanoseconds. The shards work in
+        parallel, so this is the largest time of any shard.
+        """
+        return max(self.__broadcast(lambda c, i: c.get_timer_value()))
+
+    def set_distance_mode(self, mode):
+        """
+        Set the distance metric on every shard.
+
+        :type mode: Common.DistanceMode
+        :param mode: Distance metric from Common.DistanceMode
+
+        """
+        self.__configure('set_distance_mode', mode)
+
+    def set_query_mode(self, mode):
+        """
+        Set query mode on every shard.
+
+        :type mode: Common.QueryMode
+        :param mode: Query mode from Common.QueryMode
+
+        """
+        self.__configure('set_query_mode', mode)
+
+    def set_read_count(self, count):
+        """
+        Set query result count for KNN_D/KNN_A query mode(s) on every shard.
+        Each shard returns its best 'count' results, and the best 'count' of
+        those are kept.
+
+        :type count: integer
+        :param count: The top 'K' values in KNN
+
+        """
+        self.__configure('set_read_count', count)
+
+    def set_threshold(self, threshold):
+        """
+        Set query threshold for GT, LT, or KNN query modes on every shard.
+
+        :type threshold: integer
+        :param threshold: The threshold value.
+        """
+        self.__configure('set_threshold', threshold)
+
+    def set_threshold_range(self, threshold_lower, threshold_upper):
+        """
+        Set query threshold for RANGE query mode on every shard.
+
+        :type threshold_lower: integer
+        :param threshold_lower: Lower threshold value.
+
+        :type threshold_upper: integer
+        :param threshold_upper: Upper threshold value.
+
+        """
+        self.__configure('set_threshold_range', threshold_lower, threshold_upper)
+
+    def ds_load(self, vectors, component_type=None):
+        """
+        Split a dataset into equal blocks of rows, and load one block onto
+        each appliance.
+
+        :type vectors: list of lists or numpy.ndarray
+        :param vectors: List of vectors (component lists), or a 2-D array
+                        with one vector per row
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+
+        """
+        vectors, component_type = encode_vectors(vectors, component_type, self.session.distance_mode)
+
+        if vectors.ndim != 2 or len(vectors) < len(self.clients):
+            raise ValueError('Invalid argument')
+
+        blocks = np.array_split(vectors, len(self.clients))
+
+        self.__broadcast(lambda c, i: c.ds_load(blocks[i], component_type))
+        self.__set_sizes([len(block) for block in blocks])
+
+    def load_dataset_files(self, files, component_type=None):
+        """
+        Load a dataset file on each appliance.
+
+        :type files: list
+        :param files: (file_name, dataset_name, vector_count) for each shard,
+                      in order. 'vector_count' is the number of vectors in
+                      the file, which is needed to number the vectors across
+                      shards.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components stored in the files.
+                               See Client.load_dataset_file.
+
+        """
+        if len(files) != len(self.clients):
+            raise ValueError('Invalid argument')
+
+        self.__broadcast(lambda c, i: c.load_dataset_file(files[i][0], files[i][1], component_type))
+        self.__set_sizes([vector_count for (file_name, dataset_name, vector_count) in files])
+
+    def ds_load_random(self, vector_count, comp_count):
+        """
+        Load a random dataset, split evenly across the appliances.
+
+        :type vector_count: integer
+        :param vector_count: Total vector count to generate
+
+        :type comp_count: integer
+        :param comp_count: Vector's component count
+
+        """
+        sizes = [len(block) for block in np.array_split(np.arange(vector_count), len(self.clients))]
+
+        self.__broadcast(lambda c, i: c.ds_load_random(sizes[i], comp_count))
+        self.__set_sizes(sizes)
+
+    def query(self, vectors, batch_size=128, verbose=True, window=1, component_type=None):
+        """
+        Query for single/multiple vector(s) against every shard, and merge
+        the results.
+
+        Takes the same arguments as Client.query, and returns the same
+        results, with ds_ids numbered across all of the shards. 'verbose'
+        is accepted for compatibility with Client.query, and is ignored.
+
+        :type vectors: list, list of lists or numpy.ndarray
+        :param vectors: A single query vector, or a matrix with one query
+                        vector per row.
+
+        :type window: integer
+        :param window: See Client.query.
+
+        :type component_type: Common.ComponentType
+        :param component_type: Width of the components. See Client.ds_load.
+
+        """
+        vectors, component_type = encode_vectors(vectors, component_type, self.session.distance_mode)
+
+        # Validate that 'vectors' is a non-empty vector or matrix.
+        if vectors.ndim not in (1, 2) or vectors.size == 0:
+            raise ValueError('Invalid argument')
+
+        single = vectors.ndim == 1
+
+        parts = self.__broadcast(lambda c, i: c.query(vectors, batch_size=batch_size, verbose=False, window=window,
+                                                      component_type=component_type))
+
+        # Treat the results of a single query as a batch of one, so they can
+        # be merged the same way.
+        if single:
+            indptr = lambda part: np.array([0, len(part)])
+            if self.session.query_mode in Results.THRESHOLD_MODES:
+                parts = [Results.SparseResultSet(indptr(part), part) for part in parts]
+            else:
+                parts = [Results.ResultSet.from_batch(part, indptr(part)) for part in parts]
+
+        results = Results.merge(self.session.query_mode, parts, self.offsets, self.session.read_count)
+
+        if single:
+            return results[0]
+
+        return results
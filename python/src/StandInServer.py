@@ -0,0 +1,392 @@
+"""
+A local stand-in for the Nearist appliance, for testing and benchmarking
+clients without the hardware.
+
+The server speaks the appliance's protocol over TCP (the same
+Common.Request and Common.Response framing, checksums and status codes)
+and searches with the brute-force CPU engine in Engine. Artificial
+latency and bandwidth limits can be set, to make the network behave
+predictably.
+
+Run it from the command line:
+
+    python StandInServer.py --port 5555 --api-key apikey --latency 0.005
+
+or start it in a background thread:
+
+    server = StandInServer(api_key='apikey')
+    (host, port) = server.start()
+    ...
+    server.stop()
+"""
+
+import argparse
+import binascii
+import json
+import queue
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from Common import *
+from Client import Session
+import Engine
+from Engine import SearchError
+
+
+class StandInServer(socketserver.ThreadingTCPServer):
+    """
+    TCP server which answers requests like a Nearist appliance.
+
+    The dataset is shared by all connections, and the settings (distance
+    mode, query mode, read count and threshold) are made per connection.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), api_key=None, latency=0.0, bandwidth=None,
+                 max_dataset_size=None, seed=0):
+        """
+        :type address: tuple
+        :param address: (host, port) to listen on. Port 0 picks a free port.
+
+        :type api_key: string
+        :param api_key: The API key clients must send, or None to accept
+                        any key.
+
+        :type latency: float
+        :param latency: Seconds from a request arriving to its response
+                        being sent, like a network round trip. The delays
+                        of pipelined requests overlap.
+
+        :type bandwidth: float
+        :param bandwidth: Bytes per second to limit requests and responses
+                          to, or None for no limit.
+
+        :type max_dataset_size: integer
+        :param max_dataset_size: Largest number of dataset vectors to accept,
+                                 or None for no limit.
+
+        :type seed: integer
+        :param seed: Seed for random datasets.
+        """
+        socketserver.ThreadingTCPServer.__init__(self, address, _RequestHandler)
+
+        self.api_key = api_key
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.max_dataset_size = max_dataset_size
+        self.seed = seed
+
+        self.dataset = None
+
+        # Whether the dataset is 1-bit components, stored packed by
+        # Engine.pack_bits.
+        self.dataset_packed = False
+
+        # Time spent searching, in nanoseconds (see Command.GET_TIMER).
+        self.timer = 0
+
+        self.lock = threading.Lock()
+        self.__thread = None
+
+    def start(self):
+        """
+        Serve requests on a background thread. Returns the (host, port) the
+        server is listening on.
+        """
+        self.__thread = threading.Thread(target=self.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+        return self.server_address[:2]
+
+    def stop(self):
+        """
+        Stop serving requests and close the listening socket.
+        """
+        self.shutdown()
+        self.server_close()
+
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def load_dataset(self, dataset, packed=False):
+        """
+        Store 'dataset' as the dataset to search. 'packed' is whether it is
+        1-bit components packed by Engine.pack_bits.
+        """
+        if self.max_dataset_size is not None and len(dataset) > self.max_dataset_size:
+            raise SearchError(Status.DATASET_SIZE_NOT_SUPPORTED)
+
+        with self.lock:
+            self.dataset = dataset
+            self.dataset_packed = packed
+
+    def throttle(self, length):
+        """
+        Wait as long as sending 'length' bytes takes at the bandwidth limit.
+        """
+        if self.bandwidth:
+            time.sleep(length / float(self.bandwidth))
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """
+    Handles the requests on one connection.
+    """
+
+    def setup(self):
+        self.session = Session()
+
+        # (time due, data) of each response to send, in order. The responses
+        # are sent by their own thread, so that a response can wait out the
+        # latency while the next requests are received and searched.
+        self.__responses = queue.Queue()
+        self.__sender = threading.Thread(target=self.__send_responses)
+        self.__sender.daemon = True
+        self.__sender.start()
+
+    def finish(self):
+        self.__responses.put(None)
+        self.__sender.join()
+
+    def __send_responses(self):
+        server = self.server
+        failed = False
+
+        while True:
+            item = self.__responses.get()
+            if item is None:
+                return
+
+            # After the client has gone, keep taking responses so the
+            # handler isn't held up, but don't send them.
+            if failed:
+                continue
+
+            (due, data) = item
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            server.throttle(len(data))
+            try:
+                self.request.sendall(data)
+            except OSError:
+                failed = True
+
+    def __recvall(self, length):
+        # Receive 'length' bytes, or return None if the connection closes.
+        data = bytearray(length)
+        view = memoryview(data)
+        received = 0
+
+        while received < length:
+            n = self.request.recv_into(view[received:])
+            if n == 0:
+                return None
+            received += n
+
+        return data
+
+    def handle(self):
+        server = self.server
+
+        while True:
+            buf = self.__recvall(44)
+            if buf is None:
+                return
+
+            request = Request('', Command.RESET)
+            request.unpack_header(buf)
+
+            # Receive the body and its checksum, even if the header is bad,
+            # so the next request is read from the right place.
+            body_valid = True
+            if request.body_length > 0:
+                buf = self.__recvall(request.body_length + 4)
+                if buf is None:
+                    return
+
+                request.body = memoryview(buf)[:request.body_length]
+                (checksum,) = struct.unpack_from("=L", buf, request.body_length)
+                body_valid = checksum == binascii.crc32(request.body) & 0xFFFFFFFF
+
+            server.throttle(44 + request.body_length + 4)
+            arrival = time.monotonic()
+
+            response = Response(request.command)
+            try:
+                if not request.header_valid or not body_valid:
+                    raise SearchError(Status.INVALID_CHECKSUM)
+
+                if server.api_key is not None and request.api_key != server.api_key.ljust(8)[0:8]:
+                    raise SearchError(Status.INVALID_API_KEY)
+
+                handler = _RequestHandler.COMMANDS.get(request.command)
+                if handler is None:
+                    raise SearchError(Status.INVALID_COMMAND)
+
+                handler(self, request, response)
+
+            except SearchError as e:
+                response = Response(request.command, e.status)
+
+            except (ValueError, TypeError, KeyError):
+                response = Response(request.command, Status.INVALID_DATA)
+
+            self.__responses.put((arrival + server.latency, response.pack()))
+
+    def reset(self, request, response):
+        with self.server.lock:
+            self.server.dataset = None
+            self.server.dataset_packed = False
+
+    def set_distance_mode(self, request, response):
+        try:
+            self.session.set_distance_mode(DistanceMode(request.attribute_0))
+        except ValueError:
+            raise SearchError(Status.DISTANCE_MODE_NOT_SUPPORTED)
+
+    def set_query_mode(self, request, response):
+        try:
+            self.session.set_query_mode(QueryMode(request.attribute_0))
+        except ValueError:
+            raise SearchError(Status.QUERY_MODE_NOT_SUPPORTED)
+
+    def set_read_count(self, request, response):
+        if request.attribute_0 == 0:
+            raise SearchError(Status.READ_COUNT_NOT_SUPPORTED)
+
+        self.session.set_read_count(request.attribute_0)
+
+    def set_threshold(self, request, response):
+        # set_threshold sends a single threshold in attribute 0, and
+        # set_threshold_range sends the lower and upper thresholds.
+        self.session.set_threshold_range(request.attribute_0, request.attribute_1)
+
+    @staticmethod
+    def unpack_vectors(request):
+        # The matrix of vectors in the body of a DS_LOAD or QUERY request:
+        # attribute 0 is the vector length, and the header's reserved word
+        # is the component type. Packed bits are returned as rows of bytes.
+        if request.component_type == ComponentType.BIT:
+            if request.attribute_0 % 8 != 0:
+                raise SearchError(Status.INVALID_DATA)
+            (dtype, row_length) = (np.dtype(np.uint8), request.attribute_0 // 8)
+        elif request.component_type in COMPONENT_DTYPES:
+            (dtype, row_length) = (COMPONENT_DTYPES[request.component_type], request.attribute_0)
+        else:
+            raise SearchError(Status.NOT_SUPPORTED)
+
+        if request.body is None or row_length == 0 or request.body_length % (row_length * dtype.itemsize) != 0:
+            raise SearchError(Status.INVALID_DATA)
+
+        return np.frombuffer(request.body, dtype=dtype).reshape(-1, row_length)
+
+    def ds_load(self, request, response):
+        packed = False
+
+        if request.attribute_1 == 0:
+            dataset = self.unpack_vectors(request)
+            packed = request.component_type == ComponentType.BIT
+
+            dataset = Engine.align_bits(dataset) if packed else dataset.copy()
+
+        elif request.attribute_1 == 1:
+            root = json.loads(bytes(request.body).decode())
+            dataset = Engine.read_dataset_file(root.get("fileName"), root.get("datasetName"))
+
+            component_type = component_type_of(dataset.dtype)
+            if dataset.ndim != 2 or component_type is None:
+                raise SearchError(Status.INVALID_DATA)
+
+            # The client may say which component type it expects the file
+            # to hold.
+            if "componentType" in root and root["componentType"] != component_type.name.lower():
+                raise SearchError(Status.INVALID_DATA)
+
+        elif request.attribute_1 == 2:
+            root = json.loads(bytes(request.body).decode())
+            rng = np.random.RandomState(self.server.seed)
+            dataset = rng.randint(0, 256, size=(root["vectorCount"], root["compCount"])).astype(np.uint8)
+
+        else:
+            raise SearchError(Status.INVALID_ARGUMENT)
+
+        self.server.load_dataset(dataset, packed)
+
+    def query(self, request, response):
+        if request.attribute_1 not in (0, 1):
+            raise SearchError(Status.NOT_SUPPORTED)
+
+        queries = self.unpack_vectors(request)
+
+        # A single query is one vector.
+        if request.attribute_1 == 0 and len(queries) != 1:
+            raise SearchError(Status.QUERY_SIZE_NOT_SUPPORTED)
+
+        with self.server.lock:
+            (dataset, packed) = (self.server.dataset, self.server.dataset_packed)
+
+        queries = Engine.match_queries(queries, request.component_type == ComponentType.BIT, dataset, packed)
+
+        t0 = time.perf_counter()
+        (records, indptr) = Engine.search(dataset, queries, self.session, packed=packed)
+        elapsed = int((time.perf_counter() - t0) * 1E9)
+
+        with self.server.lock:
+            self.server.timer += elapsed
+
+        response.attribute_1 = request.attribute_1
+        response.pack_results(records, indptr)
+
+    def reset_timer(self, request, response):
+        with self.server.lock:
+            self.server.timer = 0
+
+    def get_timer(self, request, response):
+        response.attribute_0 = self.server.timer
+
+    COMMANDS = {
+        Command.RESET: reset,
+        Command.DISTANCE_MODE: set_distance_mode,
+        Command.QUERY_MODE: set_query_mode,
+        Command.READ_COUNT: set_read_count,
+        Command.THRESHOLD: set_threshold,
+        Command.DS_LOAD: ds_load,
+        Command.QUERY: query,
+        Command.RESET_TIMER: reset_timer,
+        Command.GET_TIMER: get_timer,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Nearist appliance.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on.')
+    parser.add_argument('--port', type=int, default=5555, help='Port to listen on.')
+    parser.add_argument('--api-key', default=None, help='API key to require (default: accept any).')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds from each request to its response.')
+    parser.add_argument('--bandwidth', type=float, default=None, help='Bandwidth limit in bytes per second.')
+    parser.add_argument('--max-dataset-size', type=int, default=None, help='Largest dataset to accept, in vectors.')
+    args = parser.parse_args()
+
+    server = StandInServer((args.host, args.port), api_key=args.api_key, latency=args.latency,
+                           bandwidth=args.bandwidth, max_dataset_size=args.max_dataset_size)
+
+    print('Listening on %s:%d' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+"""
+Reader and writer for .nvx vector files.
+
+An .nvx file holds a matrix of vectors in the layout of a request body, so
+it can be memory mapped and sliced without copies, and sent to the
+appliance straight from the file (see Client.ds_load_from_file).
+
+The file starts with a 64 byte header, in little-endian byte order:
+
+    Magic           8 bytes  MAGIC
+    Version         4 bytes  VERSION
+    Data type       8 bytes  NumPy dtype string of a component, e.g. '|u1'
+    Dimensions      8 bytes  Components per vector (bits, if packed)
+    Count           8 bytes  Number of vectors
+    Flags           4 bytes  FLAG_PACKED_BITS, FLAG_IDS and FLAG_LABELS
+    Labels width    4 bytes  Number of labels per vector
+    Vectors CRC     4 bytes  CRC-32 of the vectors section
+    Metadata CRC    4 bytes  CRC-32 of the ids and labels sections
+    Header CRC      4 bytes  CRC-32 of the header fields above
+    Reserved        8 bytes  Zero
+
+followed by these sections, each starting on an 8 byte boundary:
+
+    Vectors  'count' rows of 'dimensions' components. Packed bits
+             (FLAG_PACKED_BITS) are uint8 rows of ceil(dimensions / 8)
+             bytes, as sent with Common.ComponentType.BIT.
+    Ids      'count' uint64 ids, if FLAG_IDS is set.
+    Labels   'count' rows of 'labels width' int64 labels, if FLAG_LABELS
+             is set.
+"""
+
+import binascii
+import struct
+
+import numpy as np
+
+from Common import *
+
+MAGIC = b"\x93NVX\r\n\x1a\n"
+
+VERSION = 1
+
+HEADER_FORMAT = "<8sI8sQQIIII"
+"""
+Layout of the header fields, up to the header CRC.
+"""
+
+HEADER_SIZE = 64
+
+FLAG_PACKED_BITS = 0x1
+FLAG_IDS = 0x2
+FLAG_LABELS = 0x4
+
+CHUNK_SIZE = 1 << 24
+"""
+Number of bytes written or checked at a time.
+"""
+
+
+def _align(offset):
+    return -(-offset // 8) * 8
+
+
+def _chunks(vectors, chunk_size=CHUNK_SIZE):
+    # Blocks of rows of 'vectors' of about 'chunk_size' bytes each.
+    rows = max(1, chunk_size // max(1, vectors.shape[1] * np.dtype(vectors.dtype).itemsize))
+    for start in range(0, vectors.shape[0], rows):
+        yield vectors[start:start + rows]
+
+
+def _pack_header(dtype, dims, count, flags, labels_width, vectors_crc, metadata_crc):
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, np.dtype(dtype).str.encode(), dims, count, flags,
+                         labels_width, vectors_crc & 0xFFFFFFFF, metadata_crc & 0xFFFFFFFF)
+    header += struct.pack("<L", binascii.crc32(header) & 0xFFFFFFFF)
+
+    return header.ljust(HEADER_SIZE, b"\0")
+
+
+def write(path, vectors, ids=None, labels=None, component_type=None):
+    """
+    Write a matrix of vectors to an .nvx file.
+
+    :type path: string
+    :param path: Name of the file to write.
+
+    :type vectors: numpy.ndarray, numpy.memmap or h5py.Dataset
+    :param vectors: 2-D array-like with one vector per row. It is read in
+                    blocks of rows, so it doesn't need to fit in memory.
+                    Integer vectors are stored as the component format
+                    given by Common.as_components, and floating point
+                    vectors as they are.
+
+    :type ids: numpy.ndarray
+    :param ids: Optional id for each vector.
+
+    :type labels: numpy.ndarray
+    :param labels: Optional label, or row of labels, for each vector.
+
+    :type component_type: Common.ComponentType
+    :param component_type: Format of the components. ComponentType.BIT packs
+                           boolean vectors eight to a byte.
+    """
+    if len(vectors.shape) != 2:
+        raise ValueError('Invalid argument')
+
+    count = vectors.shape[0]
+    packed = component_type == ComponentType.BIT
+
+    def encode(block):
+        # Floating point vectors are kept as they are, since they have no
+        # component format.
+        if component_type is None and np.dtype(block.dtype).kind == 'f':
+            return np.ascontiguousarray(block, dtype=np.dtype(block.dtype).newbyteorder('<'))
+        return encode_vectors(block, component_type)[0]
+
+    flags = FLAG_PACKED_BITS if packed else 0
+
+    if ids is not None:
+        ids = np.ascontiguousarray(ids, dtype='<u8').reshape(-1)
+        if len(ids) != count:
+            raise ValueError('Invalid argument')
+        flags |= FLAG_IDS
+
+    labels_width = 0
+    if labels is not None:
+        labels = np.ascontiguousarray(labels, dtype='<i8').reshape(count, -1)
+        labels_width = labels.shape[1]
+        flags |= FLAG_LABELS
+
+    with open(path, 'wb') as f:
+        # Write the vectors after room for the header, which is written
+        # last, once the checksums are known.
+        f.write(b"\0" * HEADER_SIZE)
+
+        # Boolean vectors are packed by encode_vectors, and keep their
+        # number of bits. Other vectors given as BIT are packed already.
+        dims = vectors.shape[1]
+        if packed and np.dtype(vectors.dtype) != bool:
+            dims *= 8
+
+        vectors_crc = 0
+        dtype = None
+
+        for block in _chunks(vectors):
+            block = encode(block)
+            if dtype is None:
+                dtype = block.dtype
+
+            data = memoryview(block.reshape(-1).view(np.uint8))
+            vectors_crc = binascii.crc32(data, vectors_crc)
+            f.write(data)
+
+        if dtype is None:
+            dtype = encode(np.zeros((0, vectors.shape[1]), dtype=vectors.dtype)).dtype
+
+        f.write(b"\0" * (_align(f.tell()) - f.tell()))
+
+        metadata_crc = 0
+        for section in (ids, labels):
+            if section is not None:
+                data = memoryview(section.reshape(-1).view(np.uint8))
+                metadata_crc = binascii.crc32(data, metadata_crc)
+                f.write(data)
+
+        f.seek(0)
+        f.write(_pack_header(dtype, dims, count, flags, labels_width, vectors_crc, metadata_crc))
+
+
+def create(path, dtype, dims, count, ids=False, labels_width=0):
+    """
+    Create an .nvx file of 'count' zero vectors, to be filled in place.
+
+    Returns the file opened for writing, as a VectorFile whose 'vectors',
+    'ids' and 'labels' are writable memory maps. The checksums are updated
+    when it is closed (see VectorFile.close).
+
+    :type path: string
+    :param path: Name of the file to create.
+
+    :type dtype: numpy.dtype
+    :param dtype: Data type of the components.
+
+    :type dims: integer
+    :param dims: Number of components per vector.
+
+    :type count: integer
+    :param count: Number of vectors.
+
+    :type ids: bool
+    :param ids: Whether the file has an ids section.
+
+    :type labels_width: integer
+    :param labels_width: Number of labels per vector, or 0 for no labels
+                         section.
+
+    :rtype: VectorFile
+    """
+    flags = (FLAG_IDS if ids else 0) | (FLAG_LABELS if labels_width else 0)
+    dtype = np.dtype(dtype).newbyteorder('<')
+
+    size = _align(HEADER_SIZE + count * dims * dtype.itemsize) + (count * 8 if ids else 0) + count * labels_width * 8
+
+    with open(path, 'wb') as f:
+        f.write(_pack_header(dtype, dims, count, flags, labels_width, 0, 0))
+        f.truncate(size)
+
+    return VectorFile(path, mode='r+')
+
+
+class VectorFile:
+    """
+    A memory mapped .nvx file.
+
+    'vectors' is a read-only np.memmap of the vectors, so rows can be
+    sliced out without reading the rest of the file. A VectorFile can be
+    passed wherever the clients take a matrix of vectors (it converts to
+    an array with numpy.asarray, and slices by rows), and Client can send it
+    straight from the file with ds_load_from_file.
+
+        with VectorFile('words.nvx') as vf:
+            client.ds_load_stream(vf)
+    """
+
+    def __init__(self, path, verify=False, mode='r'):
+        """
+        :type path: string
+        :param path: Name of the .nvx file.
+
+        :type verify: bool
+        :param verify: Whether to check the checksums of the sections (see
+                       verify). The header's checksum is always checked.
+
+        :type mode: string
+        :param mode: 'r' to open the file read-only, or 'r+' to write to the
+                     vectors, ids and labels in place.
+        """
+        self.path = path
+        self.mode = mode
+
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+
+        field_size = struct.calcsize(HEADER_FORMAT)
+        if len(header) < HEADER_SIZE or header[0:8] != MAGIC:
+            raise IOError('%s is not an .nvx file.' % path)
+
+        (header_crc,) = struct.unpack_from("<L", header, field_size)
+        if header_crc != binascii.crc32(header[0:field_size]) & 0xFFFFFFFF:
+            raise IOError('%s has a corrupt header.' % path)
+
+        (magic, self.version, dtype, self.dims, self.count, self.flags, self.labels_width,
+         self.vectors_crc, self.metadata_crc) = struct.unpack_from(HEADER_FORMAT, header, 0)
+
+        if self.version > VERSION:
+            raise IOError('%s is .nvx version %d, which is not supported.' % (path, self.version))
+
+        self.dtype = np.dtype(dtype.rstrip(b"\0").decode())
+        self.packed = bool(self.flags & FLAG_PACKED_BITS)
+
+        # The layout of each section.
+        self.row_bytes = -(-self.dims // 8) if self.packed else self.dims * self.dtype.itemsize
+        self.vectors_offset = HEADER_SIZE
+        self.vectors_length = self.count * self.row_bytes
+        self.ids_offset = _align(self.vectors_offset + self.vectors_length)
+        self.labels_offset = self.ids_offset + (self.count * 8 if self.flags & FLAG_IDS else 0)
+
+        row_length = self.row_bytes if self.packed else self.dims
+        self.vectors = self.__map(self.vectors_offset, self.dtype, (self.count, row_length))
+
+        self.ids = None
+        if self.flags & FLAG_IDS:
+            self.ids = self.__map(self.ids_offset, np.dtype('<u8'), (self.count,))
+
+        self.labels = None
+        if self.flags & FLAG_LABELS:
+            self.labels = self.__map(self.labels_offset, np.dtype('<i8'), (self.count, self.labels_width))
+
+        if verify:
+            self.verify()
+
+    def __map(self, offset, dtype, shape):
+        # Memory map a section (an empty section can't be mapped).
+        if 0 in shape:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode=self.mode, offset=offset, shape=shape)
+
+    @property
+    def component_type(self):
+        """
+        The Common.ComponentType of the vectors, or None for floating point
+        vectors.
+        """
+        if self.packed:
+            return ComponentType.BIT
+        return component_type_of(self.dtype)
+
+    @property
+    def shape(self):
+        return self.vectors.shape
+
+    def __checksums(self):
+        # CRC-32s of the vectors section, and of the ids and labels sections
+        # (which follow each other). The file is read a chunk at a time,
+        # rather than through the memory maps, so it isn't all kept in
+        # memory.
+        metadata_length = self.count * (8 if self.flags & FLAG_IDS else 0) + \
+            self.count * self.labels_width * (8 if self.flags & FLAG_LABELS else 0)
+
+        buffer = memoryview(bytearray(CHUNK_SIZE))
+        checksums = []
+
+        with open(self.path, 'rb') as f:
+            for (offset, length) in ((self.vectors_offset, self.vectors_length), (self.ids_offset, metadata_length)):
+                f.seek(offset)
+                crc = 0
+                while length > 0:
+                    n = f.readinto(buffer[:min(length, CHUNK_SIZE)])
+                    if n == 0:
+                        raise IOError('%s is truncated.' % self.path)
+                    crc = binascii.crc32(buffer[:n], crc)
+                    length -= n
+                checksums.append(crc & 0xFFFFFFFF)
+
+        return tuple(checksums)
+
+    def verify(self):
+        """
+        Check the vectors, ids and labels against their checksums, reading
+        the file a chunk at a time. Raises IOError if they don't match.
+        """
+        if self.__checksums() != (self.vectors_crc, self.metadata_crc):
+            raise IOError('%s failed its checksum.' % self.path)
+
+    def flush(self):
+        """
+        Write the changes made to a file opened for writing to disk.
+        """
+        for section in (self.vectors, self.ids, self.labels):
+            if isinstance(section, np.memmap):
+                section.flush()
+
+    def close(self):
+        """
+        Release the memory maps. Arrays sliced from them keep them open
+        until they are released too.
+
+        If the file was opened for writing, the changes are flushed and the
+        checksums in the header are updated first.
+        """
+        if self.mode != 'r' and self.vectors is not None:
+            self.flush()
+            (self.vectors_crc, self.metadata_crc) = self.__checksums()
+
+            with open(self.path, 'r+b') as f:
+                f.write(_pack_header(self.dtype, self.dims, self.count, self.flags, self.labels_width,
+                                     self.vectors_crc, self.metadata_crc))
+
+        self.vectors = self.ids = self.labels = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.vectors[index]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.vectors, dtype=dtype)
+
+    def __repr__(self):
+        return "VectorFile(%r, %d x %d %s)" % (self.path, self.count, self.dims,
+                                               'bits' if self.packed else self.dtype.name)
+
+
+def read(path, dataset_name=None):
+    """
+    Read a matrix of vectors from an .nvx file, which is memory mapped, or
+    from a dataset in an HDF5 file, which is read into memory (h5py is
+    required).
+
+    :type path: string
+    :param path: Name of the file.
+
+    :type dataset_name: string
+    :param dataset_name: Name of the dataset, for HDF5 files.
+
+    :rtype: numpy.ndarray
+    """
+    if path.endswith('.nvx'):
+        return VectorFile(path).vectors
+
+    import h5py
+    with h5py.File(path, 'r') as h5f:
+        return h5f[dataset_name][:]
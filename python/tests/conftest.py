@@ -0,0 +1,77 @@
+import os
+import socket
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from Common import *
+from Client import Client
+from StandInServer import StandInServer
+
+
+@pytest.fixture
+def server():
+    server = StandInServer(api_key='apikey')
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def dataset():
+    return np.random.RandomState(0).randint(0, 256, size=(500, 16)).astype(np.uint8)
+
+
+@pytest.fixture
+def queries():
+    return np.random.RandomState(1).randint(0, 256, size=(300, 16)).astype(np.uint8)
+
+
+@pytest.fixture
+def client(server, dataset):
+    (host, port) = server.server_address[:2]
+
+    client = Client(retry_delay=0.01)
+    client.open(host, port, 'apikey')
+    client.set_distance_mode(DistanceMode.L1)
+    client.set_query_mode(QueryMode.KNN_A)
+    client.set_read_count(5)
+    client.ds_load(dataset)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def hung_server():
+    # Accepts connections and reads requests, but never answers.
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    connections = []
+
+    def drain(conn):
+        try:
+            while conn.recv(65536):
+                pass
+        except OSError:
+            pass
+
+    def serve():
+        while True:
+            try:
+                (conn, address) = listener.accept()
+            except OSError:
+                return
+            connections.append(conn)
+            threading.Thread(target=drain, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield listener.getsockname()
+
+    listener.close()
+    for conn in connections:
+        conn.close()
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from Common import *
+from AsyncClient import AsyncClient
+
+
+def test_query_matches_client(server, client, queries):
+    expected = client.query(queries, verbose=False)
+    (host, port) = server.server_address[:2]
+
+    async def run():
+        async_client = AsyncClient()
+        await async_client.open(host, port, 'apikey')
+        await async_client.set_distance_mode(DistanceMode.L1)
+        await async_client.set_query_mode(QueryMode.KNN_A)
+        await async_client.set_read_count(5)
+        try:
+            return await async_client.query(queries, batch_size=64, window=3)
+        finally:
+            await async_client.close()
+
+    results = asyncio.run(run())
+    assert (results.records == expected.records).all()
+    assert (results.counts == expected.counts).all()
+
+
+def test_read_error_fails_pending_requests(hung_server):
+    # Any error reading responses fails the requests waiting for them.
+    (host, port) = hung_server
+
+    async def run():
+        async_client = AsyncClient()
+        await async_client.open(host, port, 'apikey')
+
+        pending = asyncio.ensure_future(async_client.get_timer_value())
+        await asyncio.sleep(0.05)
+        async_client.reader.set_exception(TimeoutError(110, 'Connection timed out'))
+
+        try:
+            with pytest.raises(IOError, match='Read error'):
+                await asyncio.wait_for(pending, timeout=5)
+        finally:
+            async_client.writer.close()
+
+    asyncio.run(run())
+
+
+def test_query_rejects_empty_window(server):
+    (host, port) = server.server_address[:2]
+
+    async def run():
+        async_client = AsyncClient()
+        await async_client.open(host, port, 'apikey')
+        try:
+            with pytest.raises(ValueError, match='Invalid argument'):
+                await asyncio.wait_for(async_client.query([[1, 2], [3, 4]], window=0), timeout=5)
+        finally:
+            await async_client.close()
+
+    asyncio.run(run())
+
+
+def test_rejected_settings_are_not_kept(server, client, queries):
+    expected = client.query(queries[:6], verbose=False)
+    (host, port) = server.server_address[:2]
+
+    async def run():
+        async_client = AsyncClient()
+        await async_client.open(host, port, 'apikey')
+        try:
+            await async_client.set_distance_mode(DistanceMode.L1)
+            await async_client.set_query_mode(QueryMode.KNN_A)
+            await async_client.set_read_count(5)
+
+            with pytest.raises(SearchError):
+                await async_client.set_read_count(0)
+            with pytest.raises(SearchError):
+                await async_client.set_query_mode(99)
+
+            assert async_client.session.read_count == 5
+            assert async_client.session.query_mode == QueryMode.KNN_A
+            return await async_client.query(queries[5])
+        finally:
+            await async_client.close()
+
+    assert (asyncio.run(run()) == expected[5]).all()
@@ -0,0 +1,124 @@
+import threading
+
+import numpy as np
+import pytest
+
+import Engine
+
+
+def test_ds_load_from_raw_file(client, dataset, queries, tmp_path):
+    expected = client.query(queries, verbose=False)
+
+    path = str(tmp_path / 'dataset.u8')
+    dataset.tofile(path)
+    client.reset()
+    client.ds_load_from_file(path, dims=dataset.shape[1])
+
+    assert (client.query(queries, verbose=False).records == expected.records).all()
+
+
+def test_ds_load_from_raw_file_needs_dims(client, dataset, tmp_path):
+    path = str(tmp_path / 'dataset.u8')
+    dataset.tofile(path)
+
+    with pytest.raises(ValueError, match='Invalid argument'):
+        client.ds_load_from_file(path)
+
+
+def test_query_iter_source_error(client, queries):
+    # An error reading the queries is raised as it is, rather than taken
+    # for a connection failure.
+    def blocks():
+        yield queries[:30]
+        yield queries[30:60]
+        raise OSError('Read error.')
+
+    received = []
+    outcome = []
+
+    def run():
+        try:
+            for (offset, results) in client.query_iter(blocks(), batch_size=30, window=2):
+                received.append(offset)
+        except Exception as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert isinstance(outcome[0], OSError) and str(outcome[0]) == 'Read error.'
+    assert received == [0, 30]
+
+    # The connection is still in step.
+    expected = client.query(queries[:6], verbose=False)
+    assert (client.query(queries[5]) == expected[5]).all()
+
+
+@pytest.fixture
+def short_batch(monkeypatch):
+    # The first mini-batch searched returns the results of one query too
+    # few.
+    search = Engine.search
+    calls = []
+
+    def short_search(dataset, queries, session, packed=False):
+        (records, indptr) = search(dataset, queries, session, packed=packed)
+        calls.append(len(queries))
+        if len(calls) == 1:
+            (records, indptr) = (records[:indptr[-2]], indptr[:-1])
+        return (records, indptr)
+
+    monkeypatch.setattr(Engine, 'search', short_search)
+
+
+def test_query_result_count_mismatch(client, queries, short_batch):
+    with pytest.raises(IOError, match='Mini batch'):
+        client.query(queries, batch_size=50, verbose=False, window=3)
+
+    # The responses to the other mini-batches were received.
+    expected = client.query(queries[:6], verbose=False)
+    assert (client.query(queries[5]) == expected[5]).all()
+
+
+def test_query_iter_result_count_mismatch(client, queries, short_batch):
+    with pytest.raises(IOError, match='Mini batch'):
+        for (offset, results) in client.query_iter([queries], batch_size=50, window=3):
+            pass
+
+    expected = client.query(queries[:6], verbose=False)
+    assert (client.query(queries[5]) == expected[5]).all()
+
+
+@pytest.mark.parametrize('args', [{'window': 0}, {'batch_size': 0}])
+def test_query_rejects_empty_window(client, queries, args):
+    with pytest.raises(ValueError, match='Invalid argument'):
+        client.query(queries, verbose=False, **args)
+
+
+def test_ds_load_stream(client, dataset, queries, tmp_path):
+    expected = client.query(queries, verbose=False)
+
+    path = str(tmp_path / 'dataset.u8')
+    dataset.tofile(path)
+    source = np.memmap(path, dtype=np.uint8, mode='r', shape=dataset.shape)
+
+    client.reset()
+    client.ds_load_stream(source, chunk_size=1000, verbose=False)
+    assert (client.query(queries, verbose=False).records == expected.records).all()
+
+    client.reset()
+    client.ds_load_stream(np.array_split(dataset, 7), n_vectors=len(dataset), verbose=False)
+    assert (client.query(queries, verbose=False).records == expected.records).all()
+
+
+def test_ds_load_stream_short(client, dataset, queries):
+    expected = client.query(queries[:6], verbose=False)
+
+    with pytest.raises(IOError, match='ended after 400 vectors'):
+        client.ds_load_stream([dataset[:200], dataset[200:400]], n_vectors=len(dataset), verbose=False)
+
+    # The connection was closed, and the next request reconnects.
+    assert (client.query(queries[5]) == expected[5]).all()
@@ -0,0 +1,40 @@
+import pytest
+
+from Common import *
+from ClientPool import ClientPool
+
+
+@pytest.fixture
+def pool(server, dataset):
+    (host, port) = server.server_address[:2]
+
+    pool = ClientPool(3, retry_delay=0.01)
+    pool.open(host, port, 'apikey')
+    pool.set_distance_mode(DistanceMode.L1)
+    pool.set_query_mode(QueryMode.KNN_A)
+    pool.set_read_count(5)
+    pool.ds_load(dataset)
+    yield pool
+    pool.close()
+
+
+@pytest.mark.parametrize('window', [1, 2, 4])
+def test_query_matches_client(client, pool, queries, window):
+    expected = client.query(queries, verbose=False)
+    results = pool.query(queries, batch_size=32, window=window)
+
+    assert (results.records == expected.records).all()
+    assert (pool.query(queries[7]) == expected[7]).all()
+
+
+def test_threshold_query_matches_client(client, pool, queries):
+    for c in (client, pool):
+        c.set_query_mode(QueryMode.LT)
+        c.set_threshold(1500)
+
+    expected = client.query(queries, verbose=False)
+    results = pool.query(queries, batch_size=32, window=2)
+
+    assert 0 < expected.records.size < len(queries) * 500
+    assert (results.indptr == expected.indptr).all()
+    assert (results.records == expected.records).all()
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from Common import *
+
+
+def test_as_components_converts_whole_floats():
+    components = as_components([[1.0, 2.0], [255.0, 0.0]])
+
+    assert components.dtype == np.uint8
+    assert components.tolist() == [[1, 2], [255, 0]]
+
+
+def test_as_components_keeps_arrays_in_format():
+    vectors = np.arange(12, dtype=np.uint16).reshape(3, 4)
+
+    assert as_components(vectors) is vectors
+
+
+@pytest.mark.parametrize('vectors', [[1.7, 2.0], [[0.0, 0.5]], [np.nan], np.array([3.25], dtype=np.float32)])
+def test_as_components_rejects_fractions(vectors):
+    with pytest.raises(ValueError, match='Invalid argument'):
+        as_components(vectors)
+
+
+@pytest.mark.parametrize('vectors, component_type', [([256], ComponentType.UINT8), ([-1], ComponentType.UINT8),
+                                                     ([70000.0], ComponentType.UINT16)])
+def test_as_components_rejects_out_of_range(vectors, component_type):
+    with pytest.raises(ValueError):
+        as_components(vectors, component_type)
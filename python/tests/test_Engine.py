@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from Common import *
+from Client import Session
+import Engine
+
+
+@pytest.mark.parametrize('distance_mode', [DistanceMode.L1, DistanceMode.LMAX, DistanceMode.HAMMING,
+                                           DistanceMode.BIT_AND, DistanceMode.BIT_OR, DistanceMode.JACCARD])
+@pytest.mark.parametrize('query_mode', [QueryMode.KNN_A, QueryMode.KNN_D])
+def test_packed_bits_match_unpacked(distance_mode, query_mode):
+    # 70 components don't fill the last byte, or the 8 byte alignment.
+    rng = np.random.RandomState(4)
+    dataset = rng.randint(0, 2, size=(300, 70)).astype(np.uint8)
+    queries = rng.randint(0, 2, size=(40, 70)).astype(np.uint8)
+
+    session = Session()
+    session.set_distance_mode(distance_mode)
+    session.set_query_mode(query_mode)
+    session.set_read_count(10)
+
+    (records, indptr) = Engine.search(dataset, queries, session)
+    (packed_records, packed_indptr) = Engine.search(Engine.pack_bits(dataset), Engine.pack_bits(queries),
+                                                    session, packed=True)
+
+    assert (packed_indptr == indptr).all()
+    assert (packed_records == records).all()
+
+
+def test_pack_bits():
+    bits = np.zeros((2, 12), dtype=bool)
+    bits[0, 0] = bits[1, 11] = True
+
+    packed = Engine.pack_bits(bits)
+
+    assert packed.shape == (2, Engine.PACK_ALIGNMENT)
+    assert packed[:, :2].tolist() == [[0x80, 0x00], [0x00, 0x10]]
+    assert not packed[:, 2:].any()
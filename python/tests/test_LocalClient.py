@@ -0,0 +1,48 @@
+import pytest
+
+from Common import *
+from LocalClient import LocalClient
+
+
+@pytest.fixture
+def local(dataset):
+    local = LocalClient(threads=2)
+    local.open()
+    local.set_distance_mode(DistanceMode.L1)
+    local.set_query_mode(QueryMode.KNN_A)
+    local.set_read_count(5)
+    local.ds_load(dataset)
+    yield local
+    local.close()
+
+
+@pytest.mark.parametrize('query_mode', [QueryMode.KNN_A, QueryMode.KNN_D, QueryMode.LT, QueryMode.RANGE])
+def test_query_matches_client(client, local, queries, query_mode):
+    for c in (client, local):
+        c.set_query_mode(query_mode)
+        if query_mode == QueryMode.RANGE:
+            c.set_threshold_range(1200, 1400)
+        else:
+            c.set_threshold(1500)
+
+    expected = client.query(queries, verbose=False)
+    results = local.query(queries, batch_size=64)
+
+    assert type(results) is type(expected)
+    assert (results.records == expected.records).all()
+    assert (results.counts == expected.counts).all()
+    assert (local.query(queries[3]) == client.query(queries[3])).all()
+
+
+def test_query_iter_matches_client(client, local, queries):
+    expected = client.query(queries, verbose=False)
+
+    for (offset, results) in local.query_iter([queries[:100], queries[100:]], batch_size=64):
+        assert (results.records == expected.records[offset:offset + len(results)]).all()
+
+
+def test_errors_match_client(client, local):
+    for c in (client, local):
+        with pytest.raises(SearchError) as error:
+            c.set_read_count(0)
+        assert error.value.status == Status.READ_COUNT_NOT_SUPPORTED
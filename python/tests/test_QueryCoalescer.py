@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+import pytest
+
+from Common import *
+from ClientPool import ClientPool
+from QueryCoalescer import QueryCoalescer
+
+
+@pytest.fixture
+def pool(server, dataset):
+    (host, port) = server.server_address[:2]
+
+    pool = ClientPool(2, retry_delay=0.01)
+    pool.open(host, port, 'apikey')
+    pool.set_distance_mode(DistanceMode.L1)
+    pool.set_query_mode(QueryMode.KNN_A)
+    pool.set_read_count(5)
+    pool.ds_load(dataset)
+    yield pool
+    pool.close()
+
+
+def test_queries_from_threads_match_client(client, pool, queries):
+    expected = client.query(queries, verbose=False)
+    results = [None] * len(queries)
+
+    with QueryCoalescer(pool, max_batch=32, max_wait=0.01, threads=2) as coalescer:
+        def run(rows):
+            for i in rows:
+                results[i] = coalescer.query(queries[i])
+
+        threads = [threading.Thread(target=run, args=(range(j, len(queries), 8),)) for j in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    for i in range(len(queries)):
+        assert (results[i] == expected[i]).all()
+
+    # The queries were sent in batches.
+    assert coalescer.queries == len(queries)
+    assert coalescer.batches < len(queries)
+
+
+def test_query_async_matches_client(client, queries):
+    expected = client.query(queries[:50], verbose=False)
+
+    async def run(coalescer):
+        return await asyncio.gather(*[coalescer.query_async(vector) for vector in queries[:50]])
+
+    with QueryCoalescer(client, max_wait=0.01) as coalescer:
+        results = asyncio.run(run(coalescer))
+
+    for i in range(50):
+        assert (results[i] == expected[i]).all()
+
+
+def test_errors_go_to_their_queries(client, queries):
+    with QueryCoalescer(client, max_wait=0.01) as coalescer:
+        good = coalescer.submit(queries[0])
+        bad = coalescer.submit(queries[1][:8])
+
+        assert len(good.result()) == 5
+        with pytest.raises(SearchError):
+            bad.result()
+
+    with pytest.raises(IOError, match='closed'):
+        coalescer.submit(queries[0])
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from Common import *
+from ReplicaClient import ReplicaClient
+from StandInServer import StandInServer
+
+
+def open_replicas(endpoints, dataset, **kwargs):
+    client = ReplicaClient([(host, port, 'apikey') for (host, port) in endpoints], **kwargs)
+    client.open()
+    client.set_distance_mode(DistanceMode.L1)
+    client.set_query_mode(QueryMode.KNN_A)
+    client.set_read_count(5)
+    client.ds_load(dataset)
+    return client
+
+
+def test_replicas_match_client(client, server, dataset, queries):
+    expected = client.query(queries, verbose=False)
+
+    other = StandInServer(api_key='apikey')
+    other.start()
+    try:
+        replicas = open_replicas([server.server_address[:2], other.server_address[:2]], dataset)
+        assert (replicas.query(queries, 64, False).records == expected.records).all()
+        assert (replicas.query(queries, 32, False, 3).records == expected.records).all()
+        for i in range(20):
+            assert (replicas.query(queries[i]) == expected[i]).all()
+        assert sum(stats['requests'] for stats in replicas.stats()) >= 20
+        replicas.close()
+    finally:
+        other.stop()
+
+
+def test_hung_replica_times_out_and_is_ejected(client, server, hung_server, dataset, queries):
+    expected = client.query(queries, verbose=False)
+
+    replicas = open_replicas([hung_server, server.server_address[:2]], dataset, timeout=0.2, eject_after=1,
+                             eject_time=60.0)
+
+    assert (replicas.query(queries, batch_size=64).records == expected.records).all()
+    for i in range(5):
+        assert (replicas.query(queries[i]) == expected[i]).all()
+
+    stats = replicas.stats()
+    assert not stats[0]['healthy']
+    assert stats[1]['healthy'] and stats[1]['errors'] == 0
+    replicas.close()
+
+
+def test_readmitted_replica_is_reopened(client, server, dataset, queries):
+    expected = client.query(queries, verbose=False)
+
+    other = StandInServer(api_key='apikey')
+    other.start()
+    try:
+        replicas = open_replicas([server.server_address[:2], other.server_address[:2]], dataset, hedge=False)
+
+        # Queries made while the replica's connections are replaced all
+        # complete.
+        def run():
+            for i in range(40):
+                assert (replicas.query(queries[i]) == expected[i]).all()
+
+        threads = [threading.Thread(target=run) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(5):
+            replicas.eject(0, 0.0)
+            replicas.replicas[0].needs_open = True
+        for thread in threads:
+            thread.join()
+
+        assert all(stats['errors'] == 0 for stats in replicas.stats())
+        replicas.close()
+    finally:
+        other.stop()
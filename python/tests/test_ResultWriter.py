@@ -0,0 +1,74 @@
+import socket
+
+import numpy as np
+import pytest
+
+import ResultWriter
+
+
+def test_npy_writer(client, queries, tmp_path):
+    expected = client.query(queries, verbose=False)
+
+    path = str(tmp_path / 'results.npy')
+    with ResultWriter.open_writer(path, len(queries), 5) as writer:
+        writer.put_all(client.query_iter(queries, batch_size=64))
+
+    assert (np.load(path) == expected.records).all()
+
+    with ResultWriter.open_writer(path, len(queries), 5, resume=True) as writer:
+        assert writer.remaining() == []
+
+
+def test_nvx_is_not_a_result_format(tmp_path):
+    with pytest.raises(ValueError, match='Invalid argument'):
+        ResultWriter.open_writer(str(tmp_path / 'results.nvx'), 10, 5)
+
+
+class DroppingSource:
+    """
+    Queries which drop the client's connection the first time the rows
+    from 'at' are read.
+    """
+
+    def __init__(self, queries, client, at):
+        self.queries = queries
+        self.client = client
+        self.at = at
+        self.shape = queries.shape
+        self.dtype = queries.dtype
+
+    def __getitem__(self, index):
+        if self.client is not None and index.start >= self.at:
+            self.client.sock.shutdown(socket.SHUT_RDWR)
+            self.client = None
+        return self.queries[index]
+
+
+def test_query_resumable_survives_dropped_connection(client, server, queries, tmp_path):
+    expected = client.query(queries, verbose=False)
+
+    # The dataset is reloaded after reconnecting.
+    server.load_dataset(np.zeros((5, 16), dtype=np.uint8))
+    client.sock.shutdown(socket.SHUT_RDWR)
+
+    path = str(tmp_path / 'results.npy')
+    source = DroppingSource(queries, client, 150)
+    with ResultWriter.open_writer(path, len(queries), 5) as writer:
+        client.query_resumable(source, writer, batch_size=30, retry_delay=0.01, verbose=False)
+
+    assert source.client is None
+    assert (np.load(path) == expected.records).all()
+
+
+def test_query_resumable_resumes(client, queries, tmp_path):
+    expected = client.query(queries, verbose=False)
+
+    path = str(tmp_path / 'results.npy')
+    with ResultWriter.open_writer(path, len(queries), 5) as writer:
+        writer.put(0, expected[:100])
+
+    with ResultWriter.open_writer(path, len(queries), 5, resume=True) as writer:
+        assert writer.remaining() == [(100, len(queries))]
+        client.query_resumable(queries, writer, batch_size=30, verbose=False)
+
+    assert (np.load(path) == expected.records).all()
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from Common import *
+from ShardedClient import ShardedClient
+import Results
+from StandInServer import StandInServer
+
+
+@pytest.fixture
+def shards(dataset):
+    servers = [StandInServer(api_key='apikey') for i in range(3)]
+    for server in servers:
+        server.start()
+
+    shards = ShardedClient([server.server_address[:2] + ('apikey',) for server in servers])
+    shards.open()
+    shards.set_distance_mode(DistanceMode.L1)
+    shards.set_query_mode(QueryMode.KNN_A)
+    shards.set_read_count(5)
+    shards.ds_load(dataset)
+    yield shards
+
+    shards.close()
+    for server in servers:
+        server.stop()
+
+
+@pytest.mark.parametrize('query_mode', [QueryMode.KNN_A, QueryMode.KNN_D])
+def test_knn_matches_client(client, shards, queries, query_mode):
+    for c in (client, shards):
+        c.set_query_mode(query_mode)
+
+    expected = client.query(queries, verbose=False)
+    results = shards.query(queries, batch_size=64, verbose=False)
+
+    assert shards.offsets == [0, 167, 334]
+    assert (results.records == expected.records).all()
+    assert (results.counts == expected.counts).all()
+    assert (shards.query(queries[3]) == expected[3]).all()
+
+
+def test_threshold_matches_client(client, shards, queries):
+    for c in (client, shards):
+        c.set_query_mode(QueryMode.LT)
+        c.set_threshold(1500)
+
+    expected = client.query(queries, verbose=False)
+    results = shards.query(queries, batch_size=64, verbose=False)
+
+    assert 0 < expected.records.size
+    assert (results.indptr == expected.indptr).all()
+    assert (results.records == expected.records).all()
+    assert (shards.query(queries[3]) == expected[3]).all()
+
+
+def test_merge_breaks_ties_by_ds_id():
+    # Both shards return distance 7 for their vector 0, which is ds_id 0 on
+    # the first and 10 on the second.
+    def part(ds_ids, distances):
+        records = np.zeros((1, len(ds_ids)), dtype=RESULT_DTYPE)
+        records['ds_id'] = ds_ids
+        records['distance'] = distances
+        return Results.ResultSet(records)
+
+    parts = [part([0, 1], [7, 9]), part([0, 1], [7, 8])]
+    results = Results.merge(QueryMode.KNN_A, parts, [0, 10], k=3)
+
+    assert results.ids.tolist() == [[0, 10, 11]]
+    assert results.distances.tolist() == [[7, 7, 8]]
@@ -0,0 +1,86 @@
+import socket
+import time
+
+import numpy as np
+
+from Common import *
+import Results
+
+
+def l1_distances(queries, dataset):
+    return np.abs(queries[:, np.newaxis, :].astype(np.int64) - dataset[np.newaxis, :, :]).sum(axis=2)
+
+
+def knn(queries, dataset, k):
+    # ds_ids of the k nearest vectors, nearest first and then by ds_id.
+    distances = l1_distances(queries, dataset)
+    return np.argsort(distances, axis=1, kind='stable')[:, :k]
+
+
+def test_single_query(client, dataset, queries):
+    result = client.query(queries[0])
+
+    assert list(result['ds_id']) == list(knn(queries[:1], dataset, 5)[0])
+    assert list(result['distance']) == sorted(l1_distances(queries[:1], dataset)[0])[:5]
+
+
+def test_batch_query(client, dataset, queries):
+    results = client.query(queries, batch_size=64, verbose=False)
+
+    assert isinstance(results, Results.ResultSet)
+    assert (results.ids == knn(queries, dataset, 5)).all()
+
+
+def test_threshold_query(client, dataset, queries):
+    client.set_query_mode(QueryMode.LT)
+    client.set_threshold(1700)
+
+    results = client.query(queries[:20], verbose=False)
+
+    assert isinstance(results, Results.SparseResultSet)
+    distances = l1_distances(queries[:20], dataset)
+    for i in range(20):
+        assert list(results[i]['ds_id']) == list(np.nonzero(distances[i] < 1700)[0])
+        assert list(results[i]['distance']) == list(distances[i][distances[i] < 1700])
+
+
+def test_pipelined_query(client, server, queries):
+    expected = client.query(queries, batch_size=30, verbose=False)
+
+    server.latency = 0.05
+    t0 = time.time()
+    serial = client.query(queries, batch_size=30, verbose=False, window=1)
+    serial_time = time.time() - t0
+
+    t0 = time.time()
+    pipelined = client.query(queries, batch_size=30, verbose=False, window=4)
+    pipelined_time = time.time() - t0
+
+    assert (serial.records == expected.records).all()
+    assert (pipelined.records == expected.records).all()
+
+    # Ten mini-batches: 0.5 s one at a time, and about a quarter of that
+    # four at a time.
+    assert serial_time >= 0.5
+    assert pipelined_time < 0.6 * serial_time
+
+
+def test_reconnect_after_dropped_connection(client, queries):
+    expected = client.query(queries, batch_size=30, verbose=False)
+
+    client.sock.shutdown(socket.SHUT_RDWR)
+    assert (client.query(queries, batch_size=30, verbose=False, window=4).records == expected.records).all()
+
+    # The settings were made again on the new connection.
+    client.sock.shutdown(socket.SHUT_RDWR)
+    assert (client.query(queries[7]) == expected[7]).all()
+
+
+def test_error_status_leaves_connection_usable(client, queries):
+    try:
+        client.set_query_mode(0x1234)
+        assert False
+    except SearchError as e:
+        assert e.status == Status.QUERY_MODE_NOT_SUPPORTED
+
+    assert len(client.query(queries[0])) == 5
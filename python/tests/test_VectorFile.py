@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from Common import *
+import VectorFile
+
+
+def test_round_trip(dataset, tmp_path):
+    path = str(tmp_path / 'dataset.nvx')
+    ids = np.arange(len(dataset), dtype=np.uint64) * 3
+    labels = np.arange(len(dataset) * 2).reshape(-1, 2) - 7
+    VectorFile.write(path, dataset, ids=ids, labels=labels)
+
+    with VectorFile.VectorFile(path, verify=True) as vf:
+        assert vf.shape == dataset.shape
+        assert vf.component_type == ComponentType.UINT8
+        assert (vf.vectors == dataset).all()
+        assert (vf.ids == ids).all()
+        assert (vf.labels == labels).all()
+        assert (vf[10:20] == dataset[10:20]).all()
+
+    assert (VectorFile.read(path) == dataset).all()
+
+
+def test_packed_bits_round_trip(tmp_path):
+    bits = np.random.RandomState(2).randint(0, 2, size=(50, 20)).astype(bool)
+    path = str(tmp_path / 'bits.nvx')
+    VectorFile.write(path, bits, component_type=ComponentType.BIT)
+
+    with VectorFile.VectorFile(path, verify=True) as vf:
+        assert (vf.dims, vf.count, vf.packed) == (20, 50, True)
+        assert vf.component_type == ComponentType.BIT
+        assert (vf.vectors == np.packbits(bits, axis=1)).all()
+
+
+def test_verify_detects_corruption(dataset, tmp_path):
+    path = str(tmp_path / 'dataset.nvx')
+    VectorFile.write(path, dataset)
+
+    with open(path, 'r+b') as f:
+        f.seek(VectorFile.HEADER_SIZE + 100)
+        f.write(b'\xff' if dataset[6, 4] != 255 else b'\0')
+
+    VectorFile.VectorFile(path).close()
+    with pytest.raises(IOError, match='checksum'):
+        VectorFile.VectorFile(path, verify=True)
+
+
+def test_packed_bits_file_matches_client(client, tmp_path):
+    rng = np.random.RandomState(3)
+    bits = rng.randint(0, 2, size=(200, 64)).astype(bool)
+    queries = rng.randint(0, 2, size=(20, 64)).astype(bool)
+
+    client.set_distance_mode(DistanceMode.HAMMING)
+    client.ds_load(bits, ComponentType.BIT)
+    expected = client.query(queries, verbose=False, component_type=ComponentType.BIT)
+
+    path = str(tmp_path / 'bits.nvx')
+    VectorFile.write(path, bits, component_type=ComponentType.BIT)
+    client.reset()
+    client.ds_load_from_file(path)
+
+    results = client.query(queries, verbose=False, component_type=ComponentType.BIT)
+    assert (results.records == expected.records).all()